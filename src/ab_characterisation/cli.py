@@ -1,8 +1,13 @@
-from mpi4py import MPI
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
+
 import typer
 
+from ab_characterisation.developability_tools.tap.structure_annotation import SASA_ENGINES
 from ab_characterisation.pipeline_orchestration import RunConfig, pipeline
+from ab_characterisation.utils.data_classes import BACKENDS
+from ab_characterisation.utils.result_cache import ResultCache
 
 app = typer.Typer(
     name="ab-characterisation-pipeline",
@@ -10,6 +15,15 @@ app = typer.Typer(
 )
 
 
+def _one_of(choices: tuple[str, ...]):
+    """Returns an option callback that rejects values other than the given choices before the pipeline starts."""
+    def validate(value: str) -> str:
+        if value not in choices:
+            raise typer.BadParameter(f"expected one of {', '.join(choices)}, got {value}.")
+        return value
+    return validate
+
+
 @app.command()
 def run_pipeline(
     input_file: str = typer.Option(..., help='Input .csv file, containing sequence_name, heavy_sequence, light_sequence '
@@ -17,11 +31,67 @@ def run_pipeline(
     chimera_resolution: float = typer.Option(6.0, help='Resolution of the map used for alignment within ChimeraX.'),
     output_dir: str = typer.Option("./ab_characterisation_output", help='Directory to which output files are written.'),
     rosetta_replicates: int = typer.Option(1, help='How many replicates to run for Rosetta characterisation steps.'),
+    rosetta_slots: Optional[int] = typer.Option(None, help='How many Rosetta replicates each worker process runs at '
+                                                          'once. Defaults to the CPU cores of the node divided by the '
+                                                          'number of worker processes on it.'),
+    rosetta_batch_size: int = typer.Option(1, help='Number of antibodies scored by each Rosetta run. Larger batches '
+                                                   'load the Rosetta database and protocol once for all their inputs '
+                                                   'and replicates. Ignored with --streaming.'),
+    rosetta_worker_pool: bool = typer.Option(False, help='If provided, Rosetta jobs are run by a pool of PyRosetta '
+                                                         'processes started once per worker process, rather than by a '
+                                                         'rosetta_scripts process per job. Requires PyRosetta.'),
     rosetta_base_dir: str = typer.Option(..., help='Base directory for the Roestta software suite, e.g. '
                                                    '/path/to/rosetta/rosetta.binary.linux.release-315'),
     top_n: int = typer.Option(10, help='Top N candidate antibodies to provide from the provided .csv file of antibodies'),
     no_complex_analysis: bool = typer.Option(False, help='If provided, the pipeline does not perform antibody-antigen '
-                                                         'complex generation and analysis.')
+                                                         'complex generation and analysis.'),
+    streaming: bool = typer.Option(False, help='If provided, each antibody is run through all pipeline stages '
+                                               'independently, with only the top N selection waiting for all '
+                                               'antibodies to finish.'),
+    backend: str = typer.Option("mpi", callback=_one_of(BACKENDS),
+                                help='Execution backend used to parallelise the pipeline: "mpi" (run under mpiexec), '
+                                     '"process" (local process pool) or "serial".'),
+    workers: Optional[int] = typer.Option(None, help='Number of worker processes used by the "process" backend. '
+                                                     'Defaults to the number of CPU cores.'),
+    distributed_payloads: bool = typer.Option(False, help='If provided with the "mpi" backend, each antibody stays on '
+                                                          'the process that first computed it, and only lightweight '
+                                                          'status is exchanged between pipeline steps.'),
+    checkpoint: bool = typer.Option(False, help='If provided, the state of each antibody is saved to checkpoints/ in the '
+                                                'output directory after every pipeline stage, so that the run can be '
+                                                'resumed with --resume.'),
+    resume: bool = typer.Option(False, help='If provided, resume a previous run in the same output directory, skipping '
+                                            'pipeline stages already completed for each antibody. Implies '
+                                            '--checkpoint.'),
+    cache_dir: Optional[str] = typer.Option(None, help='Directory of a persistent result cache shared between runs. '
+                                                       'Caching is disabled if not provided.'),
+    cache_max_size_gb: Optional[float] = typer.Option(None, help='Maximum size of the result cache; least recently '
+                                                                 'used entries are evicted at the end of the run.'),
+    no_sequence_deduplication: bool = typer.Option(False, help='If provided, sequence-only steps (liabilities, ABB2, '
+                                                               'TAP, antibody-only Rosetta) are run for every row, '
+                                                               'even if its heavy/light sequences are duplicated, and '
+                                                               'complex steps (ChimeraX, complex Rosetta) even if its '
+                                                               'sequences and reference complex are duplicated.'),
+    abb2_batch_size: int = typer.Option(1, help='Number of antibodies whose chains are numbered together in one '
+                                                'ANARCI run before ABodyBuilder2 (batched numbering), and in each '
+                                                'total CDR length check with --tap-early-exit. The ABodyBuilder2 '
+                                                'networks still model one antibody at a time. Ignored with '
+                                                '--streaming.'),
+    tap_sasa_engine: str = typer.Option('psa', callback=_one_of(SASA_ENGINES),
+                                        help='How TAP calculates relative surface areas: with the bundled psa '
+                                             'executable ("psa"), or in-process ("shrake_rupley"). The scores of the '
+                                             'two engines differ slightly and are not interchangeable, so compare '
+                                             'antibodies scored with the same engine only.'),
+    tap_contributions: bool = typer.Option(False, help='If provided, the contribution of each residue and residue pair '
+                                                       'to the TAP metrics is written to tap_contributions/ in the '
+                                                       'output directory, one pair of csv files per antibody.'),
+    tap_early_exit: bool = typer.Option(False, help='If provided, antibodies whose total CDR length is flagged RED are '
+                                                    'discarded from their sequence numbering before ABB2, and TAP '
+                                                    'stops at the first RED metric, checking the cheap metrics first. '
+                                                    'Metrics after a RED one are then not reported.'),
+    keep_relaxed_complexes: bool = typer.Option(False, help='If provided, the relaxed antibody-antigen complexes of the '
+                                                            'top N candidates are written to relaxed_complexes/ in '
+                                                            'the output directory. Otherwise Rosetta only writes '
+                                                            'scores.'),
 ):
     output_dir = Path(output_dir)
     config = RunConfig(
@@ -31,12 +101,56 @@ def run_pipeline(
         rosetta_base_directory=rosetta_base_dir,
         top_n=top_n,
         rosetta_replicates=rosetta_replicates,
+        rosetta_slots=rosetta_slots,
+        rosetta_batch_size=rosetta_batch_size,
+        rosetta_worker_pool=rosetta_worker_pool,
         exclude_complex_analysis=no_complex_analysis,
+        streaming=streaming,
+        backend=backend,
+        workers=workers,
+        distributed_payloads=distributed_payloads,
+        checkpoint=checkpoint,
+        resume=resume,
+        cache_directory=Path(cache_dir) if cache_dir else None,
+        cache_max_size_gb=cache_max_size_gb,
+        deduplicate_sequences=not no_sequence_deduplication,
+        abb2_batch_size=abb2_batch_size,
+        tap_sasa_engine=tap_sasa_engine,
+        tap_contributions=tap_contributions,
+        tap_early_exit=tap_early_exit,
+        keep_relaxed_complexes=keep_relaxed_complexes,
     )
-    comm = MPI.COMM_WORLD
-    rank = comm.Get_rank()
-    size = comm.Get_size()
-    pipeline(config, mpi_rank=rank, mpi_size=size)
+    pipeline(config)
+
+
+cache_app = typer.Typer(
+    name="ab-characterisation-cache",
+    add_completion=False,
+    help="Inspect and prune the persistent result cache of the antibody characterisation pipeline.",
+)
+
+
+@cache_app.command()
+def info(
+    cache_dir: str = typer.Option(..., help='Directory of the result cache.'),
+):
+    """Show the number of entries and total size of the result cache."""
+    entries = ResultCache(Path(cache_dir)).entries()
+    total_size = sum(entry.size for entry in entries)
+    typer.echo(f"{len(entries)} entries, {total_size / 1024**3:.3f} GB")
+    if entries:
+        typer.echo(f"Least recently used: {datetime.fromtimestamp(entries[0].last_used):%Y-%m-%d %H:%M:%S}")
+        typer.echo(f"Most recently used: {datetime.fromtimestamp(entries[-1].last_used):%Y-%m-%d %H:%M:%S}")
+
+
+@cache_app.command()
+def prune(
+    cache_dir: str = typer.Option(..., help='Directory of the result cache.'),
+    max_size_gb: float = typer.Option(..., help='Size to prune the cache to, evicting least recently used entries.'),
+):
+    """Evict least recently used entries until the result cache is below the given size."""
+    evicted = ResultCache(Path(cache_dir)).prune(int(max_size_gb * 1024**3))
+    typer.echo(f"Evicted {evicted} entries.")
 
 
 if __name__ == "__main__":
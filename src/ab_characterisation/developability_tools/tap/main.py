@@ -1,16 +1,28 @@
+import os
 import sys
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
 
+import pandas as pd
 from loguru import logger
 
 from ab_characterisation.developability_tools.tap.definitions import colour_dict
 from ab_characterisation.developability_tools.tap.metrics import (
     HydrophobicPatchScoreCalculator, NegativePatchScoreCalculator,
     PositivePatchScoreCalculator, SFvCSPCalculator, TotalCDRLengthCalculator)
-from ab_characterisation.developability_tools.tap.metrics.base_calculator import MetricResult
-from ab_characterisation.developability_tools.tap.outputs import write_output_file
-from ab_characterisation.developability_tools.tap.structure_annotation import \
-    StructureAnnotator
+from ab_characterisation.developability_tools.tap.metrics.base_calculator import (
+    MetricResult, PatchScoreCalculator, calculate_patch_score_contributions,
+    calculate_patch_scores, update_patch_scores)
+from ab_characterisation.developability_tools.tap.outputs import (
+    BATCH_OUTPUT_HEADER, format_batch_output_rows, write_contribution_files,
+    write_output_file)
+from ab_characterisation.developability_tools.tap.structure_annotation import (
+    AnnotatedStructure, StructureAnnotator)
+from ab_characterisation.utils.structure_utils import (StructureArrays,
+                                                      read_structure)
 
 logger.remove()
 logger.add(sys.stderr, format="{message}")
@@ -20,6 +32,11 @@ def run_tap(
     modelfile: str,
     outfile: Optional[str],
     quiet: bool = False,
+    sasa_engine: str = "psa",
+    annotator: Optional[StructureAnnotator] = None,
+    structure: Optional[StructureArrays] = None,
+    contributions_prefix: Optional[str] = None,
+    stop_on_red: bool = False,
 ) -> list[MetricResult]:
     """
     Main function to calculate TAP metrics for a pre-generated ABodyBuilder2 model.
@@ -31,27 +48,257 @@ def run_tap(
             This should be a model created by ABodyBuilder2, and should be already IMGT numbered.
         outfile: the output path where results should be written.
         quiet: suppresses all log messages if set to True.
+        sasa_engine: how relative surface areas are calculated: with the bundled psa executable ("psa"), or
+            in-process ("shrake_rupley"). Ignored if an annotator is given.
+        annotator: the StructureAnnotator used to annotate the model, to reuse one across many models.
+        structure: the model, if it is already in memory; the model file is then only read by psa.
+        contributions_prefix: if given, the contributions of each residue and residue pair to the metrics are written
+            to {contributions_prefix}_residues.csv and {contributions_prefix}_pairs.csv.
+        stop_on_red: calculate the cheap metrics (total CDR length, then SFvCSP) first, and stop as soon as one gets a
+            RED flag, for callers that only need to know whether any metric is RED. The results then only hold the
+            metrics calculated, and no contributions are written.
     """
+    if annotator is None:
+        annotator = StructureAnnotator(sasa_engine=sasa_engine)
+    if structure is None:
+        structure = read_structure(modelfile)
 
-    structure = StructureAnnotator().load_and_annotate_structure(modelfile)
-
-    # Calculate the 5 metrics
-    results = []
-    for calculator in [
-        HydrophobicPatchScoreCalculator,
-        NegativePatchScoreCalculator,
-        PositivePatchScoreCalculator,
-        SFvCSPCalculator,
-        TotalCDRLengthCalculator,
-    ]:
-        results.append(calculator(quiet=quiet).calculate(structure))  # type: ignore
+    contributions = None
+    if stop_on_red:
+        # Cheapest metrics first: the total CDR length only needs the IMGT numbering, and SFvCSP does not need the
+        # patch scores
+        results = [
+            TotalCDRLengthCalculator(quiet=quiet).calculate_from_numbering(
+                structure.chain_ids, structure.residue_numbers
+            )
+        ]
+        if results[0].flag != "RED":
+            annotated_structure = annotator.annotate_structure(structure, structure_path=modelfile)
+            results.insert(0, SFvCSPCalculator(quiet=quiet).calculate(annotated_structure))
+            if results[0].flag != "RED":
+                patch_results, contributions = calculate_patch_score_contributions(
+                    _patch_score_calculators(quiet), annotated_structure
+                )
+                results = patch_results + results
+    else:
+        annotated_structure = annotator.annotate_structure(structure, structure_path=modelfile)
+        # Calculate the 5 metrics, the three patch scores in a single pass over the CDR vicinity
+        results, contributions = calculate_patch_score_contributions(
+            _patch_score_calculators(quiet), annotated_structure
+        )
+        results.extend(_calculate_other_metrics(annotated_structure, quiet))
 
     if outfile:
         write_output_file(results, outfile)
+    if contributions_prefix and contributions is not None:
+        write_contribution_files(annotated_structure, contributions, contributions_prefix)
 
     return results
 
 
+def _patch_score_calculators(quiet: bool) -> list[PatchScoreCalculator]:
+    return [
+        HydrophobicPatchScoreCalculator(quiet=quiet),
+        NegativePatchScoreCalculator(quiet=quiet),
+        PositivePatchScoreCalculator(quiet=quiet),
+    ]
+
+
+def _calculate_other_metrics(structure: AnnotatedStructure, quiet: bool) -> list[MetricResult]:
+    return [
+        calculator(quiet=quiet).calculate(structure)  # type: ignore
+        for calculator in [SFvCSPCalculator, TotalCDRLengthCalculator]
+    ]
+
+
+@dataclass
+class ScoredModel:
+    """A model with its TAP annotation and results, kept in memory to rescore its mutants incrementally."""
+
+    structure: StructureArrays
+    annotated_structure: AnnotatedStructure
+    results: list[MetricResult]
+    annotator: StructureAnnotator
+
+
+def score_model(
+    modelfile: str,
+    quiet: bool = False,
+    sasa_engine: str = "psa",
+    annotator: Optional[StructureAnnotator] = None,
+    structure: Optional[StructureArrays] = None,
+) -> ScoredModel:
+    """
+    Calculates TAP metrics for a model like run_tap, keeping everything needed to rescore its mutants with
+    rescore_mutant.
+
+    Args:
+        modelfile: the path to the input model .pdb file.
+        quiet: suppresses all log messages if set to True.
+        sasa_engine: how relative surface areas are calculated, see run_tap. Mutants are only rescored incrementally
+            with "shrake_rupley"; psa always runs on the whole mutant.
+        annotator: the StructureAnnotator used to annotate the model and its mutants.
+        structure: the model, if it is already in memory.
+    """
+    if annotator is None:
+        annotator = StructureAnnotator(sasa_engine=sasa_engine)
+    if structure is None:
+        structure = read_structure(modelfile)
+    annotated_structure = annotator.annotate_structure(structure, structure_path=modelfile)
+
+    results = calculate_patch_scores(_patch_score_calculators(quiet), annotated_structure)
+    results.extend(_calculate_other_metrics(annotated_structure, quiet))
+    return ScoredModel(
+        structure=structure, annotated_structure=annotated_structure, results=results, annotator=annotator
+    )
+
+
+def rescore_mutant(
+    parent: ScoredModel,
+    modelfile: Optional[str] = None,
+    outfile: Optional[str] = None,
+    quiet: bool = False,
+    structure: Optional[StructureArrays] = None,
+    moved_tolerance: float = 0.0,
+) -> ScoredModel:
+    """
+    Calculates TAP metrics for a mutant of an already scored parent, e.g. a point mutant from affinity maturation.
+    Only the annotations of residues near the atoms that differ from the parent are recalculated, and the patch scores
+    are updated by the change in the terms of the affected residue pairs.
+
+    Args:
+        parent: the scored parent model, from score_model
+        modelfile: the path to the mutant model .pdb file. Must be given unless the structure is.
+        outfile: the output path where results should be written.
+        quiet: suppresses all log messages if set to True.
+        structure: the mutant model, if it is already in memory.
+        moved_tolerance: atoms that moved less than this (in A) from their position in the parent are treated as
+            unchanged. Zero gives the same annotation as scoring the mutant from scratch; a small tolerance keeps
+            refinement noise in models that were not built from the parent structure from making every residue
+            count as changed.
+
+    Returns:
+        the scored mutant, which can itself be the parent of further mutants
+    """
+    if structure is None:
+        structure = read_structure(modelfile)
+    annotated_structure, changed = parent.annotator.annotate_mutant(
+        parent.structure,
+        parent.annotated_structure,
+        structure,
+        structure_path=modelfile,
+        moved_tolerance=moved_tolerance,
+    )
+
+    results = update_patch_scores(
+        _patch_score_calculators(quiet),
+        parent.annotated_structure,
+        parent.results,
+        annotated_structure,
+        changed,
+    )
+    results.extend(_calculate_other_metrics(annotated_structure, quiet))
+
+    if outfile:
+        write_output_file(results, outfile)
+
+    return ScoredModel(
+        structure=structure, annotated_structure=annotated_structure, results=results, annotator=parent.annotator
+    )
+
+
+# StructureAnnotator of a run_tap_batch worker process, created once by _init_batch_worker
+_worker_annotator: Optional[StructureAnnotator] = None
+_worker_quiet: bool = True
+
+
+def _init_batch_worker(sasa_engine: str, quiet: bool) -> None:
+    global _worker_annotator, _worker_quiet
+    _worker_annotator = StructureAnnotator(sasa_engine=sasa_engine)
+    _worker_quiet = quiet
+
+
+def _run_tap_batch_worker(modelfile: str) -> tuple[str, Optional[list[MetricResult]]]:
+    """Runs TAP on one model in a worker process. Failures are returned as None so they do not end the batch."""
+    try:
+        return modelfile, run_tap(modelfile, None, quiet=_worker_quiet, annotator=_worker_annotator)
+    except Exception as exc:
+        logger.warning(f"TAP failed for {modelfile}: {exc}")
+        return modelfile, None
+
+
+def iter_tap_batch(
+    model_files: Iterable[str],
+    n_workers: Optional[int] = None,
+    quiet: bool = True,
+    sasa_engine: str = "psa",
+    chunksize: int = 16,
+) -> Iterator[tuple[str, list[MetricResult]]]:
+    """
+    Calculates TAP metrics for many pre-generated ABodyBuilder2 models in a pool of worker processes, each of which
+    reuses a single StructureAnnotator. Results are yielded as they become available, in the order of the input
+    models. Models for which TAP fails are logged and skipped.
+
+    Args:
+        model_files: paths to the input model .pdb files
+        n_workers: number of worker processes; defaults to the number of CPUs
+        quiet: suppresses the per-metric log messages of the workers if set to True.
+        sasa_engine: how relative surface areas are calculated, see run_tap.
+        chunksize: number of models sent to a worker at a time
+
+    Returns:
+        iterator of (model file, list of metric results) tuples
+    """
+    with ProcessPoolExecutor(
+        max_workers=n_workers or os.cpu_count(),
+        initializer=_init_batch_worker,
+        initargs=(sasa_engine, quiet),
+    ) as pool:
+        for modelfile, results in pool.map(_run_tap_batch_worker, model_files, chunksize=chunksize):
+            if results is not None:
+                yield modelfile, results
+
+
+def run_tap_batch(
+    model_files: Iterable[str],
+    n_workers: Optional[int] = None,
+    outfile: Optional[str] = None,
+    quiet: bool = True,
+    sasa_engine: str = "psa",
+) -> pd.DataFrame:
+    """
+    Calculates TAP metrics for many pre-generated ABodyBuilder2 models, e.g. to re-score an existing model directory
+    without running the full pipeline. The results of all models are written to a single csv file, which is appended
+    to as results come in.
+
+    Args:
+        model_files: paths to the input model .pdb files
+        n_workers: number of worker processes; defaults to the number of CPUs
+        outfile: the output path where the combined results should be written.
+        quiet: suppresses the per-metric log messages of the workers if set to True.
+        sasa_engine: how relative surface areas are calculated, see run_tap.
+
+    Returns:
+        DataFrame with a row per model and metric, with columns Model, Metric, Value and Flag
+    """
+    rows = []
+    if outfile:
+        Path(outfile).parent.mkdir(parents=True, exist_ok=True)
+    with open(outfile, "w") if outfile else nullcontext() as outf:
+        if outf is not None:
+            outf.write(BATCH_OUTPUT_HEADER)
+        for modelfile, results in iter_tap_batch(
+            model_files, n_workers=n_workers, quiet=quiet, sasa_engine=sasa_engine
+        ):
+            if outf is not None:
+                outf.write(format_batch_output_rows(modelfile, results))
+            rows.extend(
+                (modelfile, res.metric_name, res.calculated_value, res.flag) for res in results
+            )
+
+    return pd.DataFrame(rows, columns=["Model", "Metric", "Value", "Flag"])
+
+
 def list_metrics() -> list[dict]:
     """
     Returns (and prints) a list of the metrics and their green/amber region definitions.
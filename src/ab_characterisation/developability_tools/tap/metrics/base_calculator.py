@@ -1,10 +1,11 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 
-from Bio import PDB
+import numpy as np
 from loguru import logger
 
 from ab_characterisation.developability_tools.tap.definitions import colour_dict
+from ab_characterisation.developability_tools.tap.structure_annotation import AnnotatedStructure
 
 
 @dataclass
@@ -53,5 +54,195 @@ class BaseMetricCalculator(ABC):
             )
 
     @abstractmethod
-    def calculate(self, annotated_structure: PDB.Structure.Structure) -> MetricResult:
+    def calculate(self, annotated_structure: AnnotatedStructure) -> MetricResult:
         pass
+
+
+class PatchScoreCalculator(BaseMetricCalculator):
+    """
+    Base class for the patch score metrics, which sum w_i * w_j / d_ij**2 over all ordered pairs of neighbouring
+    residues i, j in the CDR vicinity, where w is a residue property and d the minimum distance between the residues.
+    """
+
+    @abstractmethod
+    def pair_weights(
+        self, annotated_structure: AnnotatedStructure, res1: np.ndarray, res2: np.ndarray
+    ) -> np.ndarray:
+        """
+        Returns the weight w_i * w_j of each pair of residues. Pairs with a weight of zero are left out of the score.
+
+        Args:
+            annotated_structure:
+            res1: indices of the first residue of each pair
+            res2: indices of the second residue of each pair
+
+        Returns:
+            array of pair weights
+        """
+
+    def calculate(self, annotated_structure: AnnotatedStructure) -> MetricResult:
+        """
+        Calculates the patch score and assigns a flag colour.
+        Considers residues that are in the CDR vicinity only.
+        The input structure must have been annotated using the
+        ab_characterisation.developability_tools.tap.structure_annotation module.
+        """
+        return calculate_patch_scores([self], annotated_structure)[0]
+
+
+# Python float / float32 is float32 under NumPy 2 promotion rules, and float64 before
+_term_dtype = type(1.0 / np.float32(1.0))
+
+
+@dataclass
+class PatchContributions:
+    """
+    Terms of the patch scores of a structure, one per ordered pair of neighbouring residues in the CDR vicinity.
+    """
+
+    res1: np.ndarray
+    res2: np.ndarray
+    distances: np.ndarray
+    # Term of each pair in each patch score, keyed by metric name; zero for pairs left out of the score
+    terms: dict[str, np.ndarray]
+
+    def residue_contributions(self, n_residues: int) -> dict[str, np.ndarray]:
+        """
+        Returns the contribution of each residue to each patch score: the sum of the terms of the pairs it is the first
+        residue of. As every pair occurs in both orders, the contributions of all residues add up to the score.
+        """
+        return {
+            name: np.bincount(self.res1, weights=terms, minlength=n_residues) for name, terms in self.terms.items()
+        }
+
+
+def _patch_terms(
+    calculator: PatchScoreCalculator,
+    annotated_structure: AnnotatedStructure,
+    res1: np.ndarray,
+    res2: np.ndarray,
+    distances: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns which of the given residue pairs are included in a patch score, and their terms w_i * w_j / d_ij**2.
+    """
+    weights = calculator.pair_weights(annotated_structure, res1, res2)
+    included = weights != 0
+    return included, weights[included].astype(_term_dtype) / (distances[included] ** 2).astype(_term_dtype)
+
+
+def _sum_terms(terms: np.ndarray) -> float:
+    # cumsum adds the terms strictly in order, unlike sum, which uses pairwise summation
+    return np.cumsum(terms)[-1] if len(terms) else 0
+
+
+def _patch_result(calculator: PatchScoreCalculator, score: float) -> MetricResult:
+    result = MetricResult(
+        metric_name=calculator.name,
+        calculated_value=score,
+        flag=calculator.get_flag(score),
+    )
+    calculator.log_result(result)
+    return result
+
+
+def calculate_patch_scores(
+    calculators: list[PatchScoreCalculator], annotated_structure: AnnotatedStructure
+) -> list[MetricResult]:
+    """
+    Calculates several patch scores in one pass over the neighbouring residue pairs in the CDR vicinity.
+    The terms of each score are added in the same order and with the same floating point precision as when
+    accumulating them one by one from Python floats and the float32 distances.
+
+    Args:
+        calculators: the patch score metrics to calculate
+        annotated_structure:
+
+    Returns:
+        the result of each metric, in the same order as the calculators
+    """
+    return calculate_patch_score_contributions(calculators, annotated_structure)[0]
+
+
+def calculate_patch_score_contributions(
+    calculators: list[PatchScoreCalculator], annotated_structure: AnnotatedStructure
+) -> tuple[list[MetricResult], PatchContributions]:
+    """
+    Calculates several patch scores like calculate_patch_scores, also returning the terms that make up the scores.
+
+    Args:
+        calculators: the patch score metrics to calculate
+        annotated_structure:
+
+    Returns:
+        the result of each metric, in the same order as the calculators, and the contributions to the scores
+    """
+    res1, res2, distances = annotated_structure.neighbour_pairs(
+        annotated_structure.in_cdr_vicinity
+    )
+    results = []
+    contributions = PatchContributions(res1=res1, res2=res2, distances=distances, terms={})
+    for calculator in calculators:
+        included, terms = _patch_terms(calculator, annotated_structure, res1, res2, distances)
+        results.append(_patch_result(calculator, _sum_terms(terms)))
+        pair_terms = np.zeros(len(res1), dtype=_term_dtype)
+        pair_terms[included] = terms
+        contributions.terms[calculator.name] = pair_terms
+    return results, contributions
+
+
+def _vicinity_pairs_touching(
+    annotated_structure: AnnotatedStructure, dirty: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns all ordered pairs of neighbouring residues in the CDR vicinity that include a dirty residue."""
+    vicinity = annotated_structure.in_cdr_vicinity
+    rows = np.flatnonzero(dirty & vicinity)
+    cols = np.flatnonzero(vicinity)
+    submatrix = annotated_structure.neighbour_distances[rows][:, cols].tocoo()
+    res1, res2, distances = rows[submatrix.row], cols[submatrix.col], submatrix.data
+    # The pairs (j, i) in which only i is dirty are the mirror images of pairs found above
+    mirrored = ~dirty[res2]
+    return np.r_[res1, res2[mirrored]], np.r_[res2, res1[mirrored]], np.r_[distances, distances[mirrored]]
+
+
+def update_patch_scores(
+    calculators: list[PatchScoreCalculator],
+    parent: AnnotatedStructure,
+    parent_results: list[MetricResult],
+    annotated_structure: AnnotatedStructure,
+    changed: np.ndarray,
+) -> list[MetricResult]:
+    """
+    Calculates the patch scores of a mutant from those of its parent, by subtracting the terms of the residue pairs
+    the mutation affects and adding their new terms. A pair is affected if either residue changed, or moved in or out
+    of the CDR vicinity, or had its hydrophobicity or charge changed by a salt bridge. The result can differ from a
+    full calculation by floating point rounding only.
+
+    Args:
+        calculators: the patch score metrics to calculate
+        parent: the annotated parent structure
+        parent_results: the results of the parent, in the same order as the calculators
+        annotated_structure: the annotated mutant structure, from StructureAnnotator.annotate_mutant
+        changed: mask of the residues that differ between the parent and the mutant
+
+    Returns:
+        the result of each metric, in the same order as the calculators
+    """
+    dirty = (
+        changed
+        | (parent.in_cdr_vicinity != annotated_structure.in_cdr_vicinity)
+        | (parent.hydrophobicity != annotated_structure.hydrophobicity)
+        | (parent.charge != annotated_structure.charge)
+    )
+    parent_pairs = _vicinity_pairs_touching(parent, dirty)
+    pairs = _vicinity_pairs_touching(annotated_structure, dirty)
+
+    results = []
+    for calculator, parent_result in zip(calculators, parent_results):
+        score = (
+            parent_result.calculated_value
+            - _sum_terms(_patch_terms(calculator, parent, *parent_pairs)[1])
+            + _sum_terms(_patch_terms(calculator, annotated_structure, *pairs)[1])
+        )
+        results.append(_patch_result(calculator, score))
+    return results
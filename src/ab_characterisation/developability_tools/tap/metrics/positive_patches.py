@@ -1,49 +1,23 @@
-from Bio import PDB
+import numpy as np
 
-from ab_characterisation.developability_tools.tap.metrics.base_calculator import (
-    BaseMetricCalculator, MetricResult)
+from ab_characterisation.developability_tools.tap.metrics.base_calculator import PatchScoreCalculator
+from ab_characterisation.developability_tools.tap.structure_annotation import AnnotatedStructure
 
 
-class PositivePatchScoreCalculator(BaseMetricCalculator):
+class PositivePatchScoreCalculator(PatchScoreCalculator):
     def __init__(self, quiet: bool = False) -> None:
         self.quiet = quiet
         self.name = "Positive Patch Score"
         self.green_flag_regions = [(0, 1.19)]
         self.amber_flag_regions = [(1.19, 3.58)]
 
-    def calculate(self, annotated_structure: PDB.Structure.Structure) -> MetricResult:
+    def pair_weights(
+        self, annotated_structure: AnnotatedStructure, res1: np.ndarray, res2: np.ndarray
+    ) -> np.ndarray:
         """
-        Calculates the 'patches of positive charge' score (PPC) and assigns a flag colour.
-        Considers residues that are in the CDR vicinity only.
-        The input structure must have been annotated using the
-        ab_characterisation.developability_tools.tap.structure_annotation module.
+        Weights for the 'patches of positive charge' score (PPC): the product of the absolute residue charges, for
+        pairs of positively charged residues only.
         """
-        cdr_vicinity = [
-            res for res in annotated_structure[0].get_residues() if res.in_cdr_vicinity
-        ]
-
-        score = 0
-        for res1 in cdr_vicinity:
-            for res2 in cdr_vicinity:
-                if res1 == res2:
-                    continue
-
-                if res1.charge <= 0 or res2.charge <= 0:
-                    continue
-
-                distance = res1.neighbours.get(res2.get_full_id(), None)
-                if not distance:
-                    continue
-
-                score += (abs(res1.charge) * abs(res2.charge)) / distance**2
-
-        flag = self.get_flag(score)
-
-        result = MetricResult(
-            metric_name=self.name,
-            calculated_value=score,
-            flag=flag,
-        )
-
-        self.log_result(result)
-        return result
+        charge = annotated_structure.charge
+        same_charge = (charge[res1] > 0) & (charge[res2] > 0)
+        return np.where(same_charge, np.abs(charge[res1]) * np.abs(charge[res2]), 0.0)
@@ -1,7 +1,6 @@
-from Bio import PDB
-
 from ab_characterisation.developability_tools.tap.metrics.base_calculator import (
     BaseMetricCalculator, MetricResult)
+from ab_characterisation.developability_tools.tap.structure_annotation import AnnotatedStructure
 
 
 class SFvCSPCalculator(BaseMetricCalculator):
@@ -11,23 +10,18 @@ class SFvCSPCalculator(BaseMetricCalculator):
         self.green_flag_regions = [(-4.20, 100000)]
         self.amber_flag_regions = [(-20.50, -4.20)]
 
-    def calculate(self, annotated_structure: PDB.Structure.Structure) -> MetricResult:
+    def calculate(self, annotated_structure: AnnotatedStructure) -> MetricResult:
         """
         Calculates the 'structural Fv charge symmetry parameter' (SFvCSP) and assigns a flag colour.
         Considers surface residues only.
         The input structure must have been annotated using the
         ab_characterisation.developability_tools.tap.structure_annotation module.
         """
-        h_charge = sum(
-            res.charge
-            for res in annotated_structure[0]["H"].get_residues()
-            if res.is_surface
-        )
-        l_charge = sum(
-            res.charge
-            for res in annotated_structure[0]["L"].get_residues()
-            if res.is_surface
-        )
+        surface_charge = annotated_structure.charge[annotated_structure.is_surface]
+        surface_chains = annotated_structure.chain_ids[annotated_structure.is_surface]
+        # Summed as Python floats, in residue order
+        h_charge = sum(surface_charge[surface_chains == "H"].tolist())
+        l_charge = sum(surface_charge[surface_chains == "L"].tolist())
         sfvcsp = h_charge * l_charge
         flag = self.get_flag(sfvcsp)
 
@@ -1,7 +1,9 @@
-from Bio import PDB
+import numpy as np
 
+from ab_characterisation.developability_tools.tap.definitions import imgt_cdr_definitions
 from ab_characterisation.developability_tools.tap.metrics.base_calculator import (
     BaseMetricCalculator, MetricResult)
+from ab_characterisation.developability_tools.tap.structure_annotation import AnnotatedStructure
 
 
 class TotalCDRLengthCalculator(BaseMetricCalculator):
@@ -11,17 +13,29 @@ class TotalCDRLengthCalculator(BaseMetricCalculator):
         self.green_flag_regions = [(43, 55)]
         self.amber_flag_regions = [(37, 43), (55, 63)]
 
-    def calculate(self, annotated_structure: PDB.Structure.Structure) -> MetricResult:
+    def calculate(self, annotated_structure: AnnotatedStructure) -> MetricResult:
         """
         Calculates the total number of CDR residues and assigns a flag colour.
         Uses the IMGT CDR definition.
         The input structure must have been annotated using the
         ab_characterisation.developability_tools.tap.structure_annotation module.
         """
-        cdr_residues = [
-            res for res in annotated_structure[0].get_residues() if res.is_cdr
-        ]
-        total_cdr_length = len(cdr_residues)
+        return self._result(int(annotated_structure.is_cdr.sum()))
+
+    def calculate_from_numbering(self, chain_ids: np.ndarray, residue_numbers: np.ndarray) -> MetricResult:
+        """
+        Calculates the total number of CDR residues from the IMGT numbering alone, e.g. of the sequences before a
+        structure is modelled, and assigns a flag colour.
+
+        Args:
+            chain_ids: the chain (H or L) of each residue
+            residue_numbers: the IMGT number of each residue, without insertion codes
+        """
+        cdr_numbers = [number for residue_range in imgt_cdr_definitions.values() for number in residue_range]
+        is_cdr = np.isin(chain_ids, ["H", "L"]) & np.isin(residue_numbers, cdr_numbers)
+        return self._result(int(is_cdr.sum()))
+
+    def _result(self, total_cdr_length: int) -> MetricResult:
         flag = self.get_flag(total_cdr_length)
 
         result = MetricResult(
@@ -1,10 +1,18 @@
 import tempfile
 from pathlib import Path
 
-from ab_characterisation.developability_tools.tap.metrics.base_calculator import MetricResult
+import numpy as np
+import pandas as pd
+
+from ab_characterisation.developability_tools.tap.metrics.base_calculator import (
+    MetricResult, PatchContributions)
+from ab_characterisation.developability_tools.tap.structure_annotation import AnnotatedStructure
 from ab_characterisation.developability_tools.utils.outputs import write_file
 
 
+BATCH_OUTPUT_HEADER = "Model,Metric,Value,Flag\n"
+
+
 def write_output_file(results: list[MetricResult], outfile: str) -> None:
     """
     Writes the TAP results to an output file in csv format.
@@ -20,3 +28,89 @@ def write_output_file(results: list[MetricResult], outfile: str) -> None:
     write_file(outstr, outfile)
 
     return
+
+
+def format_batch_output_rows(modelfile: str, results: list[MetricResult]) -> str:
+    """
+    Formats the TAP results of one model as rows of the combined csv output of a batch run.
+
+    Args:
+        modelfile: the path of the model the results were calculated for
+        results: the list of metric results
+    """
+    return "".join(
+        f"{modelfile},{res.metric_name},{res.calculated_value:.2f},{res.flag}\n"
+        for res in results
+    )
+
+
+def contribution_tables(
+    annotated_structure: AnnotatedStructure, contributions: PatchContributions
+) -> dict[str, pd.DataFrame]:
+    """
+    Tabulates what drives the TAP metrics of a model: the annotations of each residue with its contribution to each
+    patch score and to SFvCSP, and the term of each pair of neighbouring residues in the CDR vicinity. The contributions
+    of all residues add up to each metric. SFvCSP is the product of the surface charges of the heavy and light chains,
+    so each surface residue contributes half of its charge times the surface charge of the other chain.
+
+    Args:
+        annotated_structure: the annotated model
+        contributions: the patch score terms of the model
+
+    Returns:
+        the "residues" and "pairs" tables
+    """
+    res_numbers = np.array(annotated_structure.res_numbers)
+    residue_ids = np.char.add(annotated_structure.chain_ids.astype(str), res_numbers)
+    partner = annotated_structure.salt_bridge_partner
+    surface_charge = np.where(annotated_structure.is_surface, annotated_structure.charge, 0.0)
+    chain_charges = {chain: surface_charge[annotated_structure.chain_ids == chain].sum() for chain in "HL"}
+    other_chain_charge = np.where(annotated_structure.chain_ids == "H", chain_charges["L"], chain_charges["H"])
+    residues = pd.DataFrame(
+        {
+            "chain": annotated_structure.chain_ids,
+            "residue_number": res_numbers,
+            "residue_name": annotated_structure.residue_names,
+            "relative_surface_area": annotated_structure.relative_surface_area,
+            "is_surface": annotated_structure.is_surface,
+            "cdr_number": annotated_structure.cdr_number,
+            "in_cdr_vicinity": annotated_structure.in_cdr_vicinity,
+            "salt_bridge_partner": np.where(partner >= 0, residue_ids[partner], ""),
+            "hydrophobicity": annotated_structure.hydrophobicity,
+            "charge": annotated_structure.charge,
+            **contributions.residue_contributions(len(annotated_structure)),
+            "SFvCSP": surface_charge * other_chain_charge / 2,
+        }
+    )
+    pairs = pd.DataFrame(
+        {
+            "residue_1": residue_ids[contributions.res1],
+            "residue_2": residue_ids[contributions.res2],
+            "distance": contributions.distances,
+            **contributions.terms,
+        }
+    )
+    return {"residues": residues, "pairs": pairs}
+
+
+def write_contribution_files(
+    annotated_structure: AnnotatedStructure, contributions: PatchContributions, prefix: str
+) -> list[str]:
+    """
+    Writes the contribution tables of a model (see contribution_tables) to csv files named {prefix}_residues.csv and
+    {prefix}_pairs.csv.
+
+    Args:
+        annotated_structure: the annotated model
+        contributions: the patch score terms of the model
+        prefix: path prefix of the output files
+
+    Returns:
+        the paths of the written files
+    """
+    outfiles = []
+    for name, table in contribution_tables(annotated_structure, contributions).items():
+        outfile = f"{prefix}_{name}.csv"
+        write_file(table.to_csv(index=False, float_format="%.6g"), outfile)
+        outfiles.append(outfile)
+    return outfiles
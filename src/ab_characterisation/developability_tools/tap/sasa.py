@@ -0,0 +1,204 @@
+"""
+In-process calculation of relative side chain surface areas, as an alternative to running the psa executable.
+
+Surface areas are calculated with the Shrake-Rupley algorithm on the heavy atoms of the structure. Like psa, this
+calculates contact (rather than solvent accessible) surface areas with a 1.4 A probe, counts CA as part of the side
+chain, and expresses side chain areas as a percentage of the area of the same residue type in a reference state.
+The atomic radii and reference areas are calibrated against psa.
+"""
+from typing import Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+PROBE_RADIUS = 1.4
+DEFAULT_N_POINTS = 200
+
+# Atoms that are not part of the side chain; as in psa, CA is counted as side chain
+MAIN_CHAIN_ATOMS = ("N", "C", "O", "OXT")
+
+element_radii = {"C": 1.87, "N": 1.65, "O": 1.40, "S": 1.85}
+# sp2 carbons are smaller than aliphatic ones
+sp2_carbon_radius = 1.76
+sp2_carbons = {
+    "ARG": ["CZ"],
+    "ASN": ["CG"],
+    "ASP": ["CG"],
+    "GLN": ["CD"],
+    "GLU": ["CD"],
+    "HIS": ["CG", "CD2", "CE1"],
+    "PHE": ["CG", "CD1", "CD2", "CE1", "CE2", "CZ"],
+    "TRP": ["CG", "CD1", "CD2", "CE2", "CE3", "CZ2", "CZ3", "CH2"],
+    "TYR": ["CG", "CD1", "CD2", "CE1", "CE2", "CZ"],
+}
+lysine_nz_radius = 1.50
+# Radius of atoms of any other element
+default_radius = 1.80
+# Largest radius of any atom, which bounds the distance over which atoms bury each other
+max_radius = max(*element_radii.values(), sp2_carbon_radius, lysine_nz_radius, default_radius)
+
+# Side chain contact areas (A^2) of each residue type in the reference state used by psa
+reference_side_chain_areas = {
+    "ALA": 23.17,
+    "ARG": 62.67,
+    "ASN": 30.93,
+    "ASP": 29.39,
+    "CYS": 31.97,
+    "GLN": 41.67,
+    "GLU": 38.61,
+    "GLY": 10.84,
+    "HIS": 45.61,
+    "ILE": 45.71,
+    "LEU": 46.61,
+    "LYS": 51.51,
+    "MET": 51.92,
+    "PHE": 51.54,
+    "PRO": 39.27,
+    "SER": 23.62,
+    "THR": 31.94,
+    "TRP": 65.09,
+    "TYR": 52.93,
+    "VAL": 37.90,
+}
+
+
+def atom_radius(residue_name: str, atom_name: str, element: str) -> float:
+    """Returns the radius of an atom, in A."""
+    if element == "C":
+        if atom_name == "C" or atom_name in sp2_carbons.get(residue_name, []):
+            return sp2_carbon_radius
+        return element_radii["C"]
+    if residue_name == "LYS" and atom_name == "NZ":
+        return lysine_nz_radius
+    return element_radii.get(element, default_radius)
+
+
+def _sphere_points(n_points: int) -> np.ndarray:
+    """Returns approximately evenly spaced points on the unit sphere (golden section spiral)."""
+    idx = np.arange(n_points) + 0.5
+    phi = np.arccos(1 - 2 * idx / n_points)
+    theta = np.pi * (1 + 5**0.5) * idx
+    return np.column_stack(
+        [np.cos(theta) * np.sin(phi), np.sin(theta) * np.sin(phi), np.cos(phi)]
+    )
+
+
+def contact_areas(
+    coords: np.ndarray,
+    radii: np.ndarray,
+    probe_radius: float = PROBE_RADIUS,
+    n_points: int = DEFAULT_N_POINTS,
+    chunk_size: int = 256,
+    atoms: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Calculates the contact surface area of each atom with the Shrake-Rupley algorithm: the fraction of points on the
+    atom's probe-expanded sphere that lie outside the expanded spheres of all other atoms, times the area of the atom.
+
+    Args:
+        coords: (n_atoms, 3) array of atom coordinates
+        radii: atom radii
+        probe_radius: radius of the solvent probe
+        n_points: number of points sampled on the sphere of each atom
+        chunk_size: number of atoms processed at once, bounding memory usage
+        atoms: indices of the atoms whose areas are calculated, defaults to all atoms. All atoms are taken into account
+            as neighbours either way.
+
+    Returns:
+        array of contact areas, in A^2, one per calculated atom
+    """
+    coords = np.asarray(coords, dtype=float)
+    expanded = np.asarray(radii, dtype=float) + probe_radius
+    targets = np.arange(len(coords)) if atoms is None else np.asarray(atoms, dtype=int)
+    n_targets = len(targets)
+    if not n_targets:
+        return np.zeros(0)
+
+    # Neighbour lists: atoms whose expanded spheres overlap, padded to the same length. atom1 indexes the targets,
+    # atom2 all atoms.
+    if atoms is None:
+        pairs = cKDTree(coords).query_pairs(2 * expanded.max(), output_type="ndarray")
+        atom1 = np.r_[pairs[:, 0], pairs[:, 1]]
+        atom2 = np.r_[pairs[:, 1], pairs[:, 0]]
+    else:
+        pairs = cKDTree(coords[targets]).sparse_distance_matrix(
+            cKDTree(coords), 2 * expanded.max(), output_type="ndarray"
+        )
+        not_self = targets[pairs["i"]] != pairs["j"]
+        atom1, atom2 = pairs["i"][not_self], pairs["j"][not_self]
+    overlapping = (
+        np.linalg.norm(coords[targets[atom1]] - coords[atom2], axis=1) < expanded[targets[atom1]] + expanded[atom2]
+    )
+    atom1, atom2 = atom1[overlapping], atom2[overlapping]
+    order = np.argsort(atom1, kind="stable")
+    atom1, atom2 = atom1[order], atom2[order]
+    counts = np.bincount(atom1, minlength=n_targets)
+    slots = np.arange(len(atom1)) - np.repeat(np.cumsum(counts) - counts, counts)
+    max_neighbours = max(int(counts.max()), 1)
+
+    # Neighbour positions relative to each atom; padding entries are far away and never bury a point
+    offsets = np.full((n_targets, max_neighbours, 3), 1e4, dtype=np.float32)
+    offsets[atom1, slots] = coords[atom2] - coords[targets[atom1]]
+    neighbour_radii_sq = np.zeros((n_targets, max_neighbours), dtype=np.float32)
+    neighbour_radii_sq[atom1, slots] = expanded[atom2] ** 2
+    # A point p (relative to its atom) is buried by a neighbour at offset c if |p - c|^2 < r^2, i.e. if
+    # |c|^2 - r^2 < 2 p.c - |p|^2
+    thresholds = (offsets**2).sum(-1) - neighbour_radii_sq
+
+    sphere = _sphere_points(n_points).astype(np.float32)
+    target_expanded = expanded[targets]
+    accessible_fraction = np.empty(n_targets)
+    for start in range(0, n_targets, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        points = target_expanded[chunk, None, None].astype(np.float32) * sphere[None]
+        projections = 2 * points @ offsets[chunk].transpose(0, 2, 1) - (
+            target_expanded[chunk, None, None] ** 2
+        ).astype(np.float32)
+        buried = (thresholds[chunk][:, None, :] < projections).any(-1)
+        accessible_fraction[chunk] = 1 - buried.mean(1)
+
+    return accessible_fraction * 4 * np.pi * np.asarray(radii, dtype=float)[targets] ** 2
+
+
+def relative_side_chain_areas(
+    coords: np.ndarray,
+    atom_names: np.ndarray,
+    elements: np.ndarray,
+    atom_residues: np.ndarray,
+    residue_names: np.ndarray,
+    n_points: int = DEFAULT_N_POINTS,
+    residues: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Calculates the relative side chain contact area of each residue, as a percentage of its reference area.
+
+    Args:
+        coords: (n_atoms, 3) array of heavy atom coordinates
+        atom_names: atom names
+        elements: atom elements
+        atom_residues: index of the residue of each atom
+        residue_names: three-letter name of each residue
+        n_points: number of points sampled on the sphere of each atom
+        residues: indices of the residues whose areas are calculated, defaults to all residues
+
+    Returns:
+        array of relative side chain areas, one per calculated residue
+    """
+    radii = np.array(
+        [
+            atom_radius(residue_names[res], atom_name, element)
+            for atom_name, element, res in zip(atom_names, elements, atom_residues)
+        ]
+    )
+    if residues is None:
+        residues = np.arange(len(residue_names))
+        atoms = np.arange(len(atom_names))
+    else:
+        atoms = np.flatnonzero(np.isin(atom_residues, residues))
+    areas = contact_areas(coords, radii, n_points=n_points, atoms=atoms)
+    is_side_chain = ~np.isin(atom_names[atoms], MAIN_CHAIN_ATOMS)
+    side_chain_areas = np.bincount(
+        atom_residues[atoms][is_side_chain], weights=areas[is_side_chain], minlength=len(residue_names)
+    )[residues]
+    reference_areas = np.array([reference_side_chain_areas[resname] for resname in residue_names[residues]])
+    return side_chain_areas / reference_areas * 100
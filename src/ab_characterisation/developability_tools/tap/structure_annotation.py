@@ -1,78 +1,97 @@
 import subprocess
 import sys
+import tempfile
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional
 
-from Bio import PDB
-from Bio.PDB.NeighborSearch import NeighborSearch
+import numpy as np
+import pandas as pd
+from loguru import logger
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
 
 from ab_characterisation.developability_tools.tap.definitions import (
     acceptors, anchor_residues, donors, imgt_cdr_definitions,
     normalised_hydrophobicities, residue_charges)
+from ab_characterisation.developability_tools.tap.sasa import (
+    DEFAULT_N_POINTS, PROBE_RADIUS, max_radius, relative_side_chain_areas)
+from ab_characterisation.utils.structure_utils import StructureArrays, read_structure
+
+
+# Residues with a relative sidechain surface area of at least this value are on the surface
+SURFACE_CUTOFF = 7.5
+
+# Engines available to calculate relative sidechain surface areas: the bundled psa executable, or the in-process
+# implementation in the sasa module
+SASA_ENGINES = ("psa", "shrake_rupley")
 
 
 class PSAError(Exception):
     """Raised when something has gone awry when running psa to calculate surface areas."""
 
 
+def _format_res_numbers(residue_numbers: np.ndarray, insertion_codes: np.ndarray) -> list[str]:
+    return [f"{number}{insertion_code}".strip() for number, insertion_code in zip(residue_numbers, insertion_codes)]
+
+
 @dataclass
-class AnnotatedResidue(PDB.Residue.Residue):  # type: ignore
-    salt_bridge_partner: Optional[tuple] = None
-    neighbours: dict = field(default_factory=dict)
-    cdr_number: int = field(init=False)
-    relative_surface_area: float = field(init=False)
-    hydrophobicity: float = field(init=False)
-    charge: float = field(init=False)
-    in_cdr_vicinity: bool = field(init=False)
-
-    def __eq__(self, other):  # type: ignore
-        """Direct copy from Biopython Entity"""
-        if isinstance(other, type(self)):
-            if self.parent is None:
-                return self.id == other.id
-            return self.full_id[1:] == other.full_id[1:]
-        return NotImplemented
-
-    def __hash__(self) -> int:
-        """Direct copy from Biopython Entity"""
-        return hash(self.full_id)
+class AnnotatedStructure:
+    """
+    Columnar representation of an antibody structure annotated with the properties required by TAP. Each array holds
+    one entry per residue, in the order of the residues in the structure file.
+    """
 
-    @property
-    def is_cdr(self) -> bool:
-        """Whether the residue is part of a CDR (IMGT definition) or not."""
-        return self.cdr_number > 0
+    chain_ids: np.ndarray
+    residue_numbers: np.ndarray
+    insertion_codes: np.ndarray
+    residue_names: np.ndarray
+    relative_surface_area: np.ndarray
+    cdr_number: np.ndarray
+    is_anchor: np.ndarray
+    in_cdr_vicinity: np.ndarray
+    # Index of the residue each residue forms a salt bridge with, or -1
+    salt_bridge_partner: np.ndarray
+    hydrophobicity: np.ndarray
+    charge: np.ndarray
+    # Symmetric matrix of minimum distances between neighbouring residues; non-neighbours have no entry
+    neighbour_distances: csr_matrix
+
+    def __len__(self) -> int:
+        return len(self.residue_numbers)
 
     @property
-    def is_anchor(self) -> bool:
-        """
-        Whether the residue an anchor residue to a CDR (IMGT definition) or not.
-        Anchor residues are defined as the two residues on each side of the CDR.
-        """
-        return self.id[1] in anchor_residues
+    def is_cdr(self) -> np.ndarray:
+        """Whether each residue is part of a CDR (IMGT definition) or not."""
+        return self.cdr_number > 0
 
     @property
-    def is_surface(self) -> bool:
+    def is_surface(self) -> np.ndarray:
         """
-        Uses the relative surface area as calculated by psa to determine whether the residue is on the surface or not.
+        Uses the relative surface area as calculated by psa to determine whether each residue is on the surface or not.
         Surface residues have a relative sidechain surface area of 7.5 or above.
         """
-        return self.relative_surface_area >= 7.5
+        return self.relative_surface_area >= SURFACE_CUTOFF
 
     @property
-    def res_number(self) -> str:
-        """Returns a formatted string containing the residue number and insertion code, if present."""
-        return f"{self.id[1]}{self.id[2]}".strip()
+    def res_numbers(self) -> list[str]:
+        """Formatted strings containing the residue number and insertion code, if present, of each residue."""
+        return _format_res_numbers(self.residue_numbers, self.insertion_codes)
 
-    @property
-    def is_donor(self) -> bool:
-        """Whether the residue is a salt bridge donor residue type."""
-        return self.resname in donors
+    def neighbour_pairs(self, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns all ordered pairs of neighbouring residues among the residues selected by the mask, with their minimum
+        distance. Pairs are ordered by the first residue, then by the second residue.
 
-    @property
-    def is_acceptor(self) -> bool:
-        """Whether the residue is a salt bridge acceptor residue type."""
-        return self.resname in acceptors
+        Args:
+            mask: boolean array selecting residues
+
+        Returns:
+            the indices of the first and second residue of each pair, and their minimum distances
+        """
+        indices = np.flatnonzero(mask)
+        submatrix = self.neighbour_distances[indices][:, indices].sorted_indices().tocoo()
+        return indices[submatrix.row], indices[submatrix.col], submatrix.data
 
 
 @dataclass
@@ -85,15 +104,24 @@ class StructureAnnotator:
         - salt bridges (donor/acceptor atoms within 3.2 A)
         - hydrophobicity
         - charge
+    The annotations are returned as an AnnotatedStructure.
+    Surface areas are calculated by the psa executable, or in-process if sasa_engine is "shrake_rupley".
     """
 
     neighbour_cutoff: float = 7.5
     salt_bridge_cutoff: float = 3.2
     vicinity_cutoff: float = 4.0
+    sasa_engine: str = "psa"
+    sasa_points: int = DEFAULT_N_POINTS
     psa_path: Path = field(init=False)
     cdr_lookup_dict: dict[tuple[str, int], int] = field(init=False)
 
     def __post_init__(self) -> None:
+        if self.sasa_engine not in SASA_ENGINES:
+            raise ValueError(
+                f"Unknown SASA engine {self.sasa_engine}, expected one of {', '.join(SASA_ENGINES)}."
+            )
+
         lookup_dict = {}
         for chain in "HL":
             for cdr, residue_range in imgt_cdr_definitions.items():
@@ -106,14 +134,6 @@ class StructureAnnotator:
             Path(__file__).resolve().parent / f"psa_executables/{psa_version}"
         )
 
-    @staticmethod
-    def _convert_residues(structure: PDB.Structure.Structure) -> None:
-        """Converts normal Biopython residues to our annotated version with extra properties/methods."""
-        for res in structure[0].get_residues():
-            res.__class__ = AnnotatedResidue
-            res.neighbours = {}
-        return
-
     def _run_psa(self, structure_path: str) -> list[str]:
         """Runs the psa executable on the .pdb file to get surface accessibility information."""
         if self.psa_path.exists() is False:
@@ -130,64 +150,102 @@ class StructureAnnotator:
         psa_output = result.decode().split("\n")
         return psa_output
 
-    def _annotate_sasa(
-        self, structure: PDB.Structure.Structure, structure_path: str
-    ) -> None:
-        """Runs psa and extracts surface accessibility information from its output."""
+    def _get_psa_relative_surface_areas(
+        self, chain_ids: np.ndarray, residue_names: np.ndarray, res_numbers: list[str], structure_path: str
+    ) -> np.ndarray:
+        """Runs psa and extracts the relative sidechain surface area of each residue from its output."""
         # Run psa and get the relevant lines from the output
         psa_output = self._run_psa(structure_path)
         residue_lines = [line for line in psa_output if line.startswith("ACCESS")]
 
         # Check that the number of residues in the psa output is the same as the number of residues in our structure
-        all_residues = list(structure[0].get_residues())
-        if len(all_residues) != len(residue_lines):
+        if len(residue_names) != len(residue_lines):
             raise PSAError("PSA output contained the wrong number of residues.")
 
-        # Iterate through residues and annotate the structure
-        for res, psa_line in zip(all_residues, residue_lines):
+        relative_surface_area = np.empty(len(residue_names))
+        for idx, (chain_id, resname, res_number, psa_line) in enumerate(
+            zip(chain_ids, residue_names, res_numbers, residue_lines)
+        ):
             # Check we are on the correct residue with the correct type
             psa_residue_number = psa_line[6:12].strip()
-            if res.res_number != psa_residue_number:
+            if res_number != psa_residue_number:
                 raise PSAError(
-                    f"Residue number mismatch: {res.res_number} != {psa_residue_number}"
+                    f"Residue number mismatch: {res_number} != {psa_residue_number}"
                 )
             psa_residue_type = psa_line[14:17]
-            if res.resname != psa_residue_type:
+            if resname != psa_residue_type:
                 raise PSAError(
-                    f"Expected type {res.resname} for residue {res.parent}{res.res_number}; got {psa_residue_type}"
+                    f"Expected type {resname} for residue {chain_id}{res_number}; got {psa_residue_type}"
                 )
 
-            res.relative_surface_area = float(psa_line[61:67])
-        return
-
-    @staticmethod
-    def _get_minimum_distance(res1: AnnotatedResidue, res2: AnnotatedResidue) -> float:
-        """Calculates the minimum distance between the heavy atoms of two residues."""
-        min_dist = 100.0
-        for atom1 in res1.get_atoms():
-            for atom2 in res2.get_atoms():
-                dist = atom1 - atom2
-                if dist < min_dist:
-                    min_dist = dist
-        return min_dist
-
-    def _get_neighbours(self, structure: PDB.Structure.Structure) -> None:
-        """For each residue in the structure, gets a list of neighbouring residues and their minimum distance"""
-        # Quickly get list of residue pairs that are less than 7.5A apart
-        all_heavy_atoms = [
-            atom for atom in structure[0].get_atoms() if atom.element != "H"
-        ]
-        residue_pairs = NeighborSearch(atom_list=all_heavy_atoms).search_all(
-            self.neighbour_cutoff, level="R"
+            relative_surface_area[idx] = float(psa_line[61:67])
+        return relative_surface_area
+
+    def _get_neighbours(
+        self,
+        coords: np.ndarray,
+        is_heavy: np.ndarray,
+        atom_residues: np.ndarray,
+        n_residues: int,
+        atoms: Optional[np.ndarray] = None,
+    ) -> csr_matrix:
+        """
+        Gets the matrix of minimum distances between neighbouring residues.
+        Residues are neighbours if any of their heavy atoms are within the neighbour cutoff; the minimum distance is
+        taken over all their atoms. All atom pairs are found with a single KD-tree query, and reduced to the minimum
+        per residue pair.
+        If atoms is given, only atom pairs involving those atoms are considered, which gives the distances of all
+        residue pairs involving a residue whose atoms are all included.
+        """
+        neighbour_distances = csr_matrix((n_residues, n_residues), dtype=np.float32)
+        if not len(coords):
+            return neighbour_distances
+
+        # Any heavy atom pair closer than the cutoff makes two residues neighbours, and their closest atom pair can be
+        # no further apart, so a single query of all atom pairs within the cutoff covers all minimum distances
+        if atoms is None:
+            atom_pairs = cKDTree(coords).query_pairs(self.neighbour_cutoff, output_type="ndarray")
+        else:
+            pairs = cKDTree(coords[atoms]).sparse_distance_matrix(
+                cKDTree(coords), self.neighbour_cutoff, output_type="ndarray"
+            )
+            atom1, atom2 = atoms[pairs["i"]], pairs["j"]
+            # Pairs of two included atoms are found in both orders; keep them once, as i < j like query_pairs
+            in_atoms = np.zeros(len(coords), dtype=bool)
+            in_atoms[atoms] = True
+            keep = (atom1 < atom2) | ~in_atoms[atom2]
+            atom_pairs = np.sort(np.column_stack([atom1[keep], atom2[keep]]), axis=1)
+        res1 = atom_residues[atom_pairs[:, 0]]
+        res2 = atom_residues[atom_pairs[:, 1]]
+        different = res1 != res2
+        atom_pairs, res1, res2 = atom_pairs[different], res1[different], res2[different]
+        if not len(atom_pairs):
+            return neighbour_distances
+        # Atoms are ordered by residue and the query returns i < j, so each residue pair only occurs as (res1, res2)
+        pair_keys = res1 * n_residues + res2
+
+        # Same float32 arithmetic (dot product, not an elementwise sum) as Biopython atom subtraction
+        diff = coords[atom_pairs[:, 0]] - coords[atom_pairs[:, 1]]
+        distances = np.sqrt(np.matmul(diff[:, None, :], diff[:, :, None])[:, 0, 0])
+
+        order = np.argsort(pair_keys, kind="stable")
+        pair_keys, distances = pair_keys[order], distances[order]
+        segment_starts = np.flatnonzero(np.r_[True, pair_keys[1:] != pair_keys[:-1]])
+        unique_keys = pair_keys[segment_starts]
+        min_distances = np.minimum.reduceat(distances, segment_starts)
+        heavy_pair = is_heavy[atom_pairs[:, 0]] & is_heavy[atom_pairs[:, 1]]
+        has_heavy_pair = np.logical_or.reduceat(heavy_pair[order], segment_starts)
+
+        unique_keys, min_distances = unique_keys[has_heavy_pair], min_distances[has_heavy_pair]
+        rows, cols = unique_keys // n_residues, unique_keys % n_residues
+        neighbour_distances = csr_matrix(
+            (np.r_[min_distances, min_distances], (np.r_[rows, cols], np.r_[cols, rows])),
+            shape=(n_residues, n_residues),
         )
-
-        for res1, res2 in residue_pairs:
-            if res1 == res2:
-                continue
-            min_dist = self._get_minimum_distance(res1, res2)
-            res1.neighbours[res2.get_full_id()] = min_dist
-            res2.neighbours[res1.get_full_id()] = min_dist
-        return
+        # Residues with a distance of zero are not counted as neighbours
+        neighbour_distances.eliminate_zeros()
+        neighbour_distances.sort_indices()
+        return neighbour_distances
 
     def _cdr_lookup(self, chain_id: str, residue_number: int) -> int:
         """
@@ -196,86 +254,87 @@ class StructureAnnotator:
         """
         return self.cdr_lookup_dict.get((chain_id, residue_number), 0)
 
-    def _annotate_cdrs(self, structure: PDB.Structure.Structure) -> None:
-        """Annotates residues with their CDR number (0 if not in a CDR)"""
-        for res in structure[0].get_residues():
-            chain_id = res.parent.id
-            res_number = res.id[1]
-            res.cdr_number = self._cdr_lookup(chain_id, res_number)
-
-    def _annotate_cdr_vicinity(self, structure: PDB.Structure.Structure) -> None:
-        """Finds and annotates which residues are on the surface and less than 4A away from the CDRs/anchors."""
-        surface_cdrs_and_anchors = []
-        for res in structure[0].get_residues():
-            if res.is_surface and (res.is_cdr or res.is_anchor):
-                res.in_cdr_vicinity = True
-                surface_cdrs_and_anchors.append(res)
-            else:
-                res.in_cdr_vicinity = False
-
-        for res in surface_cdrs_and_anchors:
-            res.in_cdr_vicinity = True
-            for neighbour_id, distance in res.neighbours.items():
-                res2 = structure[0][neighbour_id[2]][neighbour_id[3]]
-                if distance < self.vicinity_cutoff and res2.is_surface:
-                    res2.in_cdr_vicinity = True
-        return
-
-    def _annotate_salt_bridges(self, structure: PDB.Structure.Structure) -> None:
-        """Identifies which residues form salt bridges based on distance."""
-        donor_atoms = [
-            atom
-            for atom in structure[0].get_atoms()
-            if atom.id in donors.get(atom.parent.resname, [])
-        ]
-        acceptor_atoms = [
-            atom
-            for atom in structure[0].get_atoms()
-            if atom.id in acceptors.get(atom.parent.resname, [])
-        ]
-        residue_pairs = NeighborSearch(
-            atom_list=donor_atoms + acceptor_atoms
-        ).search_all(self.salt_bridge_cutoff, level="R")
+    def _get_cdr_numbers(self, chain_ids: np.ndarray, residue_numbers: np.ndarray) -> np.ndarray:
+        """Returns the CDR number of each residue (0 if not in a CDR)"""
+        return np.array(
+            [self._cdr_lookup(chain_id, number) for chain_id, number in zip(chain_ids, residue_numbers.tolist())],
+            dtype=int,
+        )
+
+    def _get_cdr_vicinity(
+        self, is_surface: np.ndarray, is_cdr: np.ndarray, is_anchor: np.ndarray, neighbour_distances: csr_matrix
+    ) -> np.ndarray:
+        """Finds which residues are on the surface and less than 4A away from the CDRs/anchors."""
+        surface_cdrs_and_anchors = is_surface & (is_cdr | is_anchor)
+        close_neighbours = neighbour_distances[surface_cdrs_and_anchors].tocoo()
+        near_cdrs = np.zeros(len(is_surface), dtype=bool)
+        near_cdrs[close_neighbours.col[close_neighbours.data < self.vicinity_cutoff]] = True
+        return surface_cdrs_and_anchors | (near_cdrs & is_surface)
+
+    def _get_salt_bridge_partners(
+        self,
+        coords: np.ndarray,
+        atom_names: np.ndarray,
+        atom_residues: np.ndarray,
+        residue_names: np.ndarray,
+        is_surface: np.ndarray,
+    ) -> np.ndarray:
+        """Identifies which residues form salt bridges based on distance, returning the index of each partner or -1."""
+        salt_bridge_partner = np.full(len(residue_names), -1)
+        is_donor = np.array([resname in donors for resname in residue_names], dtype=bool)
+        is_acceptor = np.array([resname in acceptors for resname in residue_names], dtype=bool)
+        salt_bridge_atoms = np.flatnonzero(
+            [
+                atom_name in donors.get(residue_names[res], []) or atom_name in acceptors.get(residue_names[res], [])
+                for atom_name, res in zip(atom_names, atom_residues)
+            ]
+        )
+        if not len(salt_bridge_atoms):
+            return salt_bridge_partner
 
+        atom_pairs = cKDTree(coords[salt_bridge_atoms]).query_pairs(
+            self.salt_bridge_cutoff, output_type="ndarray"
+        )
+        residue_pairs = np.unique(
+            np.sort(atom_residues[salt_bridge_atoms[atom_pairs]], axis=1), axis=0
+        ).reshape(-1, 2)
         for res1, res2 in residue_pairs:
             # Ignore if already part of a salt bridge
-            if res1.salt_bridge_partner or res2.salt_bridge_partner:
+            if res1 == res2 or salt_bridge_partner[res1] >= 0 or salt_bridge_partner[res2] >= 0:
                 continue
-            if res1.is_surface and res2.is_surface:
-                if (res1.is_donor and res2.is_acceptor) or (
-                    res2.is_donor and res1.is_acceptor
-                ):
-                    res1.salt_bridge_partner = res2.get_full_id()
-                    res2.salt_bridge_partner = res1.get_full_id()
-        return
-
-    def _annotate_hydrophobicity(self, structure: PDB.Structure.Structure) -> None:
+            if is_surface[res1] and is_surface[res2]:
+                if (is_donor[res1] and is_acceptor[res2]) or (is_donor[res2] and is_acceptor[res1]):
+                    salt_bridge_partner[res1] = res2
+                    salt_bridge_partner[res2] = res1
+        return salt_bridge_partner
+
+    @staticmethod
+    def _get_hydrophobicities(residue_names: np.ndarray, salt_bridge_partner: np.ndarray) -> np.ndarray:
         """
-        Annotates residues with their normalised (between 1 and 2) hydrophobicity values.
+        Returns the normalised (between 1 and 2) hydrophobicity values of the residues.
         If the residue forms part of a salt bridge, it is assigned the hydrophobicity of glycine.
         """
-        for res in structure[0].get_residues():
-            if res.salt_bridge_partner:
-                res.hydrophobicity = normalised_hydrophobicities["GLY"]
-            else:
-                res.hydrophobicity = normalised_hydrophobicities[res.resname]
-        return
-
-    def _annotate_charge(self, structure: PDB.Structure.Structure) -> None:
+        return np.array(
+            [
+                normalised_hydrophobicities["GLY" if partner >= 0 else resname]
+                for resname, partner in zip(residue_names, salt_bridge_partner)
+            ]
+        )
+
+    @staticmethod
+    def _get_charges(residue_names: np.ndarray, salt_bridge_partner: np.ndarray) -> np.ndarray:
         """
-        Annotates residues with their charges.
+        Returns the charges of the residues.
         If the residue forms part of a salt bridge, it is assigned a charge of zero.
         """
-        for res in structure[0].get_residues():
-            if res.salt_bridge_partner:
-                res.charge = 0
-            else:
-                res.charge = residue_charges[res.resname]
-        return
-
-    def load_and_annotate_structure(
-        self, structure_path: str
-    ) -> PDB.Structure.Structure:
+        return np.array(
+            [
+                0.0 if partner >= 0 else residue_charges[resname]
+                for resname, partner in zip(residue_names, salt_bridge_partner)
+            ]
+        )
+
+    def load_and_annotate_structure(self, structure_path: str) -> AnnotatedStructure:
         """
         Loads an antibody structure from the provided file, and annotates the residues for later use in TAP metric
         calculations.
@@ -285,17 +344,232 @@ class StructureAnnotator:
             structure_path: the path to the structure that is to be annotated.
 
         Returns:
-            the annotated structure (Biopython Structure entity, with residues converted to an AnnotatedResidue type).
+            the annotated structure, as per-residue arrays.
+        """
+        return self.annotate_structure(read_structure(structure_path), structure_path=structure_path)
+
+    def annotate_structure(
+        self, structure: StructureArrays, structure_path: Optional[str] = None
+    ) -> AnnotatedStructure:
+        """
+        Annotates the residues of an in-memory antibody structure for later use in TAP metric calculations.
+        Assumes the structure is already IMGT-numbered!!
+
+        Args:
+            structure: the structure that is to be annotated.
+            structure_path: the path to a file holding the same structure, if there is one. It is only read by psa;
+                without it, the structure is written to a temporary file for psa.
+
+        Returns:
+            the annotated structure, as per-residue arrays.
+        """
+        if self.sasa_engine == "psa":
+            relative_surface_area = self._get_psa_structure_areas(structure, structure_path)
+        else:
+            relative_surface_area = self._get_shrake_rupley_areas(structure)
+        neighbour_distances = self._get_neighbours(
+            structure.coords, structure.is_heavy, structure.atom_residues, structure.n_residues
+        )
+        return self._annotate_residues(structure, relative_surface_area, neighbour_distances)
+
+    def annotate_mutant(
+        self,
+        parent_structure: StructureArrays,
+        parent: AnnotatedStructure,
+        structure: StructureArrays,
+        structure_path: Optional[str] = None,
+        moved_tolerance: float = 0.0,
+    ) -> tuple[AnnotatedStructure, np.ndarray]:
+        """
+        Annotates a mutant of an already annotated parent structure, recalculating only what the mutation can change.
+        Neighbour distances are recalculated for the changed residues only and, with the in-process surface area
+        engine, surface areas only for residues within reach of the changed atoms. psa always runs on the whole
+        structure. The remaining annotations are cheap and recalculated in full, as salt bridges are assigned
+        greedily over the whole structure.
+        Gives the same annotations as annotate_structure if moved_tolerance is zero. If the mutant does not have the
+        same residue numbering as the parent, it is annotated from scratch.
+
+        Args:
+            parent_structure: the parent structure
+            parent: the annotation of the parent structure, from this annotator
+            structure: the mutant structure
+            structure_path: the path to a file holding the mutant structure, if there is one; see annotate_structure.
+            moved_tolerance: atoms of the mutant that are no further than this from the parent atoms (in A) are
+                treated as unchanged.
+
+        Returns:
+            the annotated mutant structure, and a mask of the residues that differ from the parent
         """
-        structure = PDB.PDBParser(QUIET=True).get_structure(
-            "input_structure", structure_path
+        changed = _changed_residues(parent_structure, structure, moved_tolerance)
+        if changed is None:
+            logger.debug("Mutant numbering differs from the parent, annotating it from scratch.")
+            return self.annotate_structure(structure, structure_path), np.ones(structure.n_residues, dtype=bool)
+
+        coords, is_heavy, atom_residues = structure.coords, structure.is_heavy, structure.atom_residues
+        n_residues = structure.n_residues
+
+        if self.sasa_engine == "psa":
+            relative_surface_area = self._get_psa_structure_areas(structure, structure_path)
+        else:
+            # Areas only change for residues with heavy atoms within reach of a changed heavy atom, before or after
+            # the mutation
+            changed_coords = np.r_[
+                coords[is_heavy & changed[atom_residues]],
+                parent_structure.coords[parent_structure.is_heavy & changed[parent_structure.atom_residues]],
+            ]
+            affected = np.flatnonzero(changed)
+            if len(changed_coords):
+                heavy_atoms = np.flatnonzero(is_heavy)
+                nearby = cKDTree(changed_coords).sparse_distance_matrix(
+                    cKDTree(coords[heavy_atoms]), 2 * (max_radius + PROBE_RADIUS), output_type="ndarray"
+                )["j"]
+                affected = np.union1d(affected, atom_residues[heavy_atoms[nearby]])
+            relative_surface_area = parent.relative_surface_area.copy()
+            relative_surface_area[affected] = self._get_shrake_rupley_areas(structure, residues=affected)
+
+        # Distances between unchanged residues are kept from the parent
+        unchanged_distances = parent.neighbour_distances.tocoo()
+        keep = ~changed[unchanged_distances.row] & ~changed[unchanged_distances.col]
+        changed_distances = self._get_neighbours(
+            coords, is_heavy, atom_residues, n_residues, atoms=np.flatnonzero(changed[atom_residues])
+        ).tocoo()
+        neighbour_distances = csr_matrix(
+            (
+                np.r_[unchanged_distances.data[keep], changed_distances.data],
+                (
+                    np.r_[unchanged_distances.row[keep], changed_distances.row],
+                    np.r_[unchanged_distances.col[keep], changed_distances.col],
+                ),
+            ),
+            shape=(n_residues, n_residues),
+        )
+        neighbour_distances.eliminate_zeros()
+        neighbour_distances.sort_indices()
+
+        return self._annotate_residues(structure, relative_surface_area, neighbour_distances), changed
+
+    def _get_psa_structure_areas(self, structure: StructureArrays, structure_path: Optional[str]) -> np.ndarray:
+        """Calculates the relative sidechain surface areas of a structure with psa."""
+        res_numbers = _format_res_numbers(structure.residue_numbers, structure.insertion_codes)
+        if structure_path is not None:
+            return self._get_psa_relative_surface_areas(
+                structure.chain_ids, structure.residue_names, res_numbers, str(structure_path)
+            )
+        with tempfile.NamedTemporaryFile("w", suffix=".pdb") as temp_f:
+            temp_f.write(structure.to_pdb_string())
+            temp_f.flush()
+            return self._get_psa_relative_surface_areas(
+                structure.chain_ids, structure.residue_names, res_numbers, temp_f.name
+            )
+
+    def _get_shrake_rupley_areas(
+        self, structure: StructureArrays, residues: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Calculates the relative sidechain surface areas of a structure (or of some of its residues) in-process."""
+        is_heavy = structure.is_heavy
+        return relative_side_chain_areas(
+            structure.coords[is_heavy],
+            structure.atom_names[is_heavy],
+            structure.elements[is_heavy],
+            structure.atom_residues[is_heavy],
+            structure.residue_names,
+            n_points=self.sasa_points,
+            residues=residues,
+        )
+
+    def _annotate_residues(
+        self, structure: StructureArrays, relative_surface_area: np.ndarray, neighbour_distances: csr_matrix
+    ) -> AnnotatedStructure:
+        """Derives the remaining annotations from the surface areas and neighbour distances."""
+        is_surface = relative_surface_area >= SURFACE_CUTOFF
+        cdr_number = self._get_cdr_numbers(structure.chain_ids, structure.residue_numbers)
+        is_anchor = np.isin(structure.residue_numbers, anchor_residues)
+        salt_bridge_partner = self._get_salt_bridge_partners(
+            structure.coords, structure.atom_names, structure.atom_residues, structure.residue_names, is_surface
+        )
+
+        return AnnotatedStructure(
+            chain_ids=structure.chain_ids,
+            residue_numbers=structure.residue_numbers,
+            insertion_codes=structure.insertion_codes,
+            residue_names=structure.residue_names,
+            relative_surface_area=relative_surface_area,
+            cdr_number=cdr_number,
+            is_anchor=is_anchor,
+            in_cdr_vicinity=self._get_cdr_vicinity(is_surface, cdr_number > 0, is_anchor, neighbour_distances),
+            salt_bridge_partner=salt_bridge_partner,
+            hydrophobicity=self._get_hydrophobicities(structure.residue_names, salt_bridge_partner),
+            charge=self._get_charges(structure.residue_names, salt_bridge_partner),
+            neighbour_distances=neighbour_distances,
+        )
+
+
+def _changed_residues(
+    parent_structure: StructureArrays, structure: StructureArrays, moved_tolerance: float
+) -> Optional[np.ndarray]:
+    """
+    Finds the residues of a mutant structure whose type, atoms or atom positions differ from the parent structure.
+    Returns None if the two structures do not have the same residue numbering.
+    """
+    if not (
+        np.array_equal(parent_structure.chain_ids, structure.chain_ids)
+        and np.array_equal(parent_structure.residue_numbers, structure.residue_numbers)
+        and np.array_equal(parent_structure.insertion_codes, structure.insertion_codes)
+    ):
+        return None
+
+    n_residues = structure.n_residues
+    changed = (parent_structure.residue_names != structure.residue_names) | (
+        np.bincount(parent_structure.atom_residues, minlength=n_residues)
+        != np.bincount(structure.atom_residues, minlength=n_residues)
+    )
+    # The atoms of residues with the same number of atoms correspond one to one, in order
+    parent_atoms = ~changed[parent_structure.atom_residues]
+    atoms = np.flatnonzero(~changed[structure.atom_residues])
+    moved = (parent_structure.atom_names[parent_atoms] != structure.atom_names[atoms]) | (
+        np.abs(parent_structure.coords[parent_atoms] - structure.coords[atoms]).max(axis=1, initial=0.0)
+        > moved_tolerance
+    )
+    changed[structure.atom_residues[atoms[moved]]] = True
+    return changed
+
+
+def compare_sasa_engines(structure_paths: list[str]) -> pd.DataFrame:
+    """
+    Calculates the relative sidechain surface areas of the residues of a set of structures with both psa and the
+    in-process Shrake-Rupley engine, to validate the latter, and logs how often they agree on surface residues.
+
+    Args:
+        structure_paths: paths to IMGT-numbered antibody structures
+
+    Returns:
+        one row per residue, with the relative surface areas calculated by both engines
+    """
+    dfs = []
+    for structure_path in structure_paths:
+        structure = read_structure(structure_path)
+        psa_structure = StructureAnnotator(sasa_engine="psa").annotate_structure(structure, structure_path)
+        sr_structure = StructureAnnotator(sasa_engine="shrake_rupley").annotate_structure(structure)
+        dfs.append(
+            pd.DataFrame(
+                {
+                    "structure": str(structure_path),
+                    "chain": psa_structure.chain_ids,
+                    "residue_number": psa_structure.res_numbers,
+                    "residue_name": psa_structure.residue_names,
+                    "psa": psa_structure.relative_surface_area,
+                    "shrake_rupley": sr_structure.relative_surface_area,
+                }
+            )
         )
-        self._convert_residues(structure)
-        self._annotate_sasa(structure, structure_path)
-        self._get_neighbours(structure)
-        self._annotate_cdrs(structure)
-        self._annotate_cdr_vicinity(structure)
-        self._annotate_salt_bridges(structure)
-        self._annotate_hydrophobicity(structure)
-        self._annotate_charge(structure)
-        return structure
+    comparison_df = pd.concat(dfs, ignore_index=True)
+    comparison_df["difference"] = comparison_df["shrake_rupley"] - comparison_df["psa"]
+
+    surface_agreement = (
+        (comparison_df["psa"] >= SURFACE_CUTOFF) == (comparison_df["shrake_rupley"] >= SURFACE_CUTOFF)
+    ).mean()
+    logger.info(
+        f"Compared {len(comparison_df)} residues: mean absolute difference "
+        f"{comparison_df['difference'].abs().mean():.2f}, surface classification agreement {surface_agreement:.1%}."
+    )
+    return comparison_df
@@ -0,0 +1,502 @@
+import copy
+import os
+import typing as t
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+from ab_characterisation.utils.data_classes import BACKENDS, BiologicsData, RunConfig
+
+# MPI message tags used by the scheduler in MPIExecutor
+_WORK_TAG = 1
+_STOP_TAG = 2
+_RESULT_TAG = 3
+
+
+class Executor(ABC):
+    """
+    Backend used by computation_step to apply a computation function to every datapoint that has not been discarded,
+    either one datapoint or one batch of datapoints at a time.
+    Every backend returns the full, ordered list of datapoints on every process taking part in the run.
+    """
+
+    rank: int = 0
+    size: int = 1
+
+    @property
+    def is_root(self) -> bool:
+        """Whether this process is responsible for logging and writing the final output."""
+        return self.rank == 0
+
+    @property
+    def local_workers(self) -> int:
+        """Number of processes computing datapoints concurrently on the node of this process."""
+        return 1
+
+    def map(
+        self,
+        input_data: list[BiologicsData],
+        computation_function: t.Callable,
+        config: RunConfig,
+        indices: t.Optional[t.Collection[int]] = None,
+    ) -> list[BiologicsData]:
+        """
+        Applies the computation function to all datapoints that have not been discarded.
+
+        Args:
+            input_data:
+            computation_function: Function mapping BiologicsData -> BiologicsData
+            config:
+            indices: if provided, only the datapoints with these indices are computed; all others are returned as is
+
+        Returns:
+            list of BiologicsData objects, in the same order as the input data
+        """
+        return self.map_batches(
+            input_data,
+            partial(_apply_to_batch, computation_function=computation_function),
+            config,
+            batch_size=1,
+            indices=indices,
+        )
+
+    @abstractmethod
+    def map_batches(
+        self,
+        input_data: list[BiologicsData],
+        batch_function: t.Callable,
+        config: RunConfig,
+        batch_size: int,
+        indices: t.Optional[t.Collection[int]] = None,
+        groups: t.Optional[list[list[int]]] = None,
+    ) -> list[BiologicsData]:
+        """
+        Applies a batch function to all datapoints that have not been discarded, handing it up to batch_size
+        datapoints at a time, in input order.
+
+        Args:
+            input_data:
+            batch_function: Function mapping list[BiologicsData] -> list[BiologicsData], in the same order
+            config:
+            batch_size: maximum number of datapoints per batch
+            indices: if provided, only the datapoints with these indices are computed; all others are returned as is
+            groups: if provided, each group of indices is handed to the batch function as one batch, regardless of
+                batch_size and indices
+
+        Returns:
+            list of BiologicsData objects, in the same order as the input data
+        """
+
+    def _batch_group(self, idx: int) -> t.Any:
+        """Key of the group of datapoints that may be batched with the given datapoint."""
+        return None
+
+    def _make_batches(
+        self,
+        input_data: list[BiologicsData],
+        indices: t.Optional[t.Collection[int]],
+        batch_size: int,
+        groups: t.Optional[list[list[int]]] = None,
+    ) -> list[list[int]]:
+        """
+        Splits the indices of the datapoints to compute into batches of consecutive datapoints that may be batched
+        together. Explicit groups are kept as batches, without their discarded datapoints.
+        """
+        if groups is not None:
+            batches = [_pending_indices(input_data, group) for group in groups]
+            return [batch for batch in batches if batch]
+        pending = _pending_indices(input_data, indices)
+        if batch_size <= 1:
+            return [[idx] for idx in pending]
+
+        batch_groups: dict[t.Any, list[int]] = {}
+        for idx in pending:
+            batch_groups.setdefault(self._batch_group(idx), []).append(idx)
+        batches = []
+        for group in batch_groups.values():
+            batches += [group[start:start + batch_size] for start in range(0, len(group), batch_size)]
+        return batches
+
+    def owns(self, idx: int) -> bool:
+        """Whether this process holds the full payload of the datapoint with the given index."""
+        return True
+
+    def sync_status(self, input_data: list[BiologicsData]) -> list[BiologicsData]:
+        """
+        Makes the status of every datapoint (e.g. whether it has been discarded) consistent across processes, after
+        each process has updated the datapoints it owns.
+        """
+        return input_data
+
+    def collect(self, input_data: list[BiologicsData]) -> list[BiologicsData]:
+        """Returns the datapoints with their full payloads on the root process."""
+        return input_data
+
+    def copy_fields(
+        self,
+        input_data: list[BiologicsData],
+        copies: dict[int, list[int]],
+        fields: t.Sequence[str],
+    ) -> list[BiologicsData]:
+        """
+        Copies dataclass fields from source datapoints to target datapoints.
+
+        Args:
+            input_data:
+            copies: indices of the target datapoints, keyed by the index of their source datapoint
+            fields: names of the fields to copy
+
+        Returns:
+            list of BiologicsData objects
+        """
+        for source, targets in copies.items():
+            copy_datapoint_fields(input_data[source], [input_data[target] for target in targets], fields)
+        return input_data
+
+    def set_worker_initializer(self, initializer: t.Callable, *args: t.Any) -> None:
+        """
+        Runs an initializer once in every process that computes datapoints, before it computes any, e.g. to start
+        per-process resources. Must be called before the first computation step.
+        """
+        if self.size == 1 or not self.is_root:
+            initializer(*args)
+
+    def shutdown(self) -> None:
+        """Releases any resources held by the backend."""
+        return
+
+
+class SerialExecutor(Executor):
+    """Computes every datapoint in turn in the current process."""
+
+    def map_batches(
+        self,
+        input_data: list[BiologicsData],
+        batch_function: t.Callable,
+        config: RunConfig,
+        batch_size: int,
+        indices: t.Optional[t.Collection[int]] = None,
+        groups: t.Optional[list[list[int]]] = None,
+    ) -> list[BiologicsData]:
+        output_data = list(input_data)
+        for batch in self._make_batches(input_data, indices, batch_size, groups):
+            batch_results = batch_function([input_data[idx] for idx in batch], config)
+            for idx, biol_data in zip(batch, batch_results):
+                output_data[idx] = biol_data
+        return output_data
+
+
+class ProcessPoolBackend(Executor):
+    """
+    Computes datapoints in a pool of local worker processes, without requiring an MPI installation.
+    The pool is kept alive between steps, so per-process state (e.g. loaded models) is reused.
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self._initializer: Optional[t.Callable] = None
+        self._initializer_args: tuple = ()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def local_workers(self) -> int:
+        return self.workers
+
+    @property
+    def _pool(self) -> ProcessPoolExecutor:
+        # Started on first use, so that a worker initializer can still be set after the backend is created
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=self._initializer, initargs=self._initializer_args
+            )
+        return self._executor
+
+    def set_worker_initializer(self, initializer: t.Callable, *args: t.Any) -> None:
+        if self._executor is not None:
+            raise RuntimeError("The worker initializer must be set before the worker processes are started.")
+        self._initializer = initializer
+        self._initializer_args = args
+
+    def map_batches(
+        self,
+        input_data: list[BiologicsData],
+        batch_function: t.Callable,
+        config: RunConfig,
+        batch_size: int,
+        indices: t.Optional[t.Collection[int]] = None,
+        groups: t.Optional[list[list[int]]] = None,
+    ) -> list[BiologicsData]:
+        output_data = list(input_data)
+        futures = {
+            self._pool.submit(batch_function, [input_data[idx] for idx in batch], config): batch
+            for batch in self._make_batches(input_data, indices, batch_size, groups)
+        }
+        for future in as_completed(futures):
+            for idx, biol_data in zip(futures[future], future.result()):
+                output_data[idx] = biol_data
+        return output_data
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+class MPIExecutor(Executor):
+    """
+    Computes datapoints across MPI processes. With more than one process, the root process acts as a scheduler,
+    handing out one datapoint (or batch of datapoints) at a time to idle worker processes, so that slow datapoints do
+    not hold up a whole chunk of the input data.
+
+    By default the full datapoints are returned to the root process and broadcast to all processes after every step.
+    With distributed_payloads, each datapoint instead stays on the worker process that first computed it, which
+    computes and filters it in all later steps; only lightweight status (the scalar dataclass fields) is exchanged
+    between steps, and the full datapoints are only sent to the root process once, by collect.
+    """
+
+    def __init__(self, distributed_payloads: bool = False) -> None:
+        from mpi4py import MPI
+
+        self._mpi = MPI
+        self.comm = MPI.COMM_WORLD
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+        self.distributed_payloads = distributed_payloads and self.size > 1
+        # Rank holding the full payload of each datapoint computed so far, when using distributed payloads
+        self._owners: dict[int, int] = {}
+
+        # Processes sharing this node; with more than one process, the root process only schedules work
+        node_comm = self.comm.Split_type(MPI.COMM_TYPE_SHARED)
+        node_size = node_comm.Get_size()
+        node_has_root = node_comm.allreduce(int(self.rank == 0)) > 0
+        node_comm.Free()
+        self._local_workers = max(1, node_size - 1) if self.size > 1 and node_has_root else node_size
+
+    @property
+    def local_workers(self) -> int:
+        return self._local_workers
+
+    def owns(self, idx: int) -> bool:
+        if not self.distributed_payloads:
+            return True
+        # Datapoints that have not been computed yet are identical on all processes; the root process acts for them
+        return self._owners.get(idx, 0) == self.rank
+
+    def _batch_group(self, idx: int) -> t.Any:
+        # With distributed payloads, a batch may only hold datapoints owned by the same worker process
+        return self._owners.get(idx) if self.distributed_payloads else None
+
+    def _distribute_work(self, batches: list[list[int]]) -> dict[int, t.Any]:
+        """
+        Runs on the root process: hands out the batches of datapoints that still need computing one at a time to
+        whichever worker process is idle, and collects the results as they finish. With distributed payloads,
+        batches of datapoints that are already owned by a worker are only ever handed to that worker.
+
+        Returns:
+            the results sent back by the workers, keyed by datapoint index: full BiologicsData objects, or status
+            dictionaries with distributed payloads
+        """
+        shared_queue: deque[list[int]] = deque()
+        owned_queues: dict[int, deque[list[int]]] = {worker: deque() for worker in range(1, self.size)}
+        for batch in batches:
+            if batch[0] in self._owners:
+                owned_queues[self._owners[batch[0]]].append(batch)
+            else:
+                shared_queue.append(batch)
+
+        def next_batch(worker: int) -> Optional[list[int]]:
+            if owned_queues[worker]:
+                return owned_queues[worker].popleft()
+            if shared_queue:
+                return shared_queue.popleft()
+            return None
+
+        active_workers = 0
+        for worker in range(1, self.size):
+            batch = next_batch(worker)
+            if batch is None:
+                self.comm.send(None, dest=worker, tag=_STOP_TAG)
+            else:
+                self.comm.send(batch, dest=worker, tag=_WORK_TAG)
+                active_workers += 1
+
+        results: dict[int, t.Any] = {}
+        status = self._mpi.Status()
+        while active_workers:
+            batch, batch_results = self.comm.recv(
+                source=self._mpi.ANY_SOURCE, tag=_RESULT_TAG, status=status
+            )
+            worker = status.Get_source()
+            for idx, result in zip(batch, batch_results):
+                results[idx] = result
+                if self.distributed_payloads:
+                    self._owners[idx] = worker
+            batch = next_batch(worker)
+            if batch is None:
+                self.comm.send(None, dest=worker, tag=_STOP_TAG)
+                active_workers -= 1
+            else:
+                self.comm.send(batch, dest=worker, tag=_WORK_TAG)
+        return results
+
+    def _process_work(
+        self,
+        input_data: list[BiologicsData],
+        batch_function: t.Callable,
+        config: RunConfig,
+    ) -> dict[int, BiologicsData]:
+        """
+        Runs on the worker processes: computes the batches handed out by the root process until told to stop.
+
+        Returns:
+            the computed datapoints, keyed by index
+        """
+        local_results: dict[int, BiologicsData] = {}
+        status = self._mpi.Status()
+        while True:
+            batch = self.comm.recv(source=0, tag=self._mpi.ANY_TAG, status=status)
+            if status.Get_tag() == _STOP_TAG:
+                return local_results
+            batch_results = batch_function([input_data[idx] for idx in batch], config)
+            local_results.update(zip(batch, batch_results))
+            if self.distributed_payloads:
+                batch_results = [_get_status(biol_data) for biol_data in batch_results]
+            self.comm.send((batch, batch_results), dest=0, tag=_RESULT_TAG)
+
+    def map_batches(
+        self,
+        input_data: list[BiologicsData],
+        batch_function: t.Callable,
+        config: RunConfig,
+        batch_size: int,
+        indices: t.Optional[t.Collection[int]] = None,
+        groups: t.Optional[list[list[int]]] = None,
+    ) -> list[BiologicsData]:
+        if self.size == 1:
+            return SerialExecutor().map_batches(input_data, batch_function, config, batch_size, indices, groups)
+
+        output_data = list(input_data)
+        if self.is_root:
+            results = self._distribute_work(self._make_batches(input_data, indices, batch_size, groups))
+            local_results: dict[int, BiologicsData] = {}
+        else:
+            results = {}
+            local_results = self._process_work(input_data, batch_function, config)
+
+        if not self.distributed_payloads:
+            for idx, biol_data in results.items():
+                output_data[idx] = biol_data
+            return self.comm.bcast(output_data, root=0)
+
+        results, self._owners = self.comm.bcast((results, self._owners), root=0)
+        for idx, biol_data in local_results.items():
+            output_data[idx] = biol_data
+        for idx, biol_data_status in results.items():
+            _apply_status(output_data[idx], biol_data_status)
+        return output_data
+
+    def sync_status(self, input_data: list[BiologicsData]) -> list[BiologicsData]:
+        if not self.distributed_payloads:
+            return input_data
+        statuses = {
+            idx: _get_status(biol_data)
+            for idx, biol_data in enumerate(input_data)
+            if self.owns(idx)
+        }
+        for rank_statuses in self.comm.allgather(statuses):
+            for idx, biol_data_status in rank_statuses.items():
+                _apply_status(input_data[idx], biol_data_status)
+        return input_data
+
+    def collect(self, input_data: list[BiologicsData]) -> list[BiologicsData]:
+        if not self.distributed_payloads:
+            return input_data
+        owned = {
+            idx: biol_data for idx, biol_data in enumerate(input_data) if self.owns(idx)
+        }
+        all_owned = self.comm.gather(owned, root=0)
+        if not self.is_root:
+            return input_data
+        output_data = list(input_data)
+        for rank_owned in all_owned:
+            for idx, biol_data in rank_owned.items():
+                output_data[idx] = biol_data
+        return output_data
+
+    def copy_fields(
+        self,
+        input_data: list[BiologicsData],
+        copies: dict[int, list[int]],
+        fields: t.Sequence[str],
+    ) -> list[BiologicsData]:
+        if not self.distributed_payloads:
+            return super().copy_fields(input_data, copies, fields)
+        # Targets move to the process owning their source, which copies the fields locally. Datapoints that have not
+        # been computed yet are identical on all processes, so every process copies those.
+        for source, targets in copies.items():
+            if source in self._owners:
+                for target in targets:
+                    self._owners[target] = self._owners[source]
+            if self.owns(source):
+                copy_datapoint_fields(input_data[source], [input_data[target] for target in targets], fields)
+        return self.sync_status(input_data)
+
+
+def _pending_indices(
+    input_data: list[BiologicsData], indices: t.Optional[t.Collection[int]]
+) -> list[int]:
+    """Returns the indices of the datapoints to compute. Discarded datapoints need no work, so they are skipped."""
+    candidates = range(len(input_data)) if indices is None else sorted(indices)
+    return [idx for idx in candidates if input_data[idx].discarded_by is None]
+
+
+def _apply_to_batch(
+    batch: list[BiologicsData], config: RunConfig, computation_function: t.Callable
+) -> list[BiologicsData]:
+    """Applies a per-datapoint computation function to each datapoint of a batch."""
+    return [computation_function(biol_data, config) for biol_data in batch]
+
+
+def copy_datapoint_fields(
+    source: BiologicsData, targets: list[BiologicsData], fields: t.Sequence[str]
+) -> None:
+    """Copies dataclass fields from a source datapoint to target datapoints, in place."""
+    for target in targets:
+        for field_name in fields:
+            setattr(target, field_name, copy.copy(getattr(source, field_name)))
+
+
+def _get_status(biol_data: BiologicsData) -> dict[str, t.Any]:
+    """Returns the lightweight, scalar fields of a datapoint (name, discarded_by, output paths, rank, ...)."""
+    return {
+        key: value
+        for key, value in vars(biol_data).items()
+        if value is None or isinstance(value, (str, int, float, Path))
+    }
+
+
+def _apply_status(biol_data: BiologicsData, biol_data_status: dict[str, t.Any]) -> None:
+    """Updates a datapoint in place with status received from the process owning its full payload."""
+    for key, value in biol_data_status.items():
+        setattr(biol_data, key, value)
+
+
+def get_executor(config: RunConfig) -> Executor:
+    """
+    Creates the execution backend selected in the run configuration.
+
+    Args:
+        config:
+
+    Returns:
+        an Executor instance
+    """
+    if config.backend == "mpi":
+        return MPIExecutor(distributed_payloads=config.distributed_payloads)
+    if config.backend == "process":
+        return ProcessPoolBackend(workers=config.workers)
+    if config.backend == "serial":
+        return SerialExecutor()
+    raise ValueError(f"Unknown backend {config.backend}, expected one of {', '.join(BACKENDS)}.")
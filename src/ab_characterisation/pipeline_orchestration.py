@@ -1,17 +1,33 @@
 import sys
 import typing as t
+import warnings
+from dataclasses import dataclass, replace
+from functools import partial
 
 import pandas as pd
 from loguru import logger
-from mpi4py import MPI
+from ab_characterisation.executors import Executor, copy_datapoint_fields, get_executor
+from ab_characterisation.utils.checkpoint_utils import restore_checkpoints, save_checkpoint
 from ab_characterisation.utils.data_classes import BiologicsData, RunConfig, save_output
+from ab_characterisation.utils.profiling_utils import timed_call, write_timing_report
+from ab_characterisation.utils.result_cache import get_result_cache
+from ab_characterisation.utils.rosetta_pool import shutdown_rosetta_pool, start_rosetta_pool
 
 from ab_characterisation.filter_steps import (
     find_top_n, rosetta_antibody_filter, sequence_liability_filter, tap_filter
 )
-from ab_characterisation.rosetta_steps import rosetta_antibody_step, rosetta_complex_step
-from ab_characterisation.sequence_steps import sequence_liability_check
-from ab_characterisation.structure_steps import run_abb2, run_chimerax_superposition, run_tap
+from ab_characterisation.rosetta_steps import (
+    prune_relaxed_complexes,
+    rosetta_antibody_batch_step,
+    rosetta_antibody_step,
+    rosetta_complex_batch_step,
+    rosetta_complex_step,
+    rosetta_slots,
+)
+from ab_characterisation.sequence_steps import (
+    sequence_liability_check, tap_cdr_length_batch_check, tap_cdr_length_check
+)
+from ab_characterisation.structure_steps import run_abb2, run_abb2_batch, run_chimerax_superposition, run_tap
 
 
 def get_objects(config: RunConfig) -> list[BiologicsData]:
@@ -37,11 +53,306 @@ def get_objects(config: RunConfig) -> list[BiologicsData]:
     return data_objects
 
 
+@dataclass
+class PipelineStage:
+    """A single step of the pipeline, either computing new dataclass fields or filtering datapoints."""
+
+    name: str
+    description: str
+    function: t.Callable
+    is_filter: bool = False
+    # Whether the stage only depends on the heavy/light sequence pair, rather than on the reference complex
+    fv_level: bool = True
+    # Optional function mapping list[BiologicsData] -> list[BiologicsData], used instead of function when running the
+    # stage on batch_size datapoints at a time
+    batch_function: t.Optional[t.Callable] = None
+    batch_size: int = 1
+
+
+def get_pipeline_stages(config: RunConfig) -> list[PipelineStage]:
+    """
+    Returns the ordered list of pipeline stages to run for the given configuration.
+
+    Args:
+        config:
+
+    Returns:
+        list of PipelineStage objects
+    """
+    stages = [
+        PipelineStage("sequence_liabilities", "Identifying sequence liabilities", sequence_liability_check),
+        PipelineStage("liabilities", "Filtering by sequence liabilities", sequence_liability_filter, is_filter=True),
+    ]
+    if config.tap_early_exit:
+        # The total CDR length only needs the sequence numbering, so antibodies it flags RED can skip ABB2 altogether
+        stages += [
+            PipelineStage(
+                "tap_cdr_length_metric",
+                "Calculating total CDR length from sequence numbering",
+                tap_cdr_length_check,
+                batch_function=tap_cdr_length_batch_check,
+                batch_size=config.abb2_batch_size,
+            ),
+            PipelineStage("tap_cdr_length", "Filtering by total CDR length", tap_filter, is_filter=True),
+        ]
+    stages += [
+        PipelineStage(
+            "abb2", "Running ABB2", run_abb2, batch_function=run_abb2_batch, batch_size=config.abb2_batch_size
+        ),
+        PipelineStage("tap_metrics", "Running TAP", run_tap),
+        PipelineStage("tap", "Filtering TAP", tap_filter, is_filter=True),
+        PipelineStage(
+            "rosetta_ab_only",
+            "Running antibody-only Rosetta analysis",
+            rosetta_antibody_step,
+            batch_function=rosetta_antibody_batch_step,
+            batch_size=config.rosetta_batch_size,
+        ),
+        PipelineStage(
+            "rosetta_antibody",
+            "Running filtering based on antibody-only Rosetta analysis",
+            rosetta_antibody_filter,
+            is_filter=True,
+        ),
+    ]
+    if not config.exclude_complex_analysis:
+        stages += [
+            PipelineStage(
+                "chimerax", "Running ChimeraX complex generation", run_chimerax_superposition, fv_level=False
+            ),
+            PipelineStage(
+                "rosetta_complex",
+                "Running Rosetta complex analysis",
+                rosetta_complex_step,
+                fv_level=False,
+                batch_function=rosetta_complex_batch_step,
+                batch_size=config.rosetta_batch_size,
+            ),
+        ]
+    return stages
+
+
+def run_computation_stage(
+    biol_data: BiologicsData,
+    config: RunConfig,
+    stage_name: str,
+    computation_function: t.Callable,
+) -> BiologicsData:
+    """
+    Runs a computation stage on a single datapoint unless it was already completed in a previous run, and checkpoints
+    the resulting state so that the run can be resumed.
+
+    Args:
+        biol_data:
+        config:
+        stage_name: name under which completion of the stage is recorded
+        computation_function: Function mapping BiologicsData -> BiologicsData
+
+    Returns:
+        the updated BiologicsData object
+    """
+    if stage_name in biol_data.completed_stages:
+        return biol_data
+    biol_data, timing = timed_call(stage_name, computation_function, biol_data, config)
+    biol_data.stage_timings.append(timing)
+    biol_data.completed_stages.append(stage_name)
+    save_checkpoint(biol_data, config)
+    return biol_data
+
+
+def run_computation_stage_batch(
+    biol_data_ls: list[BiologicsData],
+    config: RunConfig,
+    stage_name: str,
+    batch_function: t.Callable,
+) -> list[BiologicsData]:
+    """
+    Runs a computation stage on a batch of datapoints, skipping those that already completed it in a previous run, and
+    checkpoints the resulting states. The resources used by the batch are split evenly between its datapoints in
+    their stage timings.
+
+    Args:
+        biol_data_ls:
+        config:
+        stage_name: name under which completion of the stage is recorded
+        batch_function: Function mapping list[BiologicsData] -> list[BiologicsData]
+
+    Returns:
+        the updated BiologicsData objects, in the same order
+    """
+    pending = [
+        idx for idx, biol_data in enumerate(biol_data_ls) if stage_name not in biol_data.completed_stages
+    ]
+    if not pending:
+        return biol_data_ls
+
+    output_data = list(biol_data_ls)
+    results, timing = timed_call(
+        stage_name, batch_function, [biol_data_ls[idx] for idx in pending], config
+    )
+    for idx, biol_data in zip(pending, results):
+        biol_data.stage_timings.append(
+            replace(
+                timing,
+                wall_time=timing.wall_time / len(pending),
+                cpu_time=timing.cpu_time / len(pending),
+                subprocess_time=timing.subprocess_time / len(pending),
+                worker_pool_cpu_time=timing.worker_pool_cpu_time / len(pending),
+            )
+        )
+        biol_data.completed_stages.append(stage_name)
+        save_checkpoint(biol_data, config)
+        output_data[idx] = biol_data
+    return output_data
+
+
+def run_stages(
+    biol_data: BiologicsData, config: RunConfig, stages: list[PipelineStage]
+) -> BiologicsData:
+    """
+    Runs a single datapoint through all the given stages in turn, applying filters inline and stopping as soon as the
+    datapoint is discarded.
+
+    Args:
+        biol_data:
+        config:
+        stages: ordered list of stages to run
+
+    Returns:
+        the updated BiologicsData object
+    """
+    for stage in stages:
+        if biol_data.discarded_by is not None:
+            break
+        if stage.is_filter:
+            filtered, timing = timed_call(stage.name, stage.function, biol_data, config)
+            biol_data.stage_timings.append(timing)
+            if filtered:
+                biol_data.discarded_by = stage.name
+        else:
+            biol_data = run_computation_stage(biol_data, config, stage.name, stage.function)
+    return biol_data
+
+
+# Dataclass fields set by the stages that only depend on the heavy/light sequence pair
+FV_LEVEL_FIELDS = (
+    "sequence_liabilities",
+    "chain_numbering",
+    "antibody_structure",
+    "tap_flags",
+    "rosetta_output_ab_only",
+    "discarded_by",
+    "completed_stages",
+)
+
+
+# Dataclass fields set by the stages that depend on the reference complex
+COMPLEX_LEVEL_FIELDS = (
+    "chimerax_complex_structure",
+    "rosetta_output_complex",
+    "discarded_by",
+    "completed_stages",
+)
+
+
+def _fv_key(biol_data: BiologicsData) -> tuple:
+    return biol_data.heavy_sequence, biol_data.light_sequence
+
+
+def _complex_key(biol_data: BiologicsData) -> tuple:
+    return (
+        biol_data.heavy_sequence,
+        biol_data.light_sequence,
+        biol_data.target_complex_reference,
+        biol_data.target_complex_antigen_chains,
+        biol_data.target_complex_antibody_chains,
+    )
+
+
+def _group_duplicates(biol_data_ls: list[BiologicsData], key: t.Callable) -> dict[int, list[int]]:
+    first_occurrences: dict[t.Any, int] = {}
+    duplicates: dict[int, list[int]] = {}
+    for idx, biol_data in enumerate(biol_data_ls):
+        biol_data_key = key(biol_data)
+        if biol_data_key in first_occurrences:
+            duplicates.setdefault(first_occurrences[biol_data_key], []).append(idx)
+        else:
+            first_occurrences[biol_data_key] = idx
+    return duplicates
+
+
+def group_identical_fvs(biol_data_ls: list[BiologicsData]) -> dict[int, list[int]]:
+    """
+    Groups datapoints with identical heavy and light sequences.
+
+    Args:
+        biol_data_ls:
+
+    Returns:
+        the indices of the duplicate datapoints, keyed by the index of the first datapoint with the same sequences
+    """
+    return _group_duplicates(biol_data_ls, _fv_key)
+
+
+def group_identical_complexes(biol_data_ls: list[BiologicsData]) -> dict[int, list[int]]:
+    """
+    Groups datapoints with identical heavy and light sequences and reference complex, for which the complex stages
+    give the same results.
+
+    Args:
+        biol_data_ls:
+
+    Returns:
+        the indices of the duplicate datapoints, keyed by the index of the first datapoint with the same sequences and
+        reference complex
+    """
+    return _group_duplicates(biol_data_ls, _complex_key)
+
+
+def _unique_indices(n_datapoints: int, duplicates: dict[int, list[int]]) -> list[int]:
+    duplicate_indices = {idx for idx_ls in duplicates.values() for idx in idx_ls}
+    return [idx for idx in range(n_datapoints) if idx not in duplicate_indices]
+
+
+def run_stages_deduplicated(
+    biol_data_ls: list[BiologicsData], config: RunConfig, stages: list[PipelineStage]
+) -> list[BiologicsData]:
+    """
+    Runs a group of datapoints with identical heavy and light sequences through all the given stages, as a single
+    streamed unit. The stages that only depend on the sequences are run for the first datapoint, and their results
+    copied to the others as soon as they are ready; the remaining stages are run once per reference complex.
+
+    Args:
+        biol_data_ls: datapoints sharing their heavy and light sequences
+        config:
+        stages: ordered list of stages to run, starting with the sequence-only stages
+
+    Returns:
+        the updated BiologicsData objects, in the same order
+    """
+    source = run_stages(biol_data_ls[0], config, [stage for stage in stages if stage.fv_level])
+    copy_datapoint_fields(source, biol_data_ls[1:], FV_LEVEL_FIELDS)
+    output_data = [source] + biol_data_ls[1:]
+
+    complex_stages = [stage for stage in stages if not stage.fv_level]
+    complex_duplicates = _group_duplicates(output_data, _complex_key)
+    duplicate_indices = {idx for idx_ls in complex_duplicates.values() for idx in idx_ls}
+    for idx in range(len(output_data)):
+        if idx not in duplicate_indices:
+            output_data[idx] = run_stages(output_data[idx], config, complex_stages)
+    for source_idx, duplicate_idx_ls in complex_duplicates.items():
+        copy_datapoint_fields(
+            output_data[source_idx], [output_data[idx] for idx in duplicate_idx_ls], COMPLEX_LEVEL_FIELDS
+        )
+    return output_data
+
+
 def filtering_step(
     input_data: list[BiologicsData],
     step_name: str,
     criterion_function: t.Callable,
     config: RunConfig,
+    executor: t.Optional[Executor] = None,
 ) -> list[BiologicsData]:
     """
     General framework for a step that performs filtering of the input data, labelling datapoints as discarded if they
@@ -51,27 +362,39 @@ def filtering_step(
         step_name:
         criterion_function: Function mapping BiologicsData -> bool
         config:
+        executor: backend used by the preceding computation steps. If provided, each datapoint is only filtered by
+            the process holding its full payload.
 
     Returns:
         list of BiologicsData objects
     """
     output_data: list[BiologicsData] = []
-    filter_count = 0
+    previously_discarded = [biol_data.discarded_by is not None for biol_data in input_data]
 
-    for biol_data in input_data:
-        if biol_data.discarded_by is None:
-            filtered = criterion_function(biol_data, config)
+    for idx, biol_data in enumerate(input_data):
+        if biol_data.discarded_by is None and (executor is None or executor.owns(idx)):
+            filtered, timing = timed_call(step_name, criterion_function, biol_data, config)
+            biol_data.stage_timings.append(timing)
             if filtered:
                 biol_data.discarded_by = step_name
-                filter_count += 1
         output_data.append(biol_data)
 
+    if executor is not None:
+        output_data = executor.sync_status(output_data)
+    filter_count = sum(
+        not discarded and biol_data.discarded_by is not None
+        for discarded, biol_data in zip(previously_discarded, output_data)
+    )
     logger.info(f"{filter_count} datapoints discarded during step {step_name}.")
     return output_data
 
 
 def computation_step(
-    input_data: list[BiologicsData], computation_function: t.Callable, config: RunConfig
+    input_data: list[BiologicsData],
+    computation_function: t.Callable,
+    config: RunConfig,
+    executor: t.Optional[Executor] = None,
+    indices: t.Optional[t.Collection[int]] = None,
 ) -> list[BiologicsData]:
     """
     General framework for a step that performs computation on the input data, manipulating one or more of the dataclass
@@ -82,53 +405,94 @@ def computation_step(
         computation_function: Function mapping BiologicsData -> BiologicsData, modifying the dataclass fields with the
             results of the computation
         config:
+        executor: backend used to run the computation. If not provided, one is created from the run configuration
+            for the duration of this step.
+        indices: if provided, only the datapoints with these indices are computed
 
     Returns:
         list of BiologicsData objects
     """
+    if executor is not None:
+        return executor.map(input_data, computation_function, config, indices)
 
-    comm = MPI.COMM_WORLD
-    rank = comm.Get_rank()
-    size = comm.Get_size()
+    executor = get_executor(config)
+    try:
+        return executor.map(input_data, computation_function, config, indices)
+    finally:
+        executor.shutdown()
 
-    # Calculate the chunk size for each process
-    chunk_size = len(input_data) // size
-    remainder = len(input_data) % size
 
-    # Calculate the range for the current process
-    local_start = rank * chunk_size + min(rank, remainder)
-    local_end = local_start + chunk_size + (1 if rank < remainder else 0)
+def batched_computation_step(
+    input_data: list[BiologicsData],
+    batch_function: t.Callable,
+    config: RunConfig,
+    batch_size: int,
+    executor: t.Optional[Executor] = None,
+    indices: t.Optional[t.Collection[int]] = None,
+    groups: t.Optional[list[list[int]]] = None,
+) -> list[BiologicsData]:
+    """
+    Counterpart of computation_step for computations that are more efficient on several datapoints at once, applied to
+    batches of up to batch_size datapoints.
 
-    # Perform the local computation
-    local_results: list[BiologicsData] = []
-    for biol_data in input_data[local_start:local_end]:
-        if biol_data.discarded_by is None:
-            biol_data = computation_function(biol_data, config)
-        local_results.append(biol_data)
+    Args:
+        input_data:
+        batch_function: Function mapping list[BiologicsData] -> list[BiologicsData], modifying the dataclass fields
+            with the results of the computation
+        config:
+        batch_size: maximum number of datapoints per batch
+        executor: backend used to run the computation. If not provided, one is created from the run configuration
+            for the duration of this step.
+        indices: if provided, only the datapoints with these indices are computed
+        groups: if provided, each group of indices is handed to the batch function as one batch, regardless of
+            batch_size and indices
 
-    # Gather the local results at the root process
-    all_results = comm.gather(local_results, root=0)
+    Returns:
+        list of BiologicsData objects
+    """
+    if executor is not None:
+        return executor.map_batches(input_data, batch_function, config, batch_size, indices, groups)
 
-    # Combine the results into a single list
-    output_data: list[BiologicsData] = []
-    if rank == 0:
-        for result_list in all_results:
-            output_data.extend(result_list)
-    output_data = comm.bcast(output_data, root=0)
-    return output_data
+    executor = get_executor(config)
+    try:
+        return executor.map_batches(input_data, batch_function, config, batch_size, indices, groups)
+    finally:
+        executor.shutdown()
 
 
-def pipeline(config: RunConfig, mpi_rank: int, mpi_size: int) -> None:
+def pipeline(config: RunConfig, mpi_rank: t.Optional[int] = None, mpi_size: t.Optional[int] = None) -> None:
     """
+    Runs the full pipeline, using the execution backend selected in the run configuration.
 
     Args:
         config:
+        mpi_rank: deprecated and ignored; the MPI backend reads the rank from MPI.COMM_WORLD
+        mpi_size: deprecated and ignored; the MPI backend reads the size from MPI.COMM_WORLD
 
     Returns:
 
     """
+    if mpi_rank is not None or mpi_size is not None:
+        warnings.warn(
+            "The mpi_rank and mpi_size arguments of pipeline are deprecated and ignored; select the execution "
+            "backend with RunConfig.backend instead.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+    executor = get_executor(config)
+    if config.rosetta_slots is None:
+        config.rosetta_slots = rosetta_slots(executor.local_workers)
+    try:
+        executor.set_worker_initializer(start_rosetta_pool, config)
+        _run_pipeline(config, executor)
+    finally:
+        shutdown_rosetta_pool()
+        executor.shutdown()
+
+
+def _run_pipeline(config: RunConfig, executor: Executor) -> None:
     logger.remove()
-    if mpi_rank == 0:
+    if executor.is_root:
         logger.add(
             sys.stdout,
             format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {message}",
@@ -141,44 +505,101 @@ def pipeline(config: RunConfig, mpi_rank: int, mpi_size: int) -> None:
             level="WARNING",
         )
     biologics_objects = get_objects(config)
+    if config.resume:
+        biologics_objects = restore_checkpoints(biologics_objects, config)
+    stages = get_pipeline_stages(config)
 
-    logger.info("Identifying sequence liabilities")
-    biologics_objects = computation_step(
-        biologics_objects, sequence_liability_check, config
-    )
-    logger.info("Filtering by sequence liabilities")
-    biologics_objects = filtering_step(
-        biologics_objects,
-        step_name="liabilities",
-        criterion_function=sequence_liability_filter,
-        config=config,
-    )
-
-    logger.info("Running ABB2")
-    biologics_objects = computation_step(biologics_objects, run_abb2, config)
-    logger.info("Running TAP")
-    biologics_objects = computation_step(biologics_objects, run_tap, config)
-    logger.info("Filtering TAP")
-    biologics_objects = filtering_step(biologics_objects, "tap", tap_filter, config)
-    logger.info("Running antibody-only Rosetta analysis")
-    biologics_objects = computation_step(
-        biologics_objects, rosetta_antibody_step, config
-    )
-    logger.info("Running filtering based on antibody-only Rosetta analysis")
-    biologics_objects = filtering_step(
-        biologics_objects, "rosetta_antibody", rosetta_antibody_filter, config
-    )
-    if not config.exclude_complex_analysis:
-        logger.info("Running ChimeraX complex generation")
-        biologics_objects = computation_step(
-            biologics_objects, run_chimerax_superposition, config
+    # Stages that only depend on the heavy/light sequences are run once per unique Fv, and the complex stages once per
+    # unique Fv and reference complex; their results are copied to all datapoints sharing the same inputs
+    if config.deduplicate_sequences:
+        duplicates = group_identical_fvs(biologics_objects)
+        complex_duplicates = group_identical_complexes(biologics_objects)
+    else:
+        duplicates, complex_duplicates = {}, {}
+    unique_indices = _unique_indices(len(biologics_objects), duplicates)
+    unique_complex_indices = _unique_indices(len(biologics_objects), complex_duplicates)
+    if duplicates:
+        logger.info(
+            f"{len(biologics_objects) - len(unique_indices)} datapoints share their sequences with another datapoint; "
+            f"sequence-only steps are run for {len(unique_indices)} unique sequence pairs, and complex steps for "
+            f"{len(unique_complex_indices)} unique sequence pair and reference complex combinations."
         )
-        logger.info("Running Rosetta complex analysis")
-        biologics_objects = computation_step(
-            biologics_objects, rosetta_complex_step, config
+
+    if config.streaming:
+        logger.info("Running all pipeline stages per antibody")
+        # Datapoints sharing their sequences are streamed through the pipeline together, as one unit of work
+        groups = [[idx] + duplicates.get(idx, []) for idx in unique_indices]
+        biologics_objects = batched_computation_step(
+            biologics_objects,
+            partial(run_stages_deduplicated, stages=stages),
+            config,
+            1,
+            executor,
+            groups=groups,
         )
+        for stage in stages:
+            if stage.is_filter:
+                filter_count = sum(
+                    biol_data.discarded_by == stage.name for biol_data in biologics_objects
+                )
+                logger.info(f"{filter_count} datapoints discarded during step {stage.name}.")
+    else:
+        for stage in stages:
+            logger.info(stage.description)
+            if stage.is_filter:
+                biologics_objects = filtering_step(
+                    biologics_objects, stage.name, stage.function, config, executor
+                )
+                continue
 
-    if mpi_rank == 0:
+            stage_duplicates = duplicates if stage.fv_level else complex_duplicates
+            indices = None
+            if stage_duplicates:
+                indices = unique_indices if stage.fv_level else unique_complex_indices
+            if stage.batch_function is not None and stage.batch_size > 1:
+                biologics_objects = batched_computation_step(
+                    biologics_objects,
+                    partial(
+                        run_computation_stage_batch,
+                        stage_name=stage.name,
+                        batch_function=stage.batch_function,
+                    ),
+                    config,
+                    stage.batch_size,
+                    executor,
+                    indices=indices,
+                )
+            else:
+                biologics_objects = computation_step(
+                    biologics_objects,
+                    partial(
+                        run_computation_stage,
+                        stage_name=stage.name,
+                        computation_function=stage.function,
+                    ),
+                    config,
+                    executor,
+                    indices=indices,
+                )
+            if stage_duplicates:
+                biologics_objects = executor.copy_fields(
+                    biologics_objects,
+                    stage_duplicates,
+                    FV_LEVEL_FIELDS if stage.fv_level else COMPLEX_LEVEL_FIELDS,
+                )
+
+    biologics_objects = executor.collect(biologics_objects)
+    if executor.is_root:
         logger.info("Identifying top N candidates")
         biologics_objects = find_top_n(biologics_objects, config)
+        prune_relaxed_complexes(biologics_objects, config)
         save_output(biol_data_ls=biologics_objects, config=config)
+        write_timing_report(
+            {biol_data.name: biol_data.stage_timings for biol_data in biologics_objects},
+            config.output_directory,
+        )
+
+        cache = get_result_cache(config)
+        if cache is not None:
+            evicted = cache.prune()
+            logger.info(f"Evicted {evicted} entries from the result cache.")
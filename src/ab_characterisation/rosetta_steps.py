@@ -1,11 +1,130 @@
+import hashlib
+import os
+import shlex
 import shutil
 import subprocess
 import tempfile
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
+from string import Template
+from typing import Optional
 
 import pandas as pd
+from loguru import logger
 
 from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+from ab_characterisation.utils.result_cache import get_result_cache, tool_version
+from ab_characterisation.utils.rosetta_pool import get_rosetta_pool
+
+TEMPLATE_DIRECTORY = Path(__file__).parent / "utils" / "rosetta_templates"
+
+
+@lru_cache(maxsize=None)
+def _load_template(template: str) -> Template:
+    """Reads the argument template of a Rosetta script, once per process."""
+    return Template((TEMPLATE_DIRECTORY / f"{template}.args").read_text())
+
+
+def _render_arguments(template: str, variables: dict[str, t.Union[str, list[str]]]) -> list[str]:
+    """
+    Substitutes the variables of a Rosetta argument template, returning the command as a list of arguments. Variables
+    given as lists are substituted as several arguments.
+    """
+    quoted = {
+        key: shlex.join(value) if isinstance(value, list) else shlex.quote(str(value))
+        for key, value in variables.items()
+    }
+    return shlex.split(_load_template(template).substitute(quoted), comments=True)
+
+
+@lru_cache(maxsize=None)
+def _protocol_file(template: str, output_directory: Path) -> Path:
+    """
+    Writes the XML protocol of a Rosetta template to the rosetta_protocols directory of the run, once per process, and
+    returns its absolute path, which all Rosetta jobs of the run reference.
+    """
+    protocol_path = (output_directory / "rosetta_protocols" / f"{template}.xml").resolve()
+    protocol_path.parent.mkdir(exist_ok=True)
+    protocol = (TEMPLATE_DIRECTORY / f"{template}.xml").read_text()
+    if not protocol_path.exists() or protocol_path.read_text() != protocol:
+        # Written under a unique name and renamed, as processes of the run, and the Rosetta threads of each process, may
+        # write the same protocol concurrently
+        temp_path = protocol_path.with_name(f"{protocol_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(protocol)
+        os.replace(temp_path, protocol_path)
+    return protocol_path
+
+
+def _output_options(structure_directory: Optional[Path]) -> list[str]:
+    """Rosetta output options: only the score file is written, unless the output structures are kept."""
+    if structure_directory is None:
+        return ["-out:file:score_only", "score.sc"]
+    return []
+
+
+def _run_rosetta_replicate(
+    biol_data: BiologicsData,
+    variables: dict[str, str],
+    template: str,
+    config: RunConfig,
+    step_name: str,
+    replicate: int,
+    structure_directory: Optional[Path] = None,
+) -> pd.DataFrame:
+    """
+    Runs one replicate of a Rosetta script in its own temporary directory and returns its scores. If a structure
+    directory is given, the output structure is moved to it as {name}_{replicate:04d}.pdb, counting from one.
+    """
+    arguments = _render_arguments(
+        template,
+        {
+            **variables,
+            "protocol": str(_protocol_file(template, config.output_directory)),
+            "output_options": _output_options(structure_directory),
+        },
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        with open(
+            config.output_directory
+            / "logs"
+            / f"{biol_data.name}_rosetta_{step_name}_{replicate}.log",
+            "w",
+        ) as outf:
+            subprocess.run(arguments, cwd=temp_dir, stdout=outf, stderr=outf)
+        output = pd.read_csv(
+            Path(temp_dir) / "score.sc", sep=r"\s+", skiprows=1
+        )
+        output["replicate"] = replicate
+        if structure_directory is not None:
+            for structure_path in Path(temp_dir).glob("*.pdb"):
+                shutil.move(structure_path, structure_directory / f"{biol_data.name}_{replicate + 1:04d}.pdb")
+        return output
+
+
+def _pool_protocol(template: str, config: RunConfig) -> Path:
+    """
+    Protocol of a template run on the Rosetta worker pool. This is the batch variant, which takes the input pose rather
+    than -in:file:native as the reference of its metrics.
+    """
+    return _protocol_file(f"{template}_batch", config.output_directory)
+
+
+def _structure_prefix(structure_directory: Optional[Path], biol_data: BiologicsData) -> Optional[str]:
+    """Prefix of the output structures of a Rosetta worker pool job, if they are kept."""
+    if structure_directory is None:
+        return None
+    return str(structure_directory / biol_data.name)
+
+
+def _pool_output(scores: pd.DataFrame) -> pd.DataFrame:
+    """Adds the replicate column to the scores of a Rosetta worker pool job, as for generic_rosetta_step."""
+    scores["replicate"] = range(len(scores))
+    scores.index = [0] * len(scores)
+    return scores
 
 
 def generic_rosetta_step(
@@ -15,8 +134,11 @@ def generic_rosetta_step(
     config: RunConfig,
     step_name: str,
     replicates: int = 1,
+    structure_directory: Optional[Path] = None,
 ) -> pd.DataFrame:
     """
+    Runs the replicates of a Rosetta script as concurrent subprocesses, at most config.rosetta_slots at a time, or on
+    the Rosetta worker pool if the run uses one.
     Args:
         biol_data:
         variables:
@@ -24,48 +146,211 @@ def generic_rosetta_step(
         config:
         step_name:
         replicates:
+        structure_directory: if provided, the output structure of each replicate is kept in this directory, as
+            {name}_{replicate:04d}.pdb. Otherwise Rosetta only writes scores.
 
     Returns:
 
     """
-    outputs = []
-    for replicate in range(replicates):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            bash_template_path = (
-                Path(__file__).parent / "utils" / "rosetta_templates" / f"{template}.sh"
+    pool = get_rosetta_pool(config)
+    if pool is not None:
+        return _pool_output(
+            pool.submit(
+                _pool_protocol(template, config),
+                variables["input_file"],
+                replicates,
+                _structure_prefix(structure_directory, biol_data),
+            ).result()
+        )
+
+    slots = max(1, min(replicates, config.rosetta_slots or 1))
+    with ThreadPoolExecutor(max_workers=slots) as pool:
+        futures = [
+            pool.submit(
+                _run_rosetta_replicate,
+                biol_data,
+                variables,
+                template,
+                config,
+                step_name,
+                replicate,
+                structure_directory,
+            )
+            for replicate in range(replicates)
+        ]
+        outputs = [future.result() for future in as_completed(futures)]
+    outputs.sort(key=lambda output: output["replicate"].iloc[0])
+    return pd.concat(outputs)
+
+
+def _run_rosetta_batch(
+    input_files: list[str],
+    template: str,
+    config: RunConfig,
+    log_name: str,
+    replicates: int,
+    structure_directory: Optional[Path] = None,
+    structure_names: Optional[list[str]] = None,
+) -> pd.DataFrame:
+    """
+    Runs the batch variant of a Rosetta script once over a list of input structures, with -nstruct replicates of
+    each, and returns the scores of all of them. Rosetta names each output {input stem}_{replicate:04d}, counting
+    replicates from one. If a structure directory is given, the output structures are moved to it, named after
+    structure_names, one per input, rather than the input stems.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_list = Path(temp_dir) / "inputs.txt"
+        input_list.write_text("".join(f"{input_file}\n" for input_file in input_files))
+        arguments = _render_arguments(
+            f"{template}_batch",
+            {
+                "input_list": str(input_list),
+                "nstruct": str(replicates),
+                "rosetta_base_dir": config.rosetta_base_directory,
+                "protocol": str(_protocol_file(f"{template}_batch", config.output_directory)),
+                "output_options": _output_options(structure_directory),
+            },
+        )
+
+        with open(config.output_directory / "logs" / f"{log_name}.log", "w") as outf:
+            subprocess.run(arguments, cwd=temp_dir, stdout=outf, stderr=outf)
+        if structure_directory is not None:
+            for input_file, structure_name in zip(input_files, structure_names):
+                for structure_path in Path(temp_dir).glob(f"{Path(input_file).stem}_[0-9][0-9][0-9][0-9].pdb"):
+                    replicate = structure_path.stem.rsplit("_", 1)[1]
+                    shutil.move(structure_path, structure_directory / f"{structure_name}_{replicate}.pdb")
+        score_path = Path(temp_dir) / "score.sc"
+        if not score_path.exists():
+            return pd.DataFrame(columns=["description"])
+        return pd.read_csv(score_path, sep=r"\s+", skiprows=1)
+
+
+def generic_rosetta_batch_step(
+    biol_data_ls: list[BiologicsData],
+    input_files: list[str],
+    template: str,
+    config: RunConfig,
+    step_name: str,
+    replicates: int = 1,
+    structure_directory: Optional[Path] = None,
+) -> dict[str, pd.DataFrame]:
+    """
+    Runs a Rosetta script on a batch of input structures with as few Rosetta processes as possible: the batch is split
+    into at most config.rosetta_slots chunks, each scored by one concurrent Rosetta process that loads the database and
+    parses the protocol once for all of its inputs and replicates. Datapoints whose scores are missing from the batch
+    output, e.g. because Rosetta failed on another input of the chunk, are rerun on their own. If the run uses a
+    Rosetta worker pool, each datapoint is submitted to it as a separate job instead.
+    Args:
+        biol_data_ls:
+        input_files: input structure of each datapoint, in the same order. Their file names must be unique within the
+            batch.
+        template:
+        config:
+        step_name:
+        replicates:
+        structure_directory: as for generic_rosetta_step
+
+    Returns:
+        scores of each datapoint, keyed by name, in the same format as generic_rosetta_step
+    """
+    pool = get_rosetta_pool(config)
+    if pool is not None:
+        futures = [
+            pool.submit(
+                _pool_protocol(template, config), input_file, replicates, _structure_prefix(structure_directory, biol_data)
             )
-            xml_template_path = (
-                Path(__file__).parent
-                / "utils"
-                / "rosetta_templates"
-                / f"{template}.xml"
+            for biol_data, input_file in zip(biol_data_ls, input_files)
+        ]
+        return {
+            biol_data.name: _pool_output(future.result()) for biol_data, future in zip(biol_data_ls, futures)
+        }
+
+    slots = max(1, min(len(biol_data_ls), config.rosetta_slots or 1))
+    chunks = [
+        list(range(len(biol_data_ls)))[chunk * len(biol_data_ls) // slots:(chunk + 1) * len(biol_data_ls) // slots]
+        for chunk in range(slots)
+    ]
+    with ThreadPoolExecutor(max_workers=slots) as pool:
+        futures = [
+            pool.submit(
+                _run_rosetta_batch,
+                [input_files[idx] for idx in chunk],
+                template,
+                config,
+                f"{biol_data_ls[chunk[0]].name}_rosetta_{step_name}_batch",
+                replicates,
+                structure_directory,
+                [biol_data_ls[idx].name for idx in chunk],
             )
+            for chunk in chunks
+        ]
+        scores = pd.concat([future.result() for future in futures], ignore_index=True)
 
-            with open(bash_template_path) as inf_sh, open(
-                Path(temp_dir) / f"{template}.sh", "w"
-            ) as outf_sh:
-                for line in inf_sh:
-                    for key, value in variables.items():
-                        line = line.replace(key, value)
-                    outf_sh.write(line)
-
-            shutil.copy(xml_template_path, Path(temp_dir) / f"{template}.xml")
-
-            with open(
-                config.output_directory
-                / "logs"
-                / f"{biol_data.name}_rosetta_{step_name}_{replicate}.log",
-                "w",
-            ) as outf:
-                subprocess.run(
-                    ["bash", f"{template}.sh"], cwd=temp_dir, stdout=outf, stderr=outf
-                )
-            output = pd.read_csv(
-                Path(temp_dir) / "score.sc", delim_whitespace=True, skiprows=1
+    stems = scores["description"].astype(str).str.rsplit("_", n=1)
+    scores["replicate"] = pd.to_numeric(stems.str[1], errors="coerce") - 1
+    scores["stem"] = stems.str[0]
+
+    results = {}
+    for biol_data, input_file in zip(biol_data_ls, input_files):
+        output = scores[scores["stem"] == Path(input_file).stem].drop(columns="stem")
+        output = output.sort_values("replicate")
+        if sorted(output["replicate"]) != list(range(replicates)):
+            logger.warning(
+                f"Rosetta batch output is missing scores for {biol_data.name}, rerunning it on its own"
             )
-            output["replicate"] = replicate
-            outputs.append(output)
-    return pd.concat(outputs)
+            variables = {
+                "input_file": input_file,
+                "rosetta_base_dir": config.rosetta_base_directory,
+            }
+            results[biol_data.name] = generic_rosetta_step(
+                biol_data, variables, template, config, step_name, replicates, structure_directory
+            )
+            continue
+        output["replicate"] = output["replicate"].astype(int)
+        # Same index as concatenating the score files of single replicates
+        output.index = [0] * len(output)
+        results[biol_data.name] = output
+    return results
+
+
+def rosetta_slots(local_workers: int) -> int:
+    """
+    Default number of Rosetta subprocesses each worker process runs at once: the CPUs of the node shared between the
+    worker processes on it, so that replicates use idle cores without oversubscribing the node.
+
+    Args:
+        local_workers: number of worker processes on the node
+
+    Returns:
+        the number of slots, at least one
+    """
+    return max(1, (os.cpu_count() or 1) // local_workers)
+
+
+@lru_cache(maxsize=None)
+def _template_hash(template: str) -> str:
+    """
+    Hash of the Rosetta script templates and their batch variants, so that cached results are invalidated when the
+    protocol changes.
+    """
+    digest = hashlib.sha256()
+    for name in (template, f"{template}_batch"):
+        for suffix in ("args", "xml"):
+            digest.update((TEMPLATE_DIRECTORY / f"{name}.{suffix}").read_bytes())
+    return digest.hexdigest()
+
+
+def _antibody_cache_key(cache, biol_data: BiologicsData, config: RunConfig) -> str:
+    return cache.key(
+        biol_data,
+        "rosetta_ab_only",
+        {
+            "rosetta_base_directory": config.rosetta_base_directory,
+            "rosetta_replicates": config.rosetta_replicates,
+            "template": _template_hash("rosetta_metrics_ab_only"),
+            **({"pyrosetta": tool_version("pyrosetta")} if config.rosetta_worker_pool else {}),
+        },
+    )
 
 
 def rosetta_antibody_step(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
@@ -78,18 +363,30 @@ def rosetta_antibody_step(biol_data: BiologicsData, config: RunConfig) -> Biolog
     Returns:
 
     """
-    variables = {
-        "<INPUT_FILE>": str(biol_data.antibody_structure),
-        "<ROSETTA_BASE_DIR>": config.rosetta_base_directory,
-    }
-    result_df = generic_rosetta_step(
-        biol_data,
-        variables,
-        "rosetta_metrics_ab_only",
-        config,
-        step_name="ab_only",
-        replicates=config.rosetta_replicates,
-    )
+    template = "rosetta_metrics_ab_only"
+    cache = get_result_cache(config)
+    cached = None
+    if cache is not None:
+        cache_key = _antibody_cache_key(cache, biol_data, config)
+        cached = cache.get(cache_key)
+
+    if cached is not None:
+        result_df = cached["rosetta_output"]
+    else:
+        variables = {
+            "input_file": str(biol_data.antibody_structure),
+            "rosetta_base_dir": config.rosetta_base_directory,
+        }
+        result_df = generic_rosetta_step(
+            biol_data,
+            variables,
+            template,
+            config,
+            step_name="ab_only",
+            replicates=config.rosetta_replicates,
+        )
+        if cache is not None:
+            cache.put(cache_key, {"rosetta_output": result_df})
     biol_data.rosetta_output_ab_only = result_df
     result_df.to_csv(
         config.output_directory
@@ -99,6 +396,62 @@ def rosetta_antibody_step(biol_data: BiologicsData, config: RunConfig) -> Biolog
     return biol_data
 
 
+def rosetta_antibody_batch_step(biol_data_ls: list[BiologicsData], config: RunConfig) -> list[BiologicsData]:
+    """
+    Batch counterpart of rosetta_antibody_step, scoring all antibody models of the batch that are not cached with
+    generic_rosetta_batch_step.
+    Args:
+        biol_data_ls:
+        config:
+
+    Returns:
+
+    """
+    cache = get_result_cache(config)
+    cache_keys = {}
+    results = {}
+    to_run = []
+    for biol_data in biol_data_ls:
+        cached = None
+        if cache is not None:
+            cache_keys[biol_data.name] = _antibody_cache_key(cache, biol_data, config)
+            cached = cache.get(cache_keys[biol_data.name])
+        if cached is not None:
+            results[biol_data.name] = cached["rosetta_output"]
+        else:
+            to_run.append(biol_data)
+
+    if to_run:
+        results.update(
+            generic_rosetta_batch_step(
+                to_run,
+                [str(biol_data.antibody_structure) for biol_data in to_run],
+                "rosetta_metrics_ab_only",
+                config,
+                step_name="ab_only",
+                replicates=config.rosetta_replicates,
+            )
+        )
+        if cache is not None:
+            for biol_data in to_run:
+                cache.put(cache_keys[biol_data.name], {"rosetta_output": results[biol_data.name]})
+
+    for biol_data in biol_data_ls:
+        biol_data.rosetta_output_ab_only = results[biol_data.name]
+        results[biol_data.name].to_csv(
+            config.output_directory
+            / "rosetta_output"
+            / f"{biol_data.name}_rosetta_ab_only.csv"
+        )
+    return biol_data_ls
+
+
+def _relaxed_complex_directory(config: RunConfig) -> Optional[Path]:
+    if not config.keep_relaxed_complexes:
+        return None
+    return config.output_directory / "relaxed_complexes"
+
+
 def rosetta_complex_step(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
     """
 
@@ -110,8 +463,8 @@ def rosetta_complex_step(biol_data: BiologicsData, config: RunConfig) -> Biologi
 
     """
     variables = {
-        "<INPUT_FILE>": biol_data.chimerax_complex_structure,
-        "<ROSETTA_BASE_DIR>": config.rosetta_base_directory,
+        "input_file": str(biol_data.chimerax_complex_structure),
+        "rosetta_base_dir": config.rosetta_base_directory,
     }
     result_df = generic_rosetta_step(
         biol_data,
@@ -120,6 +473,7 @@ def rosetta_complex_step(biol_data: BiologicsData, config: RunConfig) -> Biologi
         config,
         step_name="complex",
         replicates=config.rosetta_replicates,
+        structure_directory=_relaxed_complex_directory(config),
     )
     biol_data.rosetta_output_complex = result_df
     result_df.to_csv(
@@ -128,3 +482,78 @@ def rosetta_complex_step(biol_data: BiologicsData, config: RunConfig) -> Biologi
         / f"{biol_data.name}_rosetta_complex.csv"
     )
     return biol_data
+
+
+def rosetta_complex_batch_step(biol_data_ls: list[BiologicsData], config: RunConfig) -> list[BiologicsData]:
+    """
+    Batch counterpart of rosetta_complex_step, scoring all complexes of the batch with generic_rosetta_batch_step.
+    Args:
+        biol_data_ls:
+        config:
+
+    Returns:
+
+    """
+    results = generic_rosetta_batch_step(
+        biol_data_ls,
+        [str(biol_data.chimerax_complex_structure) for biol_data in biol_data_ls],
+        "rosetta_metrics_complex",
+        config,
+        step_name="complex",
+        replicates=config.rosetta_replicates,
+        structure_directory=_relaxed_complex_directory(config),
+    )
+    for biol_data in biol_data_ls:
+        biol_data.rosetta_output_complex = results[biol_data.name]
+        results[biol_data.name].to_csv(
+            config.output_directory
+            / "rosetta_output"
+            / f"{biol_data.name}_rosetta_complex.csv"
+        )
+    return biol_data_ls
+
+
+def _relaxed_complex_paths(biol_data: BiologicsData, config: RunConfig) -> list[Path]:
+    """Paths of the relaxed complexes of a datapoint, one per Rosetta replicate."""
+    return [
+        _relaxed_complex_directory(config) / f"{biol_data.name}_{replicate + 1:04d}.pdb"
+        for replicate in range(config.rosetta_replicates)
+    ]
+
+
+def prune_relaxed_complexes(biol_data_ls: list[BiologicsData], config: RunConfig) -> None:
+    """
+    Deletes the relaxed complexes of all datapoints that are not among the top N candidates, once these are known.
+    Datapoints with the same sequences and reference complex share the relaxed complexes of the first of them, which
+    were written under its name only; those of top N candidates are first hard-linked (or copied) to their own names.
+    Args:
+        biol_data_ls:
+        config:
+
+    Returns:
+
+    """
+    if _relaxed_complex_directory(config) is None:
+        return
+
+    # Datapoints that Rosetta wrote relaxed complexes for, keyed by their ChimeraX complex
+    sources = {}
+    for biol_data in biol_data_ls:
+        if biol_data.chimerax_complex_structure is not None and _relaxed_complex_paths(biol_data, config)[0].exists():
+            sources.setdefault(biol_data.chimerax_complex_structure, biol_data)
+    for biol_data in biol_data_ls:
+        source = sources.get(biol_data.chimerax_complex_structure)
+        if biol_data.rank is None or source is None or source is biol_data:
+            continue
+        for source_path, path in zip(_relaxed_complex_paths(source, config), _relaxed_complex_paths(biol_data, config)):
+            if path.exists() or not source_path.exists():
+                continue
+            try:
+                os.link(source_path, path)
+            except OSError:
+                shutil.copyfile(source_path, path)
+
+    for biol_data in biol_data_ls:
+        if biol_data.rank is None:
+            for path in _relaxed_complex_paths(biol_data, config):
+                path.unlink(missing_ok=True)
@@ -1,5 +1,11 @@
+import numpy as np
+
 from ab_characterisation.developability_tools.sequence_liabilities.main import scan_single
+from ab_characterisation.developability_tools.tap.metrics import TotalCDRLengthCalculator
+from ab_characterisation.developability_tools.tap.metrics.base_calculator import MetricResult
+from ab_characterisation.utils.anarci_utils import number_chains
 from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+from ab_characterisation.utils.result_cache import get_result_cache, source_hash, tool_version
 
 
 def sequence_liability_check(
@@ -13,8 +19,106 @@ def sequence_liability_check(
     Returns:
 
     """
+    cache = get_result_cache(config)
+    if cache is not None:
+        cache_key = cache.key(
+            input_data,
+            "sequence_liabilities",
+            {
+                "source": source_hash(
+                    "developability_tools/sequence_liabilities", "developability_tools/utils", "utils/anarci_utils.py"
+                ),
+                "anarci": tool_version("anarci"),
+            },
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            input_data.sequence_liabilities = cached["sequence_liabilities"]
+            return input_data
+
     liabilities = scan_single(
         input_data.heavy_sequence, input_data.light_sequence, quiet=True
     )
     input_data.sequence_liabilities = liabilities
+    if cache is not None:
+        cache.put(cache_key, {"sequence_liabilities": liabilities})
     return input_data
+
+
+def _total_cdr_length(chain_numbering: dict[str, list]) -> MetricResult:
+    chain_ids = []
+    residue_numbers = []
+    for chain in ("H", "L"):
+        chain_ids += [chain] * len(chain_numbering[chain])
+        residue_numbers += [residue[0][0] for residue in chain_numbering[chain]]
+    return TotalCDRLengthCalculator(quiet=True).calculate_from_numbering(
+        np.array(chain_ids), np.array(residue_numbers)
+    )
+
+
+def tap_cdr_length_batch_check(
+    input_data: list[BiologicsData], config: RunConfig
+) -> list[BiologicsData]:
+    """
+    Calculates the TAP total IMGT CDR length metric from the ANARCI numbering of the sequences, numbered as for
+    ABodyBuilder2, so that antibodies with a RED flag can be discarded before their structure is modelled. The result
+    is stored in tap_flags, which the TAP stage later overwrites with all metrics. The heavy and light chains of all
+    antibodies in the batch are numbered with one ANARCI run each, and the numbering is kept in chain_numbering so that
+    ABodyBuilder2 does not number them again.
+
+    Args:
+        input_data:
+        config:
+
+    Returns:
+
+    """
+    cache = get_result_cache(config)
+    cache_keys = {}
+    to_number = []
+    for biol_data in input_data:
+        cached = None
+        if cache is not None:
+            cache_keys[biol_data.name] = cache.key(
+                biol_data,
+                "tap_cdr_length",
+                {
+                    "source": source_hash("developability_tools/tap/metrics", "utils/anarci_utils.py"),
+                    "anarci": tool_version("anarci"),
+                },
+            )
+            cached = cache.get(cache_keys[biol_data.name])
+        if cached is not None:
+            biol_data.tap_flags = cached["tap_flags"]
+            biol_data.chain_numbering = cached["chain_numbering"]
+        else:
+            to_number.append(biol_data)
+
+    if to_number:
+        heavy_numbering = number_chains([biol_data.heavy_sequence for biol_data in to_number], "H")
+        light_numbering = number_chains([biol_data.light_sequence for biol_data in to_number], "L")
+        for biol_data, heavy, light in zip(to_number, heavy_numbering, light_numbering):
+            biol_data.chain_numbering = {"H": heavy, "L": light}
+            biol_data.tap_flags = [_total_cdr_length(biol_data.chain_numbering)]
+            if cache is not None:
+                cache.put(
+                    cache_keys[biol_data.name],
+                    {"tap_flags": biol_data.tap_flags, "chain_numbering": biol_data.chain_numbering},
+                )
+    return input_data
+
+
+def tap_cdr_length_check(
+    input_data: BiologicsData, config: RunConfig
+) -> BiologicsData:
+    """
+    Single-antibody counterpart of tap_cdr_length_batch_check.
+
+    Args:
+        input_data:
+        config:
+
+    Returns:
+
+    """
+    return tap_cdr_length_batch_check([input_data], config)[0]
@@ -1,8 +1,115 @@
+from functools import lru_cache
+from pathlib import Path
+
+import torch
 from ImmuneBuilder import ABodyBuilder2
+from ImmuneBuilder.ABodyBuilder2 import Antibody
+from ImmuneBuilder.util import get_encoding
 
 from ab_characterisation.developability_tools.tap.main import run_tap as tap
+from ab_characterisation.developability_tools.utils.outputs import write_file
+from ab_characterisation.utils.anarci_utils import number_chains
 from ab_characterisation.utils.chimerax_utils import ChimeraInput, ChimeraOutput, run_chimerax
 from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+from ab_characterisation.utils.result_cache import get_result_cache, source_hash, tool_version
+from ab_characterisation.utils.structure_utils import cache_structure, parse_structure, pop_cached_structure
+
+
+@lru_cache(maxsize=None)
+def get_abb2_predictor() -> ABodyBuilder2:
+    """
+    Returns the ABodyBuilder2 predictor of the current process, loading the network weights on first use only, so that
+    each worker process loads them once rather than once per antibody.
+    """
+    return ABodyBuilder2()
+
+
+def _predict_numbered(predictor: ABodyBuilder2, numbered_sequences: dict[str, list]) -> Antibody:
+    """
+    Runs the ABodyBuilder2 networks on an antibody whose chains have already been numbered. ImmuneBuilder has no entry
+    point taking numbered chains, so this is ABodyBuilder2.predict of the ImmuneBuilder version pinned in setup.cfg,
+    without its numbering; test_structure_steps checks that the two agree.
+    """
+    sequence_dict = {
+        chain: "".join(residue[1] for residue in numbering) for chain, numbering in numbered_sequences.items()
+    }
+    with torch.no_grad():
+        encoding = torch.tensor(
+            get_encoding(sequence_dict), device=predictor.device, dtype=torch.get_default_dtype()
+        )
+        full_seq = sequence_dict["H"] + sequence_dict["L"]
+        outputs = [model(encoding, full_seq) for model in predictor.models.values()]
+    return Antibody(numbered_sequences, outputs)
+
+
+def tap_shares_abb2_process(config: RunConfig) -> bool:
+    """
+    Whether TAP runs in the same process as the ABB2 step that built each model: in streaming mode, on the serial
+    backend, or with distributed payloads. Otherwise TAP usually runs elsewhere, and ABB2 does not keep the parsed
+    models, which would take up memory without ever being read.
+    """
+    return config.streaming or config.backend == "serial" or (config.backend == "mpi" and config.distributed_payloads)
+
+
+def run_abb2_batch(biol_data_ls: list[BiologicsData], config: RunConfig) -> list[BiologicsData]:
+    """
+    Run ABodyBuilder2 on a batch of input data, save outputs and output paths. The heavy and light chains of all
+    antibodies in the batch that were not already numbered by the total CDR length check are numbered with one ANARCI
+    run each (batched numbering). The ABodyBuilder2 networks still model one antibody at a time.
+    Args:
+        biol_data_ls:
+        config:
+
+    Returns:
+
+    """
+    cache = get_result_cache(config)
+    keep_structures = tap_shares_abb2_process(config)
+    model_paths = {}
+    cache_keys = {}
+    to_predict = []
+    for biol_data in biol_data_ls:
+        model_path = config.output_directory / "antibody_models" / f"{biol_data.name}_model.pdb"
+        model_paths[biol_data.name] = model_path
+        cached = None
+        if cache is not None:
+            cache_keys[biol_data.name] = cache.key(
+                biol_data, "abb2", {"ImmuneBuilder": tool_version("ImmuneBuilder")}
+            )
+            cached = cache.get(cache_keys[biol_data.name])
+        if cached is not None:
+            model_path.write_text(cached["model"])
+            if keep_structures:
+                cache_structure(model_path, parse_structure(cached["model"]))
+        else:
+            to_predict.append(biol_data)
+
+    if to_predict:
+        predictor = get_abb2_predictor()
+        # Sequences already numbered by the total CDR length check are not numbered again
+        chain_numbering = {
+            biol_data.name: biol_data.chain_numbering for biol_data in to_predict if biol_data.chain_numbering
+        }
+        to_number = [biol_data for biol_data in to_predict if biol_data.name not in chain_numbering]
+        if to_number:
+            heavy_numbering = number_chains([biol_data.heavy_sequence for biol_data in to_number], "H")
+            light_numbering = number_chains([biol_data.light_sequence for biol_data in to_number], "L")
+            for biol_data, heavy, light in zip(to_number, heavy_numbering, light_numbering):
+                chain_numbering[biol_data.name] = {"H": heavy, "L": light}
+        for biol_data in to_predict:
+            model_path = model_paths[biol_data.name]
+            antibody = _predict_numbered(predictor, chain_numbering[biol_data.name])
+            antibody.save(str(model_path))
+            model = model_path.read_text()
+            if keep_structures:
+                # Parse the refined model once; TAP reuses the arrays rather than re-reading the file
+                cache_structure(model_path, parse_structure(model))
+            if cache is not None:
+                cache.put(cache_keys[biol_data.name], {"model": model})
+
+    for biol_data in biol_data_ls:
+        biol_data.antibody_structure = model_paths[biol_data.name].resolve()
+    return biol_data_ls
 
 
 def run_abb2(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
@@ -15,18 +122,7 @@ def run_abb2(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
     Returns:
 
     """
-    predictor = ABodyBuilder2()
-
-    sequences = {"H": biol_data.heavy_sequence, "L": biol_data.light_sequence}
-
-    antibody = predictor.predict(sequences)
-    antibody.save(
-        str(config.output_directory / "antibody_models" / f"{biol_data.name}_model.pdb")
-    )
-    biol_data.antibody_structure = (
-        config.output_directory / "antibody_models" / f"{biol_data.name}_model.pdb"
-    ).resolve()
-    return biol_data
+    return run_abb2_batch([biol_data], config)[0]
 
 
 def run_tap(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
@@ -39,8 +135,48 @@ def run_tap(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
     Returns:
 
     """
-    results = tap(biol_data.antibody_structure, outfile=None, quiet=True)
+    contributions_prefix = None
+    if config.tap_contributions:
+        contributions_prefix = str(config.output_directory / "tap_contributions" / biol_data.name)
+    # Parsed by ABB2 if it ran in this process; TAP is the last step to use it, so it is dropped from the cache here
+    structure = pop_cached_structure(biol_data.antibody_structure)
+
+    cache = get_result_cache(config)
+    if cache is not None:
+        cache_key = cache.key(
+            biol_data,
+            "tap",
+            {
+                "source": source_hash("developability_tools/tap", "utils/structure_utils.py"),
+                "sasa_engine": config.tap_sasa_engine,
+                "contributions": config.tap_contributions,
+                "stop_on_red": config.tap_early_exit,
+            },
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            biol_data.tap_flags = cached["tap_flags"]
+            for table, contents in cached.get("contributions", {}).items():
+                write_file(contents, f"{contributions_prefix}_{table}.csv")
+            return biol_data
+
+    results = tap(
+        biol_data.antibody_structure,
+        outfile=None,
+        quiet=True,
+        sasa_engine=config.tap_sasa_engine,
+        structure=structure,
+        contributions_prefix=contributions_prefix,
+        stop_on_red=config.tap_early_exit,
+    )
     biol_data.tap_flags = results
+    if cache is not None:
+        cached = {"tap_flags": results}
+        if contributions_prefix is not None and Path(f"{contributions_prefix}_residues.csv").exists():
+            cached["contributions"] = {
+                table: Path(f"{contributions_prefix}_{table}.csv").read_text() for table in ("residues", "pairs")
+            }
+        cache.put(cache_key, cached)
     return biol_data
 
 
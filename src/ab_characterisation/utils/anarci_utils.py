@@ -1,6 +1,8 @@
 from dataclasses import dataclass, field
 from typing import Optional, Union
 
+from anarci import anarci, validate_sequence
+
 from ab_characterisation.utils.anarci_region_definition_utils import (_index_to_imgt_state,
                                                       _regions)
 
@@ -186,3 +188,40 @@ def get_region(  # pylint: disable=R0911
         )
     except KeyError:
         return "?"
+
+
+def number_chains(sequences: list[str], chain: str) -> list[list]:
+    """
+    IMGT-numbers a list of heavy or light chain sequences with a single ANARCI run, applying the same sanity checks as
+    ImmuneBuilder does when numbering one sequence at a time.
+
+    Args:
+        sequences: chain sequences
+        chain: "H" or "L"
+
+    Returns:
+        the numbering of each sequence, as expected by ImmuneBuilder
+    """
+    for sequence in sequences:
+        validate_sequence(sequence)
+        assert len(sequence) > 70, f"Sequence too short to be an Ig domain. Please give whole sequence:\n{sequence}"
+
+    allow = {chain, "K"} if chain == "L" else {chain}
+    numbered, _, _ = anarci(
+        [(str(idx), sequence) for idx, sequence in enumerate(sequences)],
+        scheme="imgt",
+        output=False,
+        allow=allow,
+        allowed_species=["human", "mouse"],
+    )
+
+    numbered_sequences = []
+    for sequence, numbering in zip(sequences, numbered):
+        assert numbering, f"Sequence provided as an {chain} chain is not recognised as an {chain} chain."
+        output = [residue for residue in numbering[0][0] if residue[1] != "-"]
+        numbers = [residue[0][0] for residue in output]
+        assert (max(numbers) > 120) and (
+            min(numbers) < 8
+        ), f"Sequence missing too many residues to model correctly. Please give whole sequence:\n{sequence}"
+        numbered_sequences.append(output)
+    return numbered_sequences
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+from loguru import logger
+
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+
+# RunConfig fields that affect the results of the pipeline stages; checkpoints written under different values of any
+# of them are not reused
+CHECKPOINT_CONFIG_FIELDS = (
+    "rosetta_base_directory",
+    "chimera_map_resolution",
+    "dq_sequence_liabilities",
+    "rosetta_replicates",
+    "exclude_complex_analysis",
+    "tap_sasa_engine",
+    "tap_contributions",
+    "tap_early_exit",
+    "keep_relaxed_complexes",
+)
+
+
+def checkpoint_config_hash(config: RunConfig) -> str:
+    """Returns a hash of the run options that affect stage results, recorded with each checkpoint."""
+    options = {name: getattr(config, name) for name in CHECKPOINT_CONFIG_FIELDS}
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def checkpointing_enabled(config: RunConfig) -> bool:
+    """Checkpoints are written when requested, and always when resuming so that the run can be resumed again."""
+    return config.checkpoint or config.resume
+
+
+def _checkpoint_paths(name: str, config: RunConfig) -> tuple[Path, Path]:
+    """Returns the paths of the serialised state and of the stage completion manifest for a datapoint."""
+    checkpoint_dir = config.output_directory / "checkpoints"
+    return checkpoint_dir / f"{name}.pkl", checkpoint_dir / f"{name}.json"
+
+
+def _atomic_write(path: Path, contents: bytes) -> None:
+    """Writes a file via a temporary file, so that an interrupted run never leaves a partially written checkpoint."""
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "wb") as outf:
+        outf.write(contents)
+    os.replace(temp_path, path)
+
+
+def save_checkpoint(biol_data: BiologicsData, config: RunConfig) -> None:
+    """
+    Persists the state of a datapoint, together with a manifest of the pipeline stages it has completed and of the run
+    options they were computed with. Does nothing unless checkpointing is enabled for the run.
+
+    Args:
+        biol_data:
+        config:
+    """
+    if not checkpointing_enabled(config):
+        return
+    state_path, manifest_path = _checkpoint_paths(biol_data.name, config)
+    _atomic_write(state_path, pickle.dumps(biol_data))
+    manifest = {
+        "name": biol_data.name,
+        "completed_stages": biol_data.completed_stages,
+        "discarded_by": biol_data.discarded_by,
+        "config_hash": checkpoint_config_hash(config),
+    }
+    _atomic_write(manifest_path, json.dumps(manifest, indent=2).encode())
+
+
+def load_checkpoint(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    """
+    Returns the checkpointed state of a datapoint if one exists and matches its input sequences and the run options,
+    or the datapoint unchanged otherwise.
+
+    Args:
+        biol_data: the datapoint as read from the input file
+        config:
+
+    Returns:
+        BiologicsData object
+    """
+    state_path, manifest_path = _checkpoint_paths(biol_data.name, config)
+    if not state_path.exists() or not manifest_path.exists():
+        return biol_data
+
+    with open(manifest_path) as inf:
+        manifest = json.load(inf)
+    if manifest.get("config_hash") != checkpoint_config_hash(config):
+        logger.warning(
+            f"Checkpoint for {biol_data.name} was written with different run options, recomputing from scratch."
+        )
+        return biol_data
+
+    with open(state_path, "rb") as inf:
+        checkpointed: BiologicsData = pickle.load(inf)
+    if (
+        checkpointed.heavy_sequence != biol_data.heavy_sequence
+        or checkpointed.light_sequence != biol_data.light_sequence
+        or checkpointed.target_complex_reference != biol_data.target_complex_reference
+    ):
+        logger.warning(
+            f"Checkpoint for {biol_data.name} does not match the input file, recomputing from scratch."
+        )
+        return biol_data
+    return checkpointed
+
+
+def restore_checkpoints(
+    biol_data_ls: list[BiologicsData], config: RunConfig
+) -> list[BiologicsData]:
+    """
+    Replaces datapoints by their checkpointed state from a previous run, where available.
+
+    Args:
+        biol_data_ls:
+        config:
+
+    Returns:
+        list of BiologicsData objects
+    """
+    restored = [load_checkpoint(biol_data, config) for biol_data in biol_data_ls]
+    restored_count = sum(1 for biol_data in restored if biol_data.completed_stages)
+    logger.info(f"Restored checkpoints for {restored_count} datapoints.")
+    return restored
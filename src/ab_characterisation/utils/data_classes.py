@@ -8,6 +8,8 @@ import pandas as pd
 
 from ab_characterisation.developability_tools.sequence_liabilities.scanner_classes import \
     SequenceLiability
+from ab_characterisation.developability_tools.tap.structure_annotation import SASA_ENGINES
+from ab_characterisation.utils.profiling_utils import StageTiming
 from ab_characterisation.utils.rosetta_utils import aggregate_rosetta_metrics
 
 
@@ -21,6 +23,8 @@ class BiologicsData:
     target_complex_reference: str
     target_complex_antigen_chains: str = "A"
     target_complex_antibody_chains: str = "HL"
+    # ANARCI numbering of the "H" and "L" chains, if the sequences were numbered before modelling
+    chain_numbering: t.Optional[dict[str, list]] = None
     antibody_structure: t.Optional[str] = None
     discarded_by: t.Optional[str] = None
     tap_flags: list = field(default_factory=lambda: [])
@@ -29,6 +33,12 @@ class BiologicsData:
     chimerax_complex_structure: t.Optional[str] = None
     rosetta_output_complex: Optional[pd.DataFrame] = None
     rank: Optional[int] = None
+    completed_stages: list[str] = field(default_factory=lambda: [])
+    stage_timings: list[StageTiming] = field(default_factory=lambda: [])
+
+
+# Execution backends selectable with RunConfig.backend
+BACKENDS = ("mpi", "process", "serial")
 
 
 @dataclass
@@ -44,14 +54,46 @@ class RunConfig:
     )
     top_n: int = 100
     rosetta_replicates: int = 1
+    rosetta_slots: Optional[int] = None
+    rosetta_batch_size: int = 1
+    rosetta_worker_pool: bool = False
     exclude_complex_analysis: bool = False
+    streaming: bool = False
+    backend: str = "mpi"
+    workers: Optional[int] = None
+    distributed_payloads: bool = False
+    checkpoint: bool = False
+    resume: bool = False
+    cache_directory: Optional[Path] = None
+    cache_max_size_gb: Optional[float] = None
+    deduplicate_sequences: bool = True
+    abb2_batch_size: int = 1
+    tap_sasa_engine: str = "psa"
+    tap_contributions: bool = False
+    tap_early_exit: bool = False
+    keep_relaxed_complexes: bool = False
 
     def __post_init__(self):
+        # Checked here, before any antibody is processed, rather than when the option is first used in a worker
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {self.backend}, expected one of {', '.join(BACKENDS)}.")
+        if self.tap_sasa_engine not in SASA_ENGINES:
+            raise ValueError(
+                f"Unknown SASA engine {self.tap_sasa_engine}, expected one of {', '.join(SASA_ENGINES)}."
+            )
         self.output_directory.mkdir(exist_ok=True)
         (self.output_directory / "complex_structures").mkdir(exist_ok=True)
         (self.output_directory / "antibody_models").mkdir(exist_ok=True)
         (self.output_directory / "logs").mkdir(exist_ok=True)
         (self.output_directory / "rosetta_output").mkdir(exist_ok=True)
+        if self.checkpoint or self.resume:
+            (self.output_directory / "checkpoints").mkdir(exist_ok=True)
+        if self.keep_relaxed_complexes:
+            (self.output_directory / "relaxed_complexes").mkdir(exist_ok=True)
+
+
+# Fields used by the pipeline itself, which are not written to output.csv
+INTERNAL_FIELDS = ("chain_numbering", "completed_stages", "stage_timings")
 
 
 def save_output(biol_data_ls: list[BiologicsData], config: RunConfig) -> None:
@@ -59,7 +101,9 @@ def save_output(biol_data_ls: list[BiologicsData], config: RunConfig) -> None:
     for biol_data in biol_data_ls:
         row_dict = {}
         for key, value in biol_data.__dict__.items():
-            if isinstance(value, str):
+            if key in INTERNAL_FIELDS:
+                continue
+            elif isinstance(value, str):
                 row_dict[key] = value
             elif isinstance(value, int):
                 row_dict[key] = value
@@ -0,0 +1,192 @@
+import json
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+import typing as t
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from loguru import logger
+
+
+@dataclass
+class StageTiming:
+    """Resources used by one pipeline stage for one datapoint."""
+
+    stage: str
+    wall_time: float
+    cpu_time: float
+    subprocess_time: float
+    worker_pool_cpu_time: float
+    stage_peak_rss_mb: float
+    process_peak_rss_mb: float
+    host: str
+    pid: int
+
+
+# CPU time of the jobs run for this process by long-lived worker processes, e.g. the PyRosetta worker pool. These are
+# not accounted for by RUSAGE_CHILDREN until they exit, so the pools report it here as each job finishes.
+_worker_pool_cpu_time = 0.0
+_worker_pool_cpu_time_lock = threading.Lock()
+
+# Interval at which the resident set size is sampled while a stage runs, in seconds
+RSS_SAMPLING_INTERVAL = 0.05
+
+
+def record_worker_pool_cpu_time(cpu_time: float) -> None:
+    """Adds the CPU time of a job run by a long-lived worker process to the current stage."""
+    global _worker_pool_cpu_time
+    with _worker_pool_cpu_time_lock:
+        _worker_pool_cpu_time += cpu_time
+
+
+def _process_peak_rss_mb() -> float:
+    """Peak resident set size of the current process over its lifetime so far, in MB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return max_rss / 1024**2
+    return max_rss / 1024
+
+
+def _current_rss_mb() -> Optional[float]:
+    """Current resident set size of the current process in MB, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as inf:
+            resident_pages = int(inf.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+class _RSSSampler:
+    """Samples the resident set size of the current process in a background thread, keeping the maximum."""
+
+    def __init__(self, interval: float = RSS_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.peak_rss_mb = _current_rss_mb()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _update(self) -> None:
+        rss_mb = _current_rss_mb()
+        if rss_mb is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+
+    def _sample(self) -> None:
+        while not self._stopping.wait(self.interval):
+            self._update()
+
+    def __enter__(self) -> "_RSSSampler":
+        if self.peak_rss_mb is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        if self.peak_rss_mb is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._update()
+
+
+def _children_cpu_time() -> float:
+    """CPU time used so far by all finished subprocesses of the current process."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def timed_call(
+    stage: str, function: t.Callable, *args: t.Any, **kwargs: t.Any
+) -> tuple[t.Any, StageTiming]:
+    """
+    Calls a function, measuring its wall time, its CPU time and that of any subprocesses and worker pool jobs it ran,
+    and the peak memory usage of the process while it ran, sampled every RSS_SAMPLING_INTERVAL seconds. Where the
+    memory usage cannot be sampled (e.g. on macOS), stage_peak_rss_mb is NaN; process_peak_rss_mb is the lifetime peak
+    of the process, including earlier stages.
+
+    Args:
+        stage: name of the stage, recorded in the timing
+        function: the function to call
+        *args: positional arguments to the function
+        **kwargs: keyword arguments to the function
+
+    Returns:
+        the return value of the function, and its StageTiming
+    """
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    children_start = _children_cpu_time()
+    worker_pool_start = _worker_pool_cpu_time
+    with _RSSSampler() as rss_sampler:
+        result = function(*args, **kwargs)
+    timing = StageTiming(
+        stage=stage,
+        wall_time=time.perf_counter() - wall_start,
+        cpu_time=time.process_time() - cpu_start,
+        subprocess_time=_children_cpu_time() - children_start,
+        worker_pool_cpu_time=_worker_pool_cpu_time - worker_pool_start,
+        stage_peak_rss_mb=rss_sampler.peak_rss_mb if rss_sampler.peak_rss_mb is not None else float("nan"),
+        process_peak_rss_mb=_process_peak_rss_mb(),
+        host=socket.gethostname(),
+        pid=os.getpid(),
+    )
+    return result, timing
+
+
+def write_timing_report(
+    timings: dict[str, list[StageTiming]], output_directory: Path
+) -> pd.DataFrame:
+    """
+    Writes the per-datapoint stage timings to stage_timings.csv, a per-stage summary to stage_timings_summary.json, and
+    logs the summary table.
+
+    Args:
+        timings: stage timings, keyed by datapoint name
+        output_directory: directory in which the report files are written
+
+    Returns:
+        the per-stage summary
+    """
+    rows = [
+        {"name": name, **asdict(timing)}
+        for name, name_timings in timings.items()
+        for timing in name_timings
+    ]
+    timing_df = pd.DataFrame(
+        rows,
+        columns=[
+            "name",
+            "stage",
+            "wall_time",
+            "cpu_time",
+            "subprocess_time",
+            "worker_pool_cpu_time",
+            "stage_peak_rss_mb",
+            "process_peak_rss_mb",
+            "host",
+            "pid",
+        ],
+    )
+    timing_df.to_csv(output_directory / "stage_timings.csv", index=False)
+
+    summary_df = timing_df.groupby("stage", sort=False).agg(
+        count=("name", "count"),
+        total_wall_time=("wall_time", "sum"),
+        mean_wall_time=("wall_time", "mean"),
+        max_wall_time=("wall_time", "max"),
+        total_cpu_time=("cpu_time", "sum"),
+        total_subprocess_time=("subprocess_time", "sum"),
+        total_worker_pool_cpu_time=("worker_pool_cpu_time", "sum"),
+        max_stage_peak_rss_mb=("stage_peak_rss_mb", "max"),
+        max_process_peak_rss_mb=("process_peak_rss_mb", "max"),
+    )
+    with open(output_directory / "stage_timings_summary.json", "w") as outf:
+        json.dump(summary_df.to_dict(orient="index"), outf, indent=2)
+
+    logger.info(f"Stage timings (seconds, MB):\n{summary_df.round(2).to_string()}")
+    return summary_df
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import pickle
+import typing as t
+from dataclasses import dataclass
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Optional
+
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+PACKAGE_DIRECTORY = Path(__file__).parents[1]
+
+
+@dataclass
+class CacheEntry:
+    path: Path
+    size: int
+    last_used: float
+
+
+def tool_version(package: str) -> str:
+    """Returns the installed version of a Python package, used to invalidate cached results when tools change."""
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+@lru_cache(maxsize=None)
+def source_hash(*paths: str) -> str:
+    """
+    Returns a hash of the contents of the given files and directories of the ab_characterisation package, so that
+    cached results are invalidated whenever the code or data computing them changes, including between releases.
+
+    Args:
+        paths: paths relative to the package directory, e.g. "developability_tools/tap"
+
+    Returns:
+        hex digest of the files
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        path = PACKAGE_DIRECTORY / path
+        files = sorted(path.rglob("*")) if path.is_dir() else [path]
+        for file in files:
+            if file.is_file() and "__pycache__" not in file.parts:
+                digest.update(str(file.relative_to(PACKAGE_DIRECTORY)).encode())
+                digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+@dataclass
+class ResultCache:
+    """
+    Persistent on-disk cache of per-stage results, shared between runs. Entries are content-addressed by a hash of
+    the heavy and light sequences, the stage name and the stage parameters (relevant run configuration and tool
+    versions). Entries are evicted least-recently-used first when the cache grows beyond its maximum size.
+    """
+
+    cache_directory: Path
+    max_size_bytes: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        self.cache_directory = Path(self.cache_directory)
+        self.cache_directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(biol_data: BiologicsData, stage: str, parameters: dict[str, t.Any]) -> str:
+        """
+        Computes the cache key of a stage result for a datapoint.
+
+        Args:
+            biol_data:
+            stage: name of the pipeline stage
+            parameters: everything else the stage result depends on, e.g. run configuration fields and tool versions
+
+        Returns:
+            hex digest identifying the result
+        """
+        contents = json.dumps(
+            {
+                "heavy_sequence": biol_data.heavy_sequence,
+                "light_sequence": biol_data.light_sequence,
+                "stage": stage,
+                "parameters": parameters,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(contents.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_directory / key[:2] / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[dict[str, t.Any]]:
+        """Returns the cached result for the given key, or None on a cache miss."""
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as inf:
+                result = pickle.load(inf)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # Record the access for least-recently-used eviction. A concurrent prune may have evicted the entry since it was
+        # read, which is still a hit.
+        try:
+            path.touch()
+        except FileNotFoundError:
+            pass
+        return result
+
+    def put(self, key: str, result: dict[str, t.Any]) -> None:
+        """Stores a result under the given key."""
+        path = self._entry_path(key)
+        path.parent.mkdir(exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as outf:
+            pickle.dump(result, outf)
+        os.replace(temp_path, path)
+
+    def entries(self) -> list[CacheEntry]:
+        """Returns all cache entries, least recently used first."""
+        entries = []
+        for path in self.cache_directory.glob("*/*.pkl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted by a concurrent prune
+                continue
+            entries.append(CacheEntry(path=path, size=stat.st_size, last_used=stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def prune(self, max_size_bytes: Optional[int] = None) -> int:
+        """
+        Evicts least recently used entries until the cache is no larger than the given size.
+
+        Args:
+            max_size_bytes: size to prune to; defaults to the maximum size of the cache. If neither is set, nothing is
+                evicted.
+
+        Returns:
+            the number of evicted entries
+        """
+        max_size_bytes = max_size_bytes if max_size_bytes is not None else self.max_size_bytes
+        if max_size_bytes is None:
+            return 0
+
+        entries = self.entries()
+        total_size = sum(entry.size for entry in entries)
+        evicted = 0
+        for entry in entries:
+            if total_size <= max_size_bytes:
+                break
+            entry.path.unlink(missing_ok=True)
+            total_size -= entry.size
+            evicted += 1
+        return evicted
+
+
+@lru_cache(maxsize=None)
+def _open_result_cache(cache_directory: Path, max_size_bytes: Optional[int]) -> ResultCache:
+    """Creates the result cache of a directory once per process."""
+    return ResultCache(cache_directory, max_size_bytes=max_size_bytes)
+
+
+def get_result_cache(config: RunConfig) -> Optional[ResultCache]:
+    """Returns the result cache configured for the run, or None if caching is disabled."""
+    if config.cache_directory is None:
+        return None
+    max_size_bytes = (
+        int(config.cache_max_size_gb * 1024**3)
+        if config.cache_max_size_gb is not None
+        else None
+    )
+    return _open_result_cache(Path(config.cache_directory), max_size_bytes)
@@ -0,0 +1,339 @@
+"""
+A pool of long-running PyRosetta worker processes, as an alternative to starting a rosetta_scripts process per job.
+
+Each worker initialises PyRosetta, which loads the Rosetta database, once when it starts, and then runs RosettaScripts
+protocols on the structures it is sent until the pool is shut down. Workers that die, e.g. on a segmentation fault in
+Rosetta, are restarted and their job is retried. PyRosetta is only imported in the worker processes, so it only needs
+to be installed when the pool is used.
+"""
+import multiprocessing
+import multiprocessing.util
+import queue
+import threading
+import time
+import typing as t
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from loguru import logger
+
+from ab_characterisation.utils.data_classes import RunConfig
+from ab_characterisation.utils.profiling_utils import record_worker_pool_cpu_time
+
+# Command line options of the rosetta_scripts templates, apart from the inputs and protocol
+PYROSETTA_OPTIONS = (
+    "-beta -include_sugars -alternate_3_letter_codes pdb_sugar -load_PDB_components false "
+    "-auto_detect_glycan_connections -write_glycan_pdb_codes -output_alternate_atomids -write_pdb_link_records"
+)
+# Score function of the <OUTPUT> section of the templates, with which final scores are reported
+OUTPUT_SCORE_FUNCTION = "beta"
+# Worker id of the messages the pool sends itself to wake up the dispatcher, e.g. when a job is submitted
+_WAKEUP_ID = -1
+
+
+class RosettaPoolError(Exception):
+    pass
+
+
+@dataclass
+class RosettaJob:
+    """Replicates of a RosettaScripts protocol run on one input structure."""
+
+    protocol: str
+    input_file: str
+    replicates: int
+    structure_prefix: Optional[str] = None
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+
+
+def _worker_main(
+    worker_id: int, options: str, tasks: multiprocessing.Queue, results: multiprocessing.Queue
+) -> None:
+    """
+    Main loop of a worker process. Messages to the pool are (worker_id, job_id, succeeded, payload) tuples; job_id is
+    None for the message sent once PyRosetta is initialised. The payload of a finished job holds its score rows and
+    the CPU time the worker spent on it.
+    """
+    try:
+        import pyrosetta
+        from pyrosetta.rosetta.core.io.raw_data import ScoreMap
+        from pyrosetta.rosetta.protocols.rosetta_scripts import RosettaScriptsParser
+
+        pyrosetta.init(options, silent=True)
+        score_function = pyrosetta.create_score_function(OUTPUT_SCORE_FUNCTION)
+        parser = RosettaScriptsParser()
+    except Exception as err:
+        results.put((worker_id, None, False, repr(err)))
+        return
+    results.put((worker_id, None, True, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        job_id, protocol_path, input_file, replicates, structure_prefix = task
+        cpu_start = time.process_time()
+        try:
+            input_pose = pyrosetta.pose_from_file(input_file)
+            # As with rosetta_scripts, the protocol is parsed once per input and reused across its replicates
+            protocol = parser.generate_mover(protocol_path)
+            rows = []
+            for replicate in range(replicates):
+                pose = input_pose.clone()
+                protocol.apply(pose)
+                score_function(pose)
+                if structure_prefix is not None:
+                    pose.dump_pdb(f"{structure_prefix}_{replicate + 1:04d}.pdb")
+                rows.append(
+                    {
+                        "SCORE:": "SCORE:",
+                        **dict(ScoreMap.score_map_from_scored_pose(pose)),
+                        "description": f"{Path(input_file).stem}_{replicate + 1:04d}",
+                    }
+                )
+            results.put((worker_id, job_id, True, (rows, time.process_time() - cpu_start)))
+        except Exception as err:
+            results.put((worker_id, job_id, False, repr(err)))
+
+
+class RosettaWorkerPool:
+    """
+    Pool of PyRosetta worker processes, to which jobs are submitted from any thread. A dispatcher thread hands each
+    job to an idle worker, collects the results and checks that the workers are alive, restarting dead workers and
+    resubmitting their job up to max_retries times.
+    """
+
+    def __init__(
+        self,
+        n_workers: int,
+        options: str = PYROSETTA_OPTIONS,
+        max_retries: int = 2,
+        health_check_interval: float = 1.0,
+        startup_timeout: float = 600.0,
+    ):
+        self.n_workers = n_workers
+        self.options = options
+        self.max_retries = max_retries
+        self.health_check_interval = health_check_interval
+        self.startup_timeout = startup_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._pending: queue.Queue = queue.Queue()
+        self._workers: list[t.Optional[multiprocessing.Process]] = [None] * n_workers
+        self._task_queues: list[t.Optional[multiprocessing.Queue]] = [None] * n_workers
+        self._assigned: dict[int, t.Optional[int]] = {}
+        self._jobs: dict[int, RosettaJob] = {}
+        self._next_job_id = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        for worker_id in range(n_workers):
+            self._start_worker(worker_id)
+        self._wait_until_ready(set(range(n_workers)))
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    def _start_worker(self, worker_id: int) -> None:
+        self._task_queues[worker_id] = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.options, self._task_queues[worker_id], self._results),
+            daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = process
+        self._assigned[worker_id] = None
+
+    def _wait_until_ready(self, worker_ids: set[int]) -> None:
+        """Waits for the given workers to initialise PyRosetta, raising RosettaPoolError if any of them fails to."""
+        waiting = set(worker_ids)
+        deadline = time.monotonic() + self.startup_timeout
+        while waiting:
+            try:
+                worker_id, job_id, succeeded, payload = self._results.get(timeout=self.health_check_interval)
+                if worker_id == _WAKEUP_ID:
+                    continue
+            except queue.Empty:
+                dead = [worker_id for worker_id in waiting if not self._workers[worker_id].is_alive()]
+                if dead or time.monotonic() > deadline:
+                    self.shutdown()
+                    raise RosettaPoolError(f"Rosetta workers {sorted(dead or waiting)} did not start")
+                continue
+            if job_id is not None:
+                # A result of a job finished while another worker was restarting
+                self._handle_result(worker_id, job_id, succeeded, payload)
+                continue
+            if not succeeded:
+                self.shutdown()
+                raise RosettaPoolError(f"Rosetta worker failed to initialise PyRosetta: {payload}")
+            waiting.discard(worker_id)
+
+    def submit(
+        self,
+        protocol: t.Union[str, Path],
+        input_file: t.Union[str, Path],
+        replicates: int = 1,
+        structure_prefix: Optional[str] = None,
+    ) -> Future:
+        """
+        Submits replicates of a RosettaScripts protocol on an input structure.
+
+        Args:
+            protocol: path to the protocol XML
+            input_file: path to the input structure
+            replicates: number of times the protocol is applied to the input structure
+            structure_prefix: if provided, the output structure of each replicate is written to
+                {structure_prefix}_{replicate:04d}.pdb, counting from one. Otherwise no structures are written.
+
+        Returns:
+            future of the scores of the replicates, as a DataFrame in the format of a rosetta_scripts score file
+        """
+        if self._stopping.is_set():
+            raise RosettaPoolError("Rosetta worker pool has been shut down")
+        job = RosettaJob(str(protocol), str(input_file), replicates, structure_prefix)
+        with self._lock:
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            self._jobs[job_id] = job
+        self._pending.put(job_id)
+        self._wake_dispatcher()
+        return job.future
+
+    def _wake_dispatcher(self) -> None:
+        """Makes the dispatcher stop waiting for results, so that it hands out new jobs or stops without delay."""
+        self._results.put((_WAKEUP_ID, None, True, None))
+
+    def _handle_result(self, worker_id: int, job_id: int, succeeded: bool, payload: t.Any) -> None:
+        if self._assigned.get(worker_id) == job_id:
+            self._assigned[worker_id] = None
+        # The job may already be finished, if its worker died after sending its result and the job was resubmitted
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        if succeeded:
+            rows, cpu_time = payload
+            # Recorded before the future completes, so that it is attributed to the stage waiting for the job
+            record_worker_pool_cpu_time(cpu_time)
+            job.future.set_result(pd.DataFrame(rows))
+        else:
+            job.future.set_exception(RosettaPoolError(f"Rosetta job on {job.input_file} failed: {payload}"))
+
+    def _check_workers(self) -> None:
+        """Restarts dead workers, resubmitting the job each was running unless it has been retried too often."""
+        dead = [worker_id for worker_id, process in enumerate(self._workers) if not process.is_alive()]
+        for worker_id in dead:
+            job_id = self._assigned[worker_id]
+            logger.warning(f"Rosetta worker {worker_id} died with exit code {self._workers[worker_id].exitcode}")
+            if job_id is not None:
+                job = self._jobs[job_id]
+                job.attempts += 1
+                if job.attempts > self.max_retries:
+                    del self._jobs[job_id]
+                    job.future.set_exception(
+                        RosettaPoolError(f"Rosetta worker died {job.attempts} times running {job.input_file}")
+                    )
+                else:
+                    self._pending.put(job_id)
+            self._start_worker(worker_id)
+        if dead:
+            self._wait_until_ready(set(dead))
+
+    def _dispatch(self) -> None:
+        while not self._stopping.is_set():
+            for worker_id in range(self.n_workers):
+                if self._assigned[worker_id] is not None:
+                    continue
+                try:
+                    job_id = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                self._assigned[worker_id] = job_id
+                self._task_queues[worker_id].put(
+                    (job_id, job.protocol, job.input_file, job.replicates, job.structure_prefix)
+                )
+
+            # Blocks until a worker sends a result or the pool is woken up; the timeout only bounds how long dead
+            # workers go unnoticed while the pool is idle
+            try:
+                message = self._results.get(timeout=self.health_check_interval)
+                if message[0] != _WAKEUP_ID:
+                    self._handle_result(*message)
+            except queue.Empty:
+                pass
+            except Exception as err:
+                logger.error(f"Rosetta worker pool dispatcher error: {err!r}")
+            if not self._stopping.is_set():
+                try:
+                    self._check_workers()
+                except RosettaPoolError as err:
+                    logger.error(str(err))
+                    for job in self._jobs.values():
+                        job.future.set_exception(err)
+                    self._jobs.clear()
+                    return
+
+    def shutdown(self) -> None:
+        """Stops the dispatcher and the worker processes, failing any jobs that have not finished."""
+        self._stopping.set()
+        if getattr(self, "_dispatcher", None) is not None and self._dispatcher is not threading.current_thread():
+            self._wake_dispatcher()
+            self._dispatcher.join()
+        for task_queue in self._task_queues:
+            if task_queue is not None:
+                task_queue.put(None)
+        for process in self._workers:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.set_exception(RosettaPoolError("Rosetta worker pool was shut down"))
+        self._jobs.clear()
+
+
+_pool: Optional[RosettaWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_rosetta_pool(config: RunConfig) -> Optional[RosettaWorkerPool]:
+    """
+    Returns the Rosetta worker pool of this process, starting it with config.rosetta_slots workers on first use, or
+    None if the run does not use one.
+    """
+    global _pool
+    if not config.rosetta_worker_pool:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            logger.info(f"Starting {config.rosetta_slots or 1} PyRosetta workers")
+            _pool = RosettaWorkerPool(config.rosetta_slots or 1)
+        return _pool
+
+
+def start_rosetta_pool(config: RunConfig) -> None:
+    """
+    Starts the Rosetta worker pool of this process if the run uses one, and registers its shutdown for when the process
+    exits. pipeline runs this in every process that computes datapoints, including the worker processes of the
+    "process" backend, which exit without returning to pipeline.
+    """
+    if get_rosetta_pool(config) is not None:
+        # Runs before multiprocessing closes the pool's queues (priority 10) and terminates its daemonic workers at exit,
+        # so that they are stopped cleanly
+        multiprocessing.util.Finalize(None, shutdown_rosetta_pool, exitpriority=100)
+
+
+def shutdown_rosetta_pool() -> None:
+    """Shuts down the Rosetta worker pool of this process, if one was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
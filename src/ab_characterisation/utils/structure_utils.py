@@ -0,0 +1,171 @@
+import mmap
+import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+
+@dataclass
+class StructureArrays:
+    """
+    In-memory representation of a single-model protein structure, as per-atom and per-residue arrays. This lets
+    Python-side pipeline steps share one parsed copy of a structure; it is only serialised to PDB for external tools
+    that need a file.
+    """
+
+    # Per-atom arrays
+    coords: np.ndarray
+    atom_names: np.ndarray
+    elements: np.ndarray
+    atom_residues: np.ndarray
+    occupancies: np.ndarray
+    b_factors: np.ndarray
+    # Per-residue arrays
+    chain_ids: np.ndarray
+    residue_numbers: np.ndarray
+    insertion_codes: np.ndarray
+    residue_names: np.ndarray
+
+    @property
+    def n_residues(self) -> int:
+        return len(self.residue_names)
+
+    @property
+    def is_heavy(self) -> np.ndarray:
+        """Mask of the non-hydrogen atoms."""
+        return self.elements != "H"
+
+    def to_pdb_string(self) -> str:
+        """Serialises the structure to PDB format, with one ATOM record per atom."""
+        lines = []
+        for serial, (coord, atom_name, element, res, occupancy, b_factor) in enumerate(
+            zip(self.coords, self.atom_names, self.elements, self.atom_residues, self.occupancies, self.b_factors),
+            start=1,
+        ):
+            # Atom names of fewer than four characters start in the second column, unless their element does not fit
+            padded_name = atom_name if len(atom_name) == 4 or len(element) == 2 else f" {atom_name}"
+            lines.append(
+                f"ATOM  {serial % 100000:>5d} {padded_name:<4s} {self.residue_names[res]:>3s} {self.chain_ids[res]}"
+                f"{self.residue_numbers[res]:>4d}{self.insertion_codes[res]:1s}   "
+                f"{coord[0]:8.3f}{coord[1]:8.3f}{coord[2]:8.3f}{occupancy:6.2f}{b_factor:6.2f}          {element:>2s}"
+            )
+        lines.append("END")
+        return "\n".join(lines) + "\n"
+
+    def write_pdb(self, path: t.Union[str, Path]) -> None:
+        """Writes the structure to a PDB file, for tools that need one."""
+        Path(path).write_text(self.to_pdb_string())
+
+
+def _column(records: np.ndarray, start: int, end: int) -> np.ndarray:
+    """Returns the given fixed-width columns of an (n_records, 80) byte array, as an array of byte strings."""
+    return np.ascontiguousarray(records[:, start:end]).view(f"S{end - start}").ravel()
+
+
+def _float_column(records: np.ndarray, start: int, end: int) -> np.ndarray:
+    """Returns the given fixed-width columns as floats, reading blank fields as 0.0 as Biopython's PDBParser does."""
+    column = _column(records, start, end)
+    return np.where(np.char.strip(column) == b"", b"0", column).astype(float)
+
+
+def _strip(column: np.ndarray) -> np.ndarray:
+    return np.char.strip(column.astype(str))
+
+
+def _parse_atom_records(lines: t.Iterable[bytes]) -> StructureArrays:
+    """
+    Parses the ATOM and HETATM records of the first model of a PDB file into arrays, reading each field from its fixed
+    columns for all records at once. Of atoms with alternate locations, only the first location is kept.
+    """
+    atom_lines = []
+    for line in lines:
+        if line.startswith((b"ATOM  ", b"HETATM")):
+            atom_lines.append(line.rstrip(b"\r\n"))
+        elif line.startswith(b"ENDMDL"):
+            break
+    records = np.array(atom_lines, dtype="S80").view(np.uint8).reshape(len(atom_lines), 80)
+    # Records that stop before column 80 are padded with null bytes; treat the missing columns as blank
+    records[records == 0] = ord(" ")
+
+    alt_locs = records[:, 16]
+    first_alt_loc = alt_locs[alt_locs != ord(" ")][:1]
+    records = records[(alt_locs == ord(" ")) | np.isin(alt_locs, first_alt_loc)]
+
+    # A new residue starts wherever the chain, residue number or insertion code changes
+    residue_ids = np.ascontiguousarray(records[:, 21:27]).view("S6").ravel()
+    is_residue_start = np.r_[True, residue_ids[1:] != residue_ids[:-1]] if len(records) else np.zeros(0, dtype=bool)
+    residue_starts = np.flatnonzero(is_residue_start)
+    residue_records = records[residue_starts]
+
+    atom_names = _strip(_column(records, 12, 16))
+    elements = _strip(_column(records, 76, 78))
+    # Infer missing elements from the atom name, as Biopython does for most atoms
+    missing = elements == ""
+    elements[missing] = [name.lstrip("0123456789")[:1] for name in atom_names[missing]]
+
+    return StructureArrays(
+        coords=_column(records, 30, 54).view("S8").astype(float).astype(np.float32).reshape(-1, 3),
+        atom_names=atom_names,
+        elements=elements,
+        atom_residues=np.cumsum(is_residue_start) - 1,
+        occupancies=_float_column(records, 54, 60),
+        b_factors=_float_column(records, 60, 66),
+        chain_ids=_column(residue_records, 21, 22).astype(str),
+        residue_numbers=_column(residue_records, 22, 26).astype(int),
+        insertion_codes=_column(residue_records, 26, 27).astype(str),
+        residue_names=_strip(_column(residue_records, 17, 20)),
+    )
+
+
+def read_structure(structure_path: t.Union[str, Path], memory_map: bool = False) -> StructureArrays:
+    """
+    Reads the first model of a structure from a PDB file.
+
+    Args:
+        structure_path: path to the PDB file
+        memory_map: memory-maps the file rather than reading it into a buffer.
+
+    Returns:
+        the structure, as arrays
+    """
+    with open(structure_path, "rb") as inf:
+        if memory_map:
+            with mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return _parse_atom_records(iter(mapped.readline, b""))
+        return _parse_atom_records(inf.read().splitlines())
+
+
+def parse_structure(pdb_string: str) -> StructureArrays:
+    """
+    Parses the first model of a structure from the contents of a PDB file.
+
+    Args:
+        pdb_string: the PDB file contents
+
+    Returns:
+        the structure, as arrays
+    """
+    return _parse_atom_records(pdb_string.encode().splitlines())
+
+
+# Maximum number of structures kept by cache_structure in each process
+STRUCTURE_CACHE_SIZE = 128
+
+# Structures parsed by this process, keyed by the resolved path of their file. The cache lets a later pipeline step
+# running in the same process reuse a model without re-reading it; unlike a BiologicsData field, it is never sent
+# between processes or written to checkpoints.
+_structure_cache: "OrderedDict[str, StructureArrays]" = OrderedDict()
+
+
+def cache_structure(structure_path: t.Union[str, Path], structure: StructureArrays) -> None:
+    """Keeps a parsed structure for pop_cached_structure, evicting the oldest structure if the cache is full."""
+    _structure_cache[str(Path(structure_path).resolve())] = structure
+    while len(_structure_cache) > STRUCTURE_CACHE_SIZE:
+        _structure_cache.popitem(last=False)
+
+
+def pop_cached_structure(structure_path: t.Union[str, Path]) -> t.Optional[StructureArrays]:
+    """Removes and returns the structure cached for a file by this process, or None if there is none."""
+    return _structure_cache.pop(str(Path(structure_path).resolve()), None)
@@ -0,0 +1,15 @@
+from pathlib import Path
+
+import pytest
+
+DATA_DIRECTORY = Path(__file__).parents[1] / "data"
+
+
+@pytest.fixture(scope="session")
+def antibody_model(tmp_path_factory) -> Path:
+    """The heavy and light chains of the bundled reference complex, as an antibody model for TAP."""
+    model_path = tmp_path_factory.mktemp("models") / "reference_antibody.pdb"
+    lines = (DATA_DIRECTORY / "test_complex_reference.pdb").read_text().splitlines(keepends=True)
+    antibody_lines = [line for line in lines if line.startswith("ATOM") and line[21] in "HL"]
+    model_path.write_text("".join(antibody_lines) + "END\n")
+    return model_path
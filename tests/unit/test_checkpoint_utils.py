@@ -0,0 +1,90 @@
+from dataclasses import replace
+
+import pytest
+
+from ab_characterisation.pipeline_orchestration import PipelineStage, run_stages
+from ab_characterisation.utils.checkpoint_utils import restore_checkpoints
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+stage_calls: list[str] = []
+# Stages that raise, as if the run was killed while running them
+interrupted_stages: set[str] = set()
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _model(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    stage_calls.append(f"model:{biol_data.name}")
+    biol_data.antibody_structure = f"{biol_data.name}.pdb"
+    return biol_data
+
+
+def _score(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    stage_calls.append(f"score:{biol_data.name}")
+    if "score" in interrupted_stages:
+        raise Interrupted()
+    biol_data.tap_flags = [len(biol_data.heavy_sequence)]
+    return biol_data
+
+
+STAGES = [
+    PipelineStage("model", "Stub model", _model),
+    PipelineStage("score", "Stub score", _score),
+]
+
+
+def _input_data() -> list[BiologicsData]:
+    return [
+        BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name="ab0", target_complex_reference="ref.pdb"),
+        BiologicsData(heavy_sequence="EVQLV", light_sequence="EIVL", name="ab1", target_complex_reference="ref.pdb"),
+    ]
+
+
+def _run(config: RunConfig) -> list[BiologicsData]:
+    biol_data_ls = _input_data()
+    if config.resume:
+        biol_data_ls = restore_checkpoints(biol_data_ls, config)
+    return [run_stages(biol_data, config, STAGES) for biol_data in biol_data_ls]
+
+
+@pytest.fixture(autouse=True)
+def _reset_stubs():
+    stage_calls.clear()
+    interrupted_stages.clear()
+
+
+def test_resume_after_partial_run(tmp_path):
+    config = RunConfig(input_file="", output_directory=tmp_path, checkpoint=True)
+    interrupted_stages.add("score")
+    with pytest.raises(Interrupted):
+        _run(config)
+    assert stage_calls == ["model:ab0", "score:ab0"]
+
+    interrupted_stages.clear()
+    stage_calls.clear()
+    results = _run(replace(config, resume=True))
+    assert stage_calls == ["score:ab0", "model:ab1", "score:ab1"]
+    assert [biol_data.completed_stages for biol_data in results] == [["model", "score"], ["model", "score"]]
+    assert [biol_data.tap_flags for biol_data in results] == [[4], [5]]
+
+    # A completed run is skipped entirely on the next resume
+    stage_calls.clear()
+    _run(replace(config, resume=True))
+    assert stage_calls == []
+
+
+@pytest.mark.parametrize("option", [{"rosetta_replicates": 3}, {"tap_contributions": True}])
+def test_checkpoints_not_reused_with_different_options(tmp_path, option):
+    config = RunConfig(input_file="", output_directory=tmp_path, checkpoint=True)
+    _run(config)
+
+    stage_calls.clear()
+    _run(replace(config, resume=True, **option))
+    assert stage_calls == ["model:ab0", "score:ab0", "model:ab1", "score:ab1"]
+
+
+def test_no_checkpoints_by_default(tmp_path):
+    _run(RunConfig(input_file="", output_directory=tmp_path))
+    assert not (tmp_path / "checkpoints").exists()
@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig, save_output
+
+
+def test_save_output_columns_do_not_depend_on_numbering(tmp_path):
+    config = RunConfig(input_file="", output_directory=tmp_path)
+    numbered = BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name="numbered",
+                             target_complex_reference="ref", chain_numbering={"H": [], "L": []})
+    unnumbered = BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name="unnumbered",
+                               target_complex_reference="ref")
+
+    save_output([numbered], config)
+    numbered_columns = pd.read_csv(tmp_path / "output.csv", index_col=0).columns.tolist()
+    save_output([unnumbered], config)
+    unnumbered_columns = pd.read_csv(tmp_path / "output.csv", index_col=0).columns.tolist()
+
+    assert numbered_columns == unnumbered_columns
+    assert "chain_numbering" not in numbered_columns
+
+
+@pytest.mark.parametrize("option", [{"backend": "mpii"}, {"tap_sasa_engine": "shrake"}])
+def test_run_config_rejects_unknown_choices(tmp_path, option):
+    with pytest.raises(ValueError, match="expected one of"):
+        RunConfig(input_file="", output_directory=tmp_path / "output", **option)
+    assert not (tmp_path / "output").exists()
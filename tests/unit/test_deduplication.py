@@ -0,0 +1,75 @@
+from functools import partial
+
+import pytest
+
+from ab_characterisation.executors import ProcessPoolBackend, SerialExecutor
+from ab_characterisation.pipeline_orchestration import (PipelineStage, batched_computation_step,
+                                                        group_identical_complexes, group_identical_fvs,
+                                                        run_stages_deduplicated)
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+
+def _model(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    biol_data.antibody_structure = f"{biol_data.name}.pdb"
+    return biol_data
+
+
+def _short_heavy_chain(biol_data: BiologicsData, config: RunConfig) -> bool:
+    return len(biol_data.heavy_sequence) < 4
+
+
+def _superpose(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    biol_data.chimerax_complex_structure = f"{biol_data.name}_complex.pdb"
+    return biol_data
+
+
+STAGES = [
+    PipelineStage("stub_model", "Stub model", _model),
+    PipelineStage("stub_filter", "Stub filter", _short_heavy_chain, is_filter=True),
+    PipelineStage("stub_complex", "Stub complex", _superpose, fv_level=False),
+]
+
+
+def _input_data() -> list[BiologicsData]:
+    rows = [
+        ("QVQL", "DIQM", "ref1.pdb"),
+        ("EVQL", "DIQM", "ref1.pdb"),
+        ("QVQL", "DIQM", "ref1.pdb"),
+        ("QVQL", "DIQM", "ref2.pdb"),
+        ("QV", "EIVL", "ref1.pdb"),
+        ("QV", "EIVL", "ref2.pdb"),
+    ]
+    return [
+        BiologicsData(heavy_sequence=heavy, light_sequence=light, name=f"ab{idx}", target_complex_reference=ref)
+        for idx, (heavy, light, ref) in enumerate(rows)
+    ]
+
+
+def test_group_duplicates():
+    biol_data_ls = _input_data()
+    assert group_identical_fvs(biol_data_ls) == {0: [2, 3], 4: [5]}
+    assert group_identical_complexes(biol_data_ls) == {0: [2]}
+
+
+@pytest.mark.parametrize("backend", ["serial", "process"])
+def test_streamed_groups_share_results(tmp_path, backend):
+    config = RunConfig(input_file="", output_directory=tmp_path, backend=backend)
+    biol_data_ls = _input_data()
+    groups = [[0, 2, 3], [1], [4, 5]]
+    executor = SerialExecutor() if backend == "serial" else ProcessPoolBackend(workers=2)
+    try:
+        results = batched_computation_step(
+            biol_data_ls, partial(run_stages_deduplicated, stages=STAGES), config, 1, executor, groups=groups
+        )
+    finally:
+        executor.shutdown()
+
+    # Sequence-only stages run once per Fv, complex stages once per Fv and reference complex
+    assert [biol_data.antibody_structure for biol_data in results] == [
+        "ab0.pdb", "ab1.pdb", "ab0.pdb", "ab0.pdb", "ab4.pdb", "ab4.pdb"
+    ]
+    assert [biol_data.chimerax_complex_structure for biol_data in results] == [
+        "ab0_complex.pdb", "ab1_complex.pdb", "ab0_complex.pdb", "ab3_complex.pdb", None, None
+    ]
+    assert [biol_data.discarded_by for biol_data in results] == [None] * 4 + ["stub_filter"] * 2
+    assert results[3].completed_stages == ["stub_model", "stub_complex"]
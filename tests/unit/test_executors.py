@@ -0,0 +1,120 @@
+from functools import partial
+
+import pytest
+
+from ab_characterisation.executors import ProcessPoolBackend, SerialExecutor
+from ab_characterisation.pipeline_orchestration import (PipelineStage, batched_computation_step, computation_step,
+                                                        filtering_step, run_computation_stage,
+                                                        run_computation_stage_batch)
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+
+def _sequence_length(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    biol_data.tap_flags = [len(biol_data.heavy_sequence) + len(biol_data.light_sequence)]
+    return biol_data
+
+
+def _short_heavy_chain(biol_data: BiologicsData, config: RunConfig) -> bool:
+    return len(biol_data.heavy_sequence) < 4
+
+
+def _complex_name(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    return _complex_names([biol_data], config)[0]
+
+
+def _complex_names(biol_data_ls: list[BiologicsData], config: RunConfig) -> list[BiologicsData]:
+    for biol_data in biol_data_ls:
+        biol_data.chimerax_complex_structure = f"{biol_data.name}_complex.pdb"
+    return biol_data_ls
+
+
+# Set by _initialize_worker in each process that computes datapoints
+worker_state: dict[str, str] = {}
+
+
+def _initialize_worker(value: str) -> None:
+    worker_state["initialized"] = value
+
+
+def _read_worker_state(biol_data: BiologicsData, config: RunConfig) -> BiologicsData:
+    biol_data.antibody_structure = worker_state.get("initialized")
+    return biol_data
+
+
+STUB_STAGES = [
+    PipelineStage("stub_length", "Stub computation", _sequence_length),
+    PipelineStage("stub_filter", "Stub filter", _short_heavy_chain, is_filter=True),
+    PipelineStage("stub_batch", "Stub batch computation", _complex_name, batch_function=_complex_names, batch_size=2),
+]
+
+
+def _run_stub_stages(executor, config: RunConfig) -> list[BiologicsData]:
+    biologics_objects = [
+        BiologicsData(heavy_sequence="Q" * length, light_sequence="D" * (length + 1), name=f"ab{idx}",
+                      target_complex_reference="reference.pdb")
+        for idx, length in enumerate([2, 5, 7, 3, 9, 6])
+    ]
+    for stage in STUB_STAGES:
+        if stage.is_filter:
+            biologics_objects = filtering_step(biologics_objects, stage.name, stage.function, config, executor)
+        elif stage.batch_function is not None:
+            biologics_objects = batched_computation_step(
+                biologics_objects,
+                partial(run_computation_stage_batch, stage_name=stage.name, batch_function=stage.batch_function),
+                config,
+                stage.batch_size,
+                executor,
+            )
+        else:
+            biologics_objects = computation_step(
+                biologics_objects,
+                partial(run_computation_stage, stage_name=stage.name, computation_function=stage.function),
+                config,
+                executor,
+            )
+    return executor.collect(biologics_objects)
+
+
+def _results(biologics_objects: list[BiologicsData]) -> list[dict]:
+    # Timings record the process and wall time, which differ between backends
+    return [
+        {key: value for key, value in vars(biol_data).items() if key != "stage_timings"}
+        for biol_data in biologics_objects
+    ]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_serial_and_process_backends_agree(tmp_path, workers):
+    serial_config = RunConfig(input_file="", output_directory=tmp_path / "serial", backend="serial")
+    serial_results = _run_stub_stages(SerialExecutor(), serial_config)
+
+    process_config = RunConfig(input_file="", output_directory=tmp_path / "process", backend="process")
+    executor = ProcessPoolBackend(workers=workers)
+    try:
+        process_results = _run_stub_stages(executor, process_config)
+    finally:
+        executor.shutdown()
+
+    assert _results(process_results) == _results(serial_results)
+    assert [biol_data.discarded_by for biol_data in serial_results] == [
+        "stub_filter", None, None, "stub_filter", None, None
+    ]
+    assert serial_results[1].completed_stages == ["stub_length", "stub_batch"]
+    assert serial_results[4].chimerax_complex_structure == "ab4_complex.pdb"
+
+
+@pytest.mark.parametrize("backend", ["serial", "process"])
+def test_worker_initializer_runs_before_computation(tmp_path, backend):
+    config = RunConfig(input_file="", output_directory=tmp_path, backend=backend)
+    executor = SerialExecutor() if backend == "serial" else ProcessPoolBackend(workers=2)
+    executor.set_worker_initializer(_initialize_worker, "ready")
+    biologics_objects = [
+        BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name=f"ab{idx}", target_complex_reference="ref")
+        for idx in range(4)
+    ]
+    try:
+        results = computation_step(biologics_objects, _read_worker_state, config, executor)
+    finally:
+        executor.shutdown()
+        worker_state.clear()
+    assert [biol_data.antibody_structure for biol_data in results] == ["ready"] * 4
@@ -0,0 +1,31 @@
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from ab_characterisation.utils.profiling_utils import record_worker_pool_cpu_time, timed_call
+
+
+def _allocate(size_mb: int) -> None:
+    buffer = np.ones(size_mb * 1024**2 // 8)
+    time.sleep(0.2)
+    del buffer
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="RSS sampling needs /proc")
+def test_stage_peak_rss_is_per_stage():
+    _, allocating = timed_call("allocate", _allocate, 200)
+    _, idle = timed_call("idle", time.sleep, 0.1)
+
+    assert allocating.stage_peak_rss_mb - idle.stage_peak_rss_mb > 150
+    # The lifetime peak of the process still includes the earlier allocation
+    assert idle.process_peak_rss_mb >= allocating.stage_peak_rss_mb - 1
+
+
+def test_worker_pool_cpu_time_is_attributed_to_stage():
+    _, timing = timed_call("pool", record_worker_pool_cpu_time, 2.5)
+    _, later_timing = timed_call("later", time.sleep, 0)
+
+    assert timing.worker_pool_cpu_time == pytest.approx(2.5)
+    assert later_timing.worker_pool_cpu_time == 0
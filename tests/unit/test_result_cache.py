@@ -0,0 +1,73 @@
+import os
+from pathlib import Path
+
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+from ab_characterisation.utils.result_cache import ResultCache, get_result_cache
+
+
+def _biol_data(name: str = "ab0", heavy_sequence: str = "QVQL") -> BiologicsData:
+    return BiologicsData(heavy_sequence=heavy_sequence, light_sequence="DIQM", name=name,
+                         target_complex_reference="ref.pdb")
+
+
+def test_key_stability():
+    key = ResultCache.key(_biol_data(), "tap", {"sasa_engine": "psa", "version": "1.0"})
+    # Keys must not change between releases, or every cached result would be missed
+    assert key == "74ebc971650d661cfbd9aa6d07bd43ce0d0927d2b0eeabbae2890dce7e905642"
+    # Names and the order of parameters do not matter
+    assert ResultCache.key(_biol_data(name="ab1"), "tap", {"version": "1.0", "sasa_engine": "psa"}) == key
+    assert ResultCache.key(_biol_data(heavy_sequence="EVQL"), "tap", {"sasa_engine": "psa", "version": "1.0"}) != key
+    assert ResultCache.key(_biol_data(), "abb2", {"sasa_engine": "psa", "version": "1.0"}) != key
+    assert ResultCache.key(_biol_data(), "tap", {"sasa_engine": "shrake_rupley", "version": "1.0"}) != key
+
+
+def test_get_and_put(tmp_path):
+    cache = ResultCache(tmp_path)
+    key = ResultCache.key(_biol_data(), "tap", {})
+    assert cache.get(key) is None
+
+    cache.put(key, {"tap_flags": ["GREEN"]})
+    assert cache.get(key) == {"tap_flags": ["GREEN"]}
+    assert ResultCache(tmp_path).get(key) == {"tap_flags": ["GREEN"]}
+
+    # Truncated entries are misses
+    cache._entry_path(key).write_bytes(b"")
+    assert cache.get(key) is None
+
+
+def test_get_entry_evicted_after_read(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path)
+    key = ResultCache.key(_biol_data(), "tap", {})
+    cache.put(key, {"tap_flags": []})
+
+    def evicted(path: Path, *args, **kwargs) -> None:
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(Path, "touch", evicted)
+    assert cache.get(key) == {"tap_flags": []}
+
+
+def test_prune_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path)
+    keys = [ResultCache.key(_biol_data(), f"stage{idx}", {}) for idx in range(4)]
+    for idx, key in enumerate(keys):
+        cache.put(key, {"result": idx})
+        os.utime(cache._entry_path(key), (1000 + idx, 1000 + idx))
+    entry_size = cache.entries()[0].size
+
+    # Reading the oldest entry makes it the most recently used
+    cache.get(keys[0])
+    assert cache.prune(4 * entry_size) == 0
+    assert cache.prune(2 * entry_size) == 2
+    assert [cache.get(key) is not None for key in keys] == [True, False, False, True]
+    assert ResultCache(tmp_path, max_size_bytes=0).prune() == 2
+    assert cache.entries() == []
+
+
+def test_result_cache_opened_once_per_directory(tmp_path):
+    config = RunConfig(input_file="", output_directory=tmp_path / "output", cache_directory=tmp_path / "cache")
+    cache = get_result_cache(config)
+    assert get_result_cache(config) is cache
+    assert get_result_cache(RunConfig(input_file="", output_directory=tmp_path / "output")) is None
+    other_config = RunConfig(input_file="", output_directory=tmp_path / "output", cache_directory=tmp_path / "other")
+    assert get_result_cache(other_config) is not cache
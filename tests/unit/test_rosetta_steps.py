@@ -0,0 +1,194 @@
+from pathlib import Path
+
+import pytest
+
+from ab_characterisation import rosetta_steps
+from ab_characterisation.rosetta_steps import (TEMPLATE_DIRECTORY, _load_template, _protocol_file, _render_arguments,
+                                               generic_rosetta_batch_step, prune_relaxed_complexes)
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+# Input structures of the batch, with underscores in their stems, and the base score Rosetta reports for each
+SCORES = {"ab0_model": 100.0, "ab1_model": 200.0, "ab_2_model": 300.0, "ab3_model": 400.0}
+
+
+class FakeRosetta:
+    """
+    Stands in for subprocess.run of rosetta_scripts: writes a score.sc with the rows in reverse order, and the output
+    structures unless only scores are requested. Outputs listed in missing_outputs are left out of batch runs.
+    """
+
+    def __init__(self, missing_outputs: set[str], write_batch_scores: bool = True):
+        self.missing_outputs = missing_outputs
+        self.write_batch_scores = write_batch_scores
+        self.calls: list[list[str]] = []
+
+    def __call__(self, arguments: list[str], cwd: str, stdout, stderr) -> None:
+        is_batch = "-in:file:l" in arguments
+        if is_batch:
+            input_files = Path(arguments[arguments.index("-in:file:l") + 1]).read_text().split()
+            nstruct = int(arguments[arguments.index("-nstruct") + 1])
+        else:
+            input_files = [arguments[arguments.index("-in:file:s") + 1]]
+            nstruct = 1
+        self.calls.append([Path(input_file).stem for input_file in input_files])
+        if is_batch and not self.write_batch_scores:
+            return
+
+        rows = []
+        for input_file in input_files:
+            stem = Path(input_file).stem
+            for replicate in range(1, nstruct + 1):
+                description = f"{stem}_{replicate:04d}"
+                if is_batch and (stem in self.missing_outputs or description in self.missing_outputs):
+                    continue
+                rows.append(f"SCORE: {SCORES[stem] + replicate} {description}")
+                if "-out:file:score_only" not in arguments:
+                    (Path(cwd) / f"{description}.pdb").write_text(description)
+        score_file = "SEQUENCE:\nSCORE: total_score description\n" + "".join(f"{row}\n" for row in reversed(rows))
+        (Path(cwd) / "score.sc").write_text(score_file)
+
+
+@pytest.fixture
+def batch(tmp_path):
+    config = RunConfig(input_file="", output_directory=tmp_path / "output", rosetta_base_directory="/rosetta",
+                       rosetta_slots=2, keep_relaxed_complexes=True)
+    biol_data_ls = [
+        BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name=f"ab{idx}", target_complex_reference="ref")
+        for idx in range(len(SCORES))
+    ]
+    input_files = [str(tmp_path / f"{stem}.pdb") for stem in SCORES]
+    return biol_data_ls, input_files, config
+
+
+def _run(batch, fake_rosetta, monkeypatch) -> dict:
+    biol_data_ls, input_files, config = batch
+    monkeypatch.setattr(rosetta_steps.subprocess, "run", fake_rosetta)
+    return generic_rosetta_batch_step(
+        biol_data_ls, input_files, "rosetta_metrics_complex", config, step_name="complex", replicates=2,
+        structure_directory=config.output_directory / "relaxed_complexes",
+    )
+
+
+def test_batch_scores_assigned_by_description(batch, monkeypatch):
+    fake_rosetta = FakeRosetta(missing_outputs={"ab_2_model", "ab3_model_0002"})
+    results = _run(batch, fake_rosetta, monkeypatch)
+
+    # Two concurrent chunks of two inputs, then the datapoints with missing rows on their own, one replicate per process
+    assert sorted(fake_rosetta.calls[:2]) == [["ab0_model", "ab1_model"], ["ab_2_model", "ab3_model"]]
+    assert sorted(fake_rosetta.calls[2:]) == [["ab3_model"]] * 2 + [["ab_2_model"]] * 2
+
+    for name, stem in [("ab0", "ab0_model"), ("ab1", "ab1_model")]:
+        assert results[name]["description"].tolist() == [f"{stem}_0001", f"{stem}_0002"]
+        assert results[name]["total_score"].tolist() == [SCORES[stem] + 1, SCORES[stem] + 2]
+    for name, stem in [("ab2", "ab_2_model"), ("ab3", "ab3_model")]:
+        assert results[name]["description"].tolist() == [f"{stem}_0001"] * 2
+        assert results[name]["total_score"].tolist() == [SCORES[stem] + 1] * 2
+    for output in results.values():
+        assert output["replicate"].tolist() == [0, 1]
+        assert output.index.tolist() == [0, 0]
+        assert "stem" not in output.columns
+
+    relaxed_complexes = batch[2].output_directory / "relaxed_complexes"
+    assert (relaxed_complexes / "ab1_0002.pdb").read_text() == "ab1_model_0002"
+    assert (relaxed_complexes / "ab3_0002.pdb").read_text() == "ab3_model_0001"
+    assert len(list(relaxed_complexes.glob("*.pdb"))) == 8
+
+
+def test_batch_without_score_file_is_rerun(batch, monkeypatch):
+    fake_rosetta = FakeRosetta(missing_outputs=set(), write_batch_scores=False)
+    results = _run(batch, fake_rosetta, monkeypatch)
+
+    assert len(fake_rosetta.calls) == 2 + 2 * len(SCORES)
+    for name, stem in zip(results, SCORES):
+        assert results[name]["description"].tolist() == [f"{stem}_0001"] * 2
+        assert results[name]["replicate"].tolist() == [0, 1]
+
+
+@pytest.fixture
+def template_caches():
+    """Templates and protocols are cached per process; tests that change them start and end with empty caches."""
+    _load_template.cache_clear()
+    _protocol_file.cache_clear()
+    yield
+    _load_template.cache_clear()
+    _protocol_file.cache_clear()
+
+
+def test_render_arguments_quotes_values():
+    input_file = "/data/my models/ab $1 #2.pdb"
+    arguments = _render_arguments(
+        "rosetta_metrics_ab_only",
+        {
+            "rosetta_base_dir": "/opt/rosetta 3.13",
+            "input_file": input_file,
+            "protocol": "/run/protocol.xml",
+            "output_options": ["-out:file:score_only", "score.sc"],
+        },
+    )
+    # The comment line at the top of the template is dropped
+    assert arguments[0] == "/opt/rosetta 3.13/main/source/bin/rosetta_scripts.static.linuxgccrelease"
+    assert arguments[1:9] == [
+        "-database", "/opt/rosetta 3.13/main/database",
+        "-in:file:s", input_file,
+        "-in:file:native", input_file,
+        "-parser:protocol", "/run/protocol.xml",
+    ]
+    # List values are substituted as several arguments
+    assert arguments[9:12] == ["-out:file:score_only", "score.sc", "-beta"]
+
+
+def test_render_arguments_empty_list():
+    arguments = _render_arguments(
+        "rosetta_metrics_complex_batch",
+        {"rosetta_base_dir": "/rosetta", "input_list": "inputs.txt", "nstruct": 3, "protocol": "protocol.xml",
+         "output_options": []},
+    )
+    assert arguments[3:9] == ["-in:file:l", "inputs.txt", "-nstruct", "3", "-parser:protocol", "protocol.xml"]
+    assert arguments[9] == "-beta"
+    assert "" not in arguments
+
+
+def test_render_arguments_unknown_placeholder(tmp_path, monkeypatch, template_caches):
+    (tmp_path / "typo.args").write_text("# Misspelt placeholder\n${rosetta_base_dir}/bin\n-in:file:s ${input_fle}\n")
+    monkeypatch.setattr(rosetta_steps, "TEMPLATE_DIRECTORY", tmp_path)
+    with pytest.raises(KeyError, match="input_fle"):
+        _render_arguments("typo", {"rosetta_base_dir": "/rosetta", "input_file": "model.pdb"})
+
+
+def test_protocol_file(tmp_path, template_caches):
+    protocol = (TEMPLATE_DIRECTORY / "rosetta_metrics_complex.xml").read_text()
+    protocol_path = _protocol_file("rosetta_metrics_complex", tmp_path)
+    assert protocol_path == (tmp_path / "rosetta_protocols" / "rosetta_metrics_complex.xml").resolve()
+    assert protocol_path.read_text() == protocol
+
+    # A stale protocol left by an earlier version of the pipeline is replaced
+    protocol_path.write_text("<ROSETTASCRIPTS/>")
+    _protocol_file.cache_clear()
+    assert _protocol_file("rosetta_metrics_complex", tmp_path).read_text() == protocol
+    assert [path.name for path in protocol_path.parent.iterdir()] == ["rosetta_metrics_complex.xml"]
+
+
+def test_prune_relaxed_complexes_keeps_shared_complexes_of_duplicates(tmp_path):
+    config = RunConfig(input_file="", output_directory=tmp_path, rosetta_replicates=2, keep_relaxed_complexes=True)
+    # ab1 duplicates ab0, so Rosetta only relaxed the complex of ab0; ab1 and ab2 are the top N candidates
+    biol_data_ls = [
+        BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name=name, target_complex_reference="ref",
+                      chimerax_complex_structure=complex_structure, rank=rank)
+        for name, complex_structure, rank in [
+            ("ab0", "ab0_complex.pdb", None),
+            ("ab1", "ab0_complex.pdb", 1),
+            ("ab2", "ab2_complex.pdb", 2),
+            ("ab3", "ab3_complex.pdb", None),
+        ]
+    ]
+    relaxed_complexes = tmp_path / "relaxed_complexes"
+    for name in ("ab0", "ab2", "ab3"):
+        for replicate in (1, 2):
+            (relaxed_complexes / f"{name}_{replicate:04d}.pdb").write_text(f"{name} {replicate}")
+
+    prune_relaxed_complexes(biol_data_ls, config)
+    assert sorted(path.name for path in relaxed_complexes.iterdir()) == [
+        "ab1_0001.pdb", "ab1_0002.pdb", "ab2_0001.pdb", "ab2_0002.pdb"
+    ]
+    assert (relaxed_complexes / "ab1_0002.pdb").read_text() == "ab0 2"
+    assert (relaxed_complexes / "ab2_0001.pdb").read_text() == "ab2 1"
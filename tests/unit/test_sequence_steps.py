@@ -0,0 +1,43 @@
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from ab_characterisation import sequence_steps
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig
+
+pytestmark = pytest.mark.skipif(shutil.which("hmmscan") is None, reason="ANARCI needs hmmscan")
+
+
+def _input_data() -> list[BiologicsData]:
+    input_df = pd.read_csv(Path(__file__).parents[1] / "data" / "test_pipeline.csv")
+    return [
+        BiologicsData(
+            heavy_sequence=row.heavy_sequence,
+            light_sequence=row.light_sequence,
+            name=row.sequence_name,
+            target_complex_reference=row.reference_complex,
+        )
+        for row in input_df.itertuples()
+    ]
+
+
+def test_cdr_length_batch_numbers_each_chain_once(tmp_path, monkeypatch):
+    numbering_calls = []
+
+    def number_chains(sequences, chain):
+        numbering_calls.append(chain)
+        return original_number_chains(sequences, chain)
+
+    original_number_chains = sequence_steps.number_chains
+    monkeypatch.setattr(sequence_steps, "number_chains", number_chains)
+    config = RunConfig(input_file="", output_directory=tmp_path)
+
+    batch_results = sequence_steps.tap_cdr_length_batch_check(_input_data(), config)
+    assert numbering_calls == ["H", "L"]
+
+    single_results = [sequence_steps.tap_cdr_length_check(biol_data, config) for biol_data in _input_data()]
+    for batch_result, single_result in zip(batch_results, single_results):
+        assert batch_result.tap_flags == single_result.tap_flags
+        assert batch_result.chain_numbering == single_result.chain_numbering
@@ -0,0 +1,91 @@
+import importlib
+from importlib import metadata
+
+import pytest
+
+pytest.importorskip("ImmuneBuilder")
+
+import torch  # noqa: E402
+from ImmuneBuilder import ABodyBuilder2  # noqa: E402
+
+from ab_characterisation.structure_steps import _predict_numbered, run_abb2_batch  # noqa: E402
+from ab_characterisation.utils.data_classes import BiologicsData, RunConfig  # noqa: E402
+from ab_characterisation.utils.result_cache import get_result_cache, tool_version  # noqa: E402
+from ab_characterisation.utils.structure_utils import pop_cached_structure  # noqa: E402
+
+HEAVY_SEQUENCE = "QVQLVQSGAEVKKPGASVKVSCKAS"
+LIGHT_SEQUENCE = "DIQMTQSPSSLSASVGDRVTITCRAS"
+
+
+class StubModel:
+    """Stands in for an ABodyBuilder2 network, recording its inputs and returning coordinates derived from them."""
+
+    def __init__(self, seed: int):
+        self.seed = seed
+        self.inputs = []
+
+    def __call__(self, encoding: torch.Tensor, full_seq: str) -> tuple[torch.Tensor, torch.Tensor]:
+        self.inputs.append((encoding.clone(), full_seq))
+        generator = torch.Generator().manual_seed(self.seed)
+        noise = torch.randn(len(full_seq), 14, 3, generator=generator, dtype=encoding.dtype)
+        return encoding.sum(-1)[:, None, None] + noise, encoding
+
+
+def _stub_predictor() -> ABodyBuilder2:
+    """An ABodyBuilder2 predictor with stub networks, which does not need the network weights."""
+    predictor = ABodyBuilder2.__new__(ABodyBuilder2)
+    predictor.device = "cpu"
+    predictor.scheme = "imgt"
+    predictor.models = {f"antibody_model_{idx}": StubModel(idx) for idx in range(1, 5)}
+    return predictor
+
+
+def test_immunebuilder_version_is_pinned():
+    # _predict_numbered mirrors ABodyBuilder2.predict of the version pinned in setup.cfg
+    assert metadata.version("ImmuneBuilder") == "1.2"
+
+
+def test_predict_numbered_matches_predict(monkeypatch):
+    numbering = {
+        chain: [((position, " "), residue) for position, residue in enumerate(sequence, start=1)]
+        for chain, sequence in [("H", HEAVY_SEQUENCE), ("L", LIGHT_SEQUENCE)]
+    }
+    abb2_module = importlib.import_module("ImmuneBuilder.ABodyBuilder2")
+    monkeypatch.setattr(abb2_module, "number_sequences", lambda sequence_dict, scheme: numbering)
+
+    predictor = _stub_predictor()
+    expected = predictor.predict({"H": HEAVY_SEQUENCE, "L": LIGHT_SEQUENCE})
+    expected_inputs = {name: model.inputs.pop() for name, model in predictor.models.items()}
+    antibody = _predict_numbered(predictor, numbering)
+
+    assert antibody.numbered_sequences == expected.numbered_sequences
+    for name, model in predictor.models.items():
+        (encoding, full_seq), = model.inputs
+        assert torch.equal(encoding, expected_inputs[name][0])
+        assert full_seq == expected_inputs[name][1]
+    for atoms, expected_atoms in zip(antibody.atoms, expected.atoms):
+        assert torch.equal(atoms, expected_atoms)
+    assert antibody.ranking == expected.ranking
+
+
+@pytest.mark.parametrize(
+    "options, keeps_structures",
+    [
+        ({"backend": "process"}, False),
+        ({"backend": "mpi"}, False),
+        ({"backend": "process", "streaming": True}, True),
+        ({"backend": "mpi", "distributed_payloads": True}, True),
+        ({"backend": "serial"}, True),
+    ],
+)
+def test_parsed_models_kept_for_tap_in_same_process(antibody_model, tmp_path, options, keeps_structures):
+    config = RunConfig(input_file="", output_directory=tmp_path / "output", cache_directory=tmp_path / "cache",
+                       **options)
+    biol_data = BiologicsData(heavy_sequence="QVQL", light_sequence="DIQM", name="ab0", target_complex_reference="ref")
+    # Served from the result cache, so that the networks do not need to run
+    cache = get_result_cache(config)
+    cache.put(cache.key(biol_data, "abb2", {"ImmuneBuilder": tool_version("ImmuneBuilder")}),
+              {"model": antibody_model.read_text()})
+
+    biol_data = run_abb2_batch([biol_data], config)[0]
+    assert (pop_cached_structure(biol_data.antibody_structure) is not None) == keeps_structures
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from Bio.PDB import PDBParser
+
+from ab_characterisation.utils import structure_utils
+from ab_characterisation.utils.structure_utils import cache_structure, pop_cached_structure, read_structure
+
+
+@pytest.fixture
+def truncated_model(antibody_model, tmp_path):
+    """The antibody model with some ATOM records stopping before the element, B-factor or occupancy columns."""
+    lines = antibody_model.read_text().splitlines()
+    for idx in range(0, len(lines) - 1, 7):
+        lines[idx] = lines[idx][:(66, 60, 54)[idx % 3]]
+    model_path = tmp_path / "truncated.pdb"
+    model_path.write_text("\n".join(lines) + "\n")
+    return model_path
+
+
+@pytest.mark.parametrize("memory_map", [False, True])
+def test_read_structure_matches_pdb_parser(truncated_model, memory_map):
+    structure = read_structure(truncated_model, memory_map=memory_map)
+    atoms = list(PDBParser(QUIET=True).get_structure("model", truncated_model)[0].get_atoms())
+    residues = [atom.get_parent() for atom in atoms if atom is atom.get_parent().child_list[0]]
+
+    np.testing.assert_allclose(structure.coords, [atom.coord for atom in atoms])
+    assert structure.atom_names.tolist() == [atom.get_name() for atom in atoms]
+    assert structure.elements.tolist() == [atom.element for atom in atoms]
+    assert structure.b_factors.tolist() == [atom.get_bfactor() for atom in atoms]
+    # PDBParser leaves missing occupancies as None
+    assert structure.occupancies.tolist() == [atom.get_occupancy() or 0.0 for atom in atoms]
+    assert 0.0 in structure.b_factors and 0.0 in structure.occupancies
+    assert structure.chain_ids.tolist() == [residue.get_parent().id for residue in residues]
+    assert [(" ", number, code) for number, code in zip(structure.residue_numbers, structure.insertion_codes)] == [
+        residue.id for residue in residues
+    ]
+    assert structure.residue_names.tolist() == [residue.get_resname() for residue in residues]
+    assert structure.atom_residues.tolist() == [residues.index(atom.get_parent()) for atom in atoms]
+
+
+def test_structure_cache(antibody_model, monkeypatch):
+    structure = read_structure(antibody_model)
+    cache_structure(antibody_model, structure)
+    assert pop_cached_structure(str(antibody_model)) is structure
+    # The structure is only used once, by TAP
+    assert pop_cached_structure(antibody_model) is None
+
+    monkeypatch.setattr(structure_utils, "STRUCTURE_CACHE_SIZE", 2)
+    for idx in range(3):
+        cache_structure(antibody_model.with_name(f"model_{idx}.pdb"), structure)
+    assert pop_cached_structure(antibody_model.with_name("model_0.pdb")) is None
+    assert pop_cached_structure(antibody_model.with_name("model_2.pdb")) is structure
@@ -0,0 +1,133 @@
+import pandas as pd
+import pytest
+
+from ab_characterisation.developability_tools.tap import main as tap_main
+from ab_characterisation.developability_tools.tap import outputs
+from ab_characterisation.developability_tools.tap.main import rescore_mutant, run_tap, run_tap_batch, score_model
+from ab_characterisation.developability_tools.tap.outputs import contribution_tables
+from ab_characterisation.developability_tools.tap.structure_annotation import SURFACE_CUTOFF, compare_sasa_engines
+
+# TAP results for the antibody chains of the bundled reference complex, as (metric, value, flag)
+REFERENCE_RESULTS = {
+    "psa": [
+        ("Hydrophobic Patch Score", 220.70510864257812, "AMBER"),
+        ("Negative Patch Score", 0.46624064445495605, "GREEN"),
+        ("Positive Patch Score", 0.3230826258659363, "GREEN"),
+        ("SFvCSP", -2.8799999999999994, "GREEN"),
+        ("Total IMGT CDR Length", 64, "RED"),
+    ],
+    "shrake_rupley": [
+        ("Hydrophobic Patch Score", 225.39324951171875, "AMBER"),
+        ("Negative Patch Score", 0.46624064445495605, "GREEN"),
+        ("Positive Patch Score", 0.3230826258659363, "GREEN"),
+        ("SFvCSP", -2.8799999999999994, "GREEN"),
+        ("Total IMGT CDR Length", 64, "RED"),
+    ],
+}
+
+
+@pytest.mark.parametrize("sasa_engine", ["psa", "shrake_rupley"])
+def test_tap_reference_results(antibody_model, sasa_engine):
+    results = run_tap(str(antibody_model), None, quiet=True, sasa_engine=sasa_engine)
+    assert [
+        (result.metric_name, float(result.calculated_value), result.flag) for result in results
+    ] == REFERENCE_RESULTS[sasa_engine]
+
+
+def test_sasa_engines_agree_within_tolerance(antibody_model):
+    comparison_df = compare_sasa_engines([str(antibody_model)])
+    differences = comparison_df["difference"].abs()
+    surface_agreement = (
+        (comparison_df["psa"] >= SURFACE_CUTOFF) == (comparison_df["shrake_rupley"] >= SURFACE_CUTOFF)
+    ).mean()
+    assert differences.mean() < 1.0
+    assert differences.max() < 6.0
+    assert surface_agreement > 0.99
+
+    psa_results = run_tap(str(antibody_model), None, quiet=True, sasa_engine="psa")
+    sr_results = run_tap(str(antibody_model), None, quiet=True, sasa_engine="shrake_rupley")
+    # The hydrophobic patch score sums over surface areas, so it is the most sensitive to the engine
+    assert sr_results[0].calculated_value == pytest.approx(psa_results[0].calculated_value, rel=0.05)
+    for psa_result, sr_result in zip(psa_results[1:], sr_results[1:]):
+        assert sr_result.calculated_value == pytest.approx(psa_result.calculated_value, abs=1e-6)
+
+
+def _mutate_to_alanine(model_path, residues, mutant_path):
+    """Writes a mutant of a model in which the given (chain, residue number) residues are truncated to alanine."""
+    mutant_lines = []
+    for line in model_path.read_text().splitlines(keepends=True):
+        if line.startswith("ATOM") and (line[21], int(line[22:26])) in residues:
+            if line[12:16].strip() not in ("N", "CA", "C", "O", "CB"):
+                continue
+            line = line[:17] + "ALA" + line[20:]
+        mutant_lines.append(line)
+    mutant_path.write_text("".join(mutant_lines))
+    return mutant_path
+
+
+@pytest.mark.parametrize("sasa_engine", ["psa", "shrake_rupley"])
+@pytest.mark.parametrize(
+    "residues",
+    [
+        {("H", 55)},
+        {("H", 60)},
+        {("L", 56)},
+        {("H", 107), ("L", 35)},
+    ],
+    ids=["hydrophobic", "positive", "negative", "double"],
+)
+def test_rescore_mutant_matches_full_scoring(antibody_model, tmp_path, sasa_engine, residues):
+    mutant_path = _mutate_to_alanine(antibody_model, residues, tmp_path / "mutant.pdb")
+    parent = score_model(str(antibody_model), quiet=True, sasa_engine=sasa_engine)
+
+    rescored = rescore_mutant(parent, str(mutant_path), quiet=True)
+    full_results = run_tap(str(mutant_path), None, quiet=True, sasa_engine=sasa_engine)
+
+    assert [result.metric_name for result in rescored.results] == [result.metric_name for result in full_results]
+    assert [result.flag for result in rescored.results] == [result.flag for result in full_results]
+    for rescored_result, full_result in zip(rescored.results, full_results):
+        # Patch scores are updated by differences of float32 terms, so may differ from a full sum in the last bits
+        assert float(rescored_result.calculated_value) == pytest.approx(float(full_result.calculated_value), rel=1e-6)
+    assert any(
+        float(mutant_result.calculated_value) != float(parent_result.calculated_value)
+        for mutant_result, parent_result in zip(full_results, parent.results)
+    )
+
+
+def test_run_tap_batch_writes_all_models(antibody_model, tmp_path):
+    outfile = tmp_path / "tap" / "results.csv"
+    results = run_tap_batch([str(antibody_model)] * 2, n_workers=2, outfile=str(outfile), sasa_engine="shrake_rupley")
+
+    assert len(results) == 10
+    assert len(outfile.read_text().splitlines()) == 11
+
+
+
+PATCH_SCORES = ("Hydrophobic Patch Score", "Negative Patch Score", "Positive Patch Score")
+
+
+@pytest.mark.parametrize("sasa_engine", ["psa", "shrake_rupley"])
+def test_contributions_sum_to_metrics(antibody_model, tmp_path, monkeypatch, sasa_engine):
+    tables = {}
+
+    def write_contribution_files(annotated_structure, contributions, prefix):
+        tables.update(contribution_tables(annotated_structure, contributions))
+        return outputs.write_contribution_files(annotated_structure, contributions, prefix)
+
+    monkeypatch.setattr(tap_main, "write_contribution_files", write_contribution_files)
+    prefix = tmp_path / "reference_antibody"
+    results = run_tap(str(antibody_model), None, quiet=True, sasa_engine=sasa_engine, contributions_prefix=str(prefix))
+    metrics = {result.metric_name: result.calculated_value for result in results}
+
+    for metric_name in PATCH_SCORES:
+        assert tables["residues"][metric_name].sum() == pytest.approx(metrics[metric_name], rel=1e-6)
+        assert tables["pairs"][metric_name].sum() == pytest.approx(metrics[metric_name], rel=1e-6)
+    assert tables["residues"]["SFvCSP"].sum() == pytest.approx(metrics["SFvCSP"], rel=1e-6)
+
+    # The files hold the same tables, with values rounded to 6 significant figures
+    residues = pd.read_csv(f"{prefix}_residues.csv")
+    pairs = pd.read_csv(f"{prefix}_pairs.csv")
+    for metric_name in PATCH_SCORES:
+        assert residues[metric_name].sum() == pytest.approx(metrics[metric_name], rel=1e-5)
+        assert pairs[metric_name].sum() == pytest.approx(metrics[metric_name], rel=1e-5)
+    assert residues["SFvCSP"].sum() == pytest.approx(metrics["SFvCSP"], rel=1e-5)